@@ -92,13 +92,19 @@ SMTP_PASSWORD = '***'
 
 
 # The maximum number of files a torrent can contain
-# until the site says "Too many files to display."
+# for the whole file list to be shown at once
 MAX_FILES_VIEW = 1000
+# Beyond that, the file list is loaded a directory at a time,
+# with pages of this many files and directories
+FILE_LIST_PAGE_SIZE = 200
 
 # Verify uploaded torrents have the given tracker in them?
 ENFORCE_MAIN_ANNOUNCE_URL = False
 MAIN_ANNOUNCE_URL = 'http://127.0.0.1:6881/announce'
 
+# How many tracker/webseed uris to keep the database ids of in memory, per process
+TRACKER_CACHE_SIZE = 10000
+
 # Tracker API integration - don't mind this
 TRACKER_API_URL = 'http://127.0.0.1:6881/api'
 TRACKER_API_AUTH = 'topsecret'
@@ -116,10 +122,29 @@ MAX_UPLOAD_BURST = 5
 UPLOAD_BURST_DURATION = 45 * 60
 UPLOAD_TIMEOUT = 15 * 60
 
+# Most torrents that can be uploaded in one request to /api/v2/upload/batch
+# Set to 0 to disable
+MAX_UPLOAD_BATCH_SIZE = 50
+
 # Torrents uploaded without an account must be at least this big in total (bytes)
 # Set to 0 to disable
 MINIMUM_ANONYMOUS_TORRENT_SIZE = 1 * 1024 * 1024
 
+# Uploaded .torrent files larger than this (bytes) are refused while they're being received
+# Set to 0 to disable
+MAX_TORRENT_FILE_SIZE = 32 * 1024 * 1024
+# Limits for decoding uploaded .torrent files, so a hostile one can't tie up a worker
+# Nesting depth of lists and dicts, amount of values in total, and length of a single
+# bytestring (the largest one is 'pieces', 20 bytes per piece). Set to 0 to disable
+MAX_TORRENT_DEPTH = 64
+MAX_TORRENT_ELEMENTS = 4 * 1000 * 1000
+MAX_TORRENT_STRING_LENGTH = 16 * 1024 * 1024
+# Limits for all the .torrent files of one request together (bytes, and values decoded),
+# so a batch upload can't make a worker decode MAX_UPLOAD_BATCH_SIZE torrents at the limits
+# above. Requests are refused (413) as soon as they go over. Set to 0 to disable
+MAX_UPLOAD_REQUEST_SIZE = 64 * 1024 * 1024
+MAX_UPLOAD_REQUEST_ELEMENTS = 8 * 1000 * 1000
+
 # Minimum age for an account not to be served a captcha (seconds)
 # Relies on USE_RECAPTCHA. Set to 0 to disable.
 ACCOUNT_RECAPTCHA_AGE = 7 * 24 * 3600  # A week
@@ -127,6 +152,31 @@ ACCOUNT_RECAPTCHA_AGE = 7 * 24 * 3600  # A week
 # Backup original .torrent uploads
 BACKUP_TORRENT_FOLDER = 'torrents'
 
+# Where to keep the info dicts of torrents, needed for .torrent downloads:
+# 'filesystem' uses a file per torrent in info_dicts/, 'pack' a few large files
+# in INFO_DICT_PACK_FOLDER. Move between them with manage_info_dicts.py migrate.
+INFO_DICT_STORAGE = 'filesystem'
+INFO_DICT_PACK_FOLDER = os.path.join(BASE_DIR, 'info_dicts_pack')
+
+# Compression of stored info dicts and backed up .torrent files, picked by their size:
+# a list of (minimum size in bytes, method, level) with method being 'zlib', 'lzma' or None,
+# for example [(0, None, 0), (4 * 1024, 'zlib', 6), (1024 * 1024, 'lzma', 6)].
+# Data that doesn't get smaller is stored as-is. None disables compression.
+# Existing info dicts can be (de)compressed with manage_info_dicts.py recompress.
+# Compressed backups are saved with an extra .nz extension and can be turned back into
+# .torrent files with manage_info_dicts.py decompress-backups.
+STORAGE_COMPRESSION = None
+# How many bytes of decompressed info dicts to keep in memory, per process
+INFO_DICT_CACHE_BYTES = 64 * 1024 * 1024
+
+# How many bytes of assembled .torrent files to keep in memory for downloads, per process,
+# and for how long (seconds) at most
+TORRENT_FILE_CACHE_BYTES = 64 * 1024 * 1024
+TORRENT_FILE_CACHE_TTL = 600
+# .torrent files with info dicts of at least this many bytes are not assembled in memory,
+# but streamed from the info dict storage (compressed info dicts are decompressed as they go)
+TORRENT_FILE_STREAM_SIZE = 1024 * 1024
+
 ############
 ## Search ##
 ############
@@ -134,16 +184,55 @@ BACKUP_TORRENT_FOLDER = 'torrents'
 # How many results should a page contain. Applies to RSS as well.
 RESULTS_PER_PAGE = 75
 
+# Take the totals of browsing pages from the browse counts tables instead of counting
+# torrents on every request. The counts are only kept up to date while this is on, so run
+# ./reconcile_browse_counts.py once after enabling it (the tables also start out empty
+# after migrating), and periodically (cron) to keep them exact.
+USE_BROWSE_COUNTS = False
+
+# Cache search and browse results: None to disable, 'memory' (per process),
+# 'memcached' (through pymemcache, see SEARCH_CACHE_SERVER) or 'local-memcached' (a stand-in).
+# Nothing invalidates cached results: uploads, edits and deletions only show up once they
+# expire, up to SEARCH_CACHE_TTL seconds later. Only enable this if that's acceptable.
+SEARCH_CACHE = None
+SEARCH_CACHE_TTL = 60
+# For 'memory', the most entries and total bytes (of JSON) kept per process
+SEARCH_CACHE_SIZE = 10000
+SEARCH_CACHE_BYTES = 64 * 1024 * 1024
+SEARCH_CACHE_SERVER = ('localhost', 11211)
+
+# Send metrics (such as search cache hits and misses) to this statsd server, if set
+STATSD_ADDRESS = None  # ('localhost', 8125)
+
 # Use better searching with ElasticSearch
 # See README.MD on setup!
 USE_ELASTIC_SEARCH = False
+# Also list torrents without a search term (front page, categories, user pages, RSS)
+# from ES, when the indices are kept updated by sync_es.py. While ES is unavailable,
+# browsing falls back to the database, for ES_BROWSE_RETRY_DELAY seconds at a time.
+# Page numbers past ES_MAX_SEARCH_RESULT results are always browsed from the database.
+USE_ELASTIC_BROWSE = False
+ES_BROWSE_RETRY_DELAY = 30
 # Highlight matches (for debugging)
 ENABLE_ELASTIC_SEARCH_HIGHLIGHT = False
+# Count the results per category and quality filter along with the search,
+# and show them as links to narrow it down. This adds two aggregations to every
+# Elasticsearch search, run over all the matching torrents rather than one page.
+ENABLE_ELASTIC_SEARCH_FACETS = False
 
-# Max ES search results, do not set over 10000
+# Max ES search results reachable by page number, do not set over 10000.
+# Past those, results are paged through with cursors (search_after), with no limit.
 ES_MAX_SEARCH_RESULT = 1000
 # ES index name generally (nyaa or sukebei)
 ES_INDEX_NAME = SITE_FLAVOR
+# ES nodes as "host:port" strings (localhost:9200 if empty). Connections are pooled,
+# at most ES_MAX_CONNECTIONS per node and process.
+ES_HOSTS = []
+ES_MAX_CONNECTIONS = 10
+# Timeout of a single ES request, and the total time ES requests may take
+# while handling one page (pages error out with 503 past it), in seconds
+ES_TIMEOUT = 10
+ES_REQUEST_BUDGET = 5
 
 ################
 ## Commenting ##
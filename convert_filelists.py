@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Converts torrent file lists stored as JSON (or in an older version of the binary
+format) into the current compact binary format (see nyaa/filelist.py). Rows that are
+already converted are skipped, so this can be stopped and run again at any time.
+"""
+import sys
+
+from nyaa import create_app, filelist, models
+from nyaa.extensions import db
+
+app = create_app('config')
+
+BATCH_SIZE = 1000
+
+
+def convert_filelists(filelist_class, batch_size=BATCH_SIZE):
+    table = filelist_class.__table__
+    converted = 0
+    last_id = 0
+
+    while True:
+        rows = db.session.execute(
+            db.select([table.c.torrent_id, table.c.filelist_blob])
+            .where(table.c.torrent_id > last_id)
+            .order_by(table.c.torrent_id)
+            .limit(batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1].torrent_id
+
+        updates = [{'_torrent_id': row.torrent_id,
+                    '_filelist_blob': filelist.encode(
+                        filelist.to_dict(filelist.decode(row.filelist_blob)))}
+                   for row in rows
+                   if row.filelist_blob and
+                   filelist.format_version(row.filelist_blob) != filelist.FORMAT_VERSION]
+        if updates:
+            db.session.execute(
+                table.update()
+                .where(table.c.torrent_id == db.bindparam('_torrent_id'))
+                .values(filelist_blob=db.bindparam('_filelist_blob')),
+                updates)
+            db.session.commit()
+            converted += len(updates)
+
+        print('{0}: converted {1} file lists (up to torrent {2})'.format(
+            table.name, converted, last_id))
+        sys.stdout.flush()
+
+    return converted
+
+
+if __name__ == '__main__':
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else BATCH_SIZE
+
+    with app.app_context():
+        for filelist_class in (models.NyaaTorrentFilelist, models.SukebeiTorrentFilelist):
+            convert_filelists(filelist_class, batch_size)
@@ -12,6 +12,7 @@ LINT_PATHS = [
     'utils/',
 ]
 TEST_PATHS = ['tests']
+BENCH_MODULE = 'tests.bench_bencode'
 
 
 def print_cmd(cmd, args):
@@ -53,6 +54,7 @@ def print_help():
     print('  fix  | autolint    : try and auto-fix lint (autopep8)')
     print('  isort              : fix import sorting (isort)')
     print('  test | pytest      : run tests (pytest)')
+    print('  bench | benchmark  : run bencode benchmarks (see `bench --help`)')
     print('  help | -h | --help : show this help and exit')
     print('')
     print('You may pass different arguments to the script that is being run.')
@@ -156,4 +158,15 @@ if __name__ == '__main__':
         finally:
             sys.exit(int(not result))
 
+    # Benchmarks - bencode and upload validation over synthetic torrents
+    if cmd in ('bench', 'benchmark'):
+        print_cmd(BENCH_MODULE, args)
+        try:
+            from importlib import import_module
+            bench = import_module(BENCH_MODULE)
+        except ImportError as err:
+            print('Unable to load module: {0!r}'.format(err))
+            sys.exit(1)
+        sys.exit(bench.main(args))
+
     sys.exit(print_help())
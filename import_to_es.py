@@ -10,15 +10,15 @@ import json
 
 # This should be progressbar33
 import progressbar
-from elasticsearch import Elasticsearch
 from elasticsearch.client import IndicesClient
 from elasticsearch import helpers
 
-from nyaa import create_app, models
+from nyaa import create_app, elastic, models
 from nyaa.extensions import db
 
 app = create_app('config')
-es = Elasticsearch(timeout=30)
+# Bulk requests take longer than searches
+es = elastic.create_client(app.config, timeout=30)
 ic = IndicesClient(es)
 
 # turn into thing that elasticsearch indexes. We flatten in
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Maintenance for the stored info dicts of torrents (see nyaa/info_dicts.py).
+
+  migrate SOURCE DEST  copy all info dicts between storages ('filesystem' or 'pack')
+  recompress           rewrite all info dicts with the current STORAGE_COMPRESSION
+  compact              reclaim the space of replaced and deleted info dicts in packs
+  verify               check that info dicts match their hashes and can make torrent files
+  decompress-backups   turn compressed backups in BACKUP_TORRENT_FOLDER back into .torrent files
+"""
+import argparse
+import os
+import sys
+
+from nyaa import bencode, compression, create_app, info_dicts, utils
+
+app = create_app('config')
+
+
+def migrate(source_storage, dest_storage, delete=False):
+    source = info_dicts.create_store(dict(app.config, INFO_DICT_STORAGE=source_storage))
+    dest = info_dicts.create_store(dict(app.config, INFO_DICT_STORAGE=dest_storage))
+
+    count = 0
+    for info_hash in source:
+        dest.put(info_hash, source.get(info_hash))
+        if delete:
+            source.delete(info_hash)
+        count += 1
+        if count % 10000 == 0:
+            print('Copied {} info dicts'.format(count))
+            sys.stdout.flush()
+
+    print('Copied {} info dicts from {} to {}'.format(count, source_storage, dest_storage))
+    if app.config.get('INFO_DICT_STORAGE', 'filesystem') != dest_storage:
+        print('Remember to set INFO_DICT_STORAGE = {!r} in config.py'.format(dest_storage))
+
+
+def recompress():
+    # Also decompresses everything if compression has been disabled
+    store = info_dicts.CompressedStore(
+        info_dicts.create_store(dict(app.config, STORAGE_COMPRESSION=None)),
+        app.config.get('STORAGE_COMPRESSION'))
+
+    count = 0
+    for info_hash in list(store):
+        store.put(info_hash, store.get(info_hash))
+        count += 1
+        if count % 10000 == 0:
+            print('Rewrote {} info dicts'.format(count))
+            sys.stdout.flush()
+
+    print('Rewrote {} info dicts'.format(count))
+    if app.config.get('INFO_DICT_STORAGE', 'filesystem') == 'pack':
+        print('Run compact to reclaim the space of the old copies')
+
+
+def compact(min_live_ratio):
+    store = info_dicts.create_store(dict(app.config, INFO_DICT_STORAGE='pack',
+                                         STORAGE_COMPRESSION=None))
+    segment_count, freed = store.compact(min_live_ratio)
+    print('Compacted {} segments, freeing {} bytes'.format(segment_count, freed))
+
+
+def verify():
+    store = info_dicts.create_store(app.config)
+
+    count = 0
+    bad_count = 0
+    for info_hash in store:
+        problem = _check_info_dict(info_hash, store.get(info_hash))
+        if problem:
+            print('{}: {}'.format(info_hash.hex(), problem))
+            bad_count += 1
+        count += 1
+        if count % 10000 == 0:
+            print('Checked {} info dicts'.format(count))
+            sys.stdout.flush()
+
+    print('Checked {} info dicts, {} with problems'.format(count, bad_count))
+    return bad_count
+
+
+def _check_info_dict(info_hash, data):
+    ''' Returns what's wrong with the stored info dict, if anything '''
+    if utils.sha1_hash(data) != info_hash:
+        return 'does not match its info hash'
+
+    # Only the keys looked at are decoded, and the pieces aren't copied out of the data
+    try:
+        info_dict = bencode.decode_lazy(data)
+        if not isinstance(info_dict, bencode.LazyDict):
+            return 'is not a dict'
+        for key in ('name', 'piece length', 'pieces'):
+            if key not in info_dict:
+                return 'has no {!r}'.format(key)
+        if len(info_dict['pieces']) % 20 != 0:
+            return 'has pieces of the wrong length'
+    except (bencode.BencodeException, UnicodeError) as e:
+        return 'is malformed ({})'.format(e)
+
+
+def decompress_backups(backup_dir):
+    count = 0
+    for file_name in sorted(os.listdir(backup_dir)):
+        if not file_name.endswith(compression.FILE_SUFFIX):
+            continue
+        path = os.path.join(backup_dir, file_name)
+        with open(path, 'rb') as in_file:
+            data = compression.decompress(in_file.read())
+
+        out_path = path[:-len(compression.FILE_SUFFIX)]
+        # Written aside first, so an interrupted run leaves the compressed backup in place
+        with open(out_path + '.tmp', 'wb') as out_file:
+            out_file.write(data)
+        os.replace(out_path + '.tmp', out_path)
+        os.remove(path)
+
+        count += 1
+        if count % 10000 == 0:
+            print('Decompressed {} backups'.format(count))
+            sys.stdout.flush()
+
+    print('Decompressed {} backups'.format(count))
+    if app.config.get('STORAGE_COMPRESSION'):
+        print('New backups are still compressed, unless STORAGE_COMPRESSION = None in config.py')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage stored torrent info dicts')
+    subparsers = parser.add_subparsers(dest='command')
+
+    migrate_parser = subparsers.add_parser('migrate', help='Copy info dicts between storages')
+    migrate_parser.add_argument('source', choices=['filesystem', 'pack'])
+    migrate_parser.add_argument('dest', choices=['filesystem', 'pack'])
+    migrate_parser.add_argument('--delete', default=False, action='store_true',
+                                help='Delete the info dicts from the source once copied')
+
+    subparsers.add_parser('recompress', help='Rewrite info dicts with the current compression')
+
+    compact_parser = subparsers.add_parser('compact', help='Compact the pack storage')
+    compact_parser.add_argument('--min-live-ratio', type=float, default=0.5,
+                                help='Rewrite segments with less than this ratio in use '
+                                     '(default: %(default)s)')
+
+    subparsers.add_parser('verify', help='Check the stored info dicts')
+
+    subparsers.add_parser('decompress-backups',
+                          help='Decompress the backed up .torrent files')
+
+    args = parser.parse_args()
+    if args.command == 'migrate':
+        if args.source == args.dest:
+            parser.error('source and dest are the same')
+        migrate(args.source, args.dest, args.delete)
+    elif args.command == 'recompress':
+        recompress()
+    elif args.command == 'compact':
+        compact(args.min_live_ratio)
+    elif args.command == 'verify':
+        sys.exit(1 if verify() else 0)
+    elif args.command == 'decompress-backups':
+        if not app.config.get('BACKUP_TORRENT_FOLDER'):
+            parser.error('BACKUP_TORRENT_FOLDER is not set')
+        decompress_backups(app.config['BACKUP_TORRENT_FOLDER'])
+    else:
+        parser.print_help()
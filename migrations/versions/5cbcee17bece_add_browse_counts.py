@@ -0,0 +1,35 @@
+"""Add browse counts tables.
+
+Revision ID: 5cbcee17bece
+Revises: b61e4f6a88cc
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5cbcee17bece'
+down_revision = 'b61e4f6a88cc'
+branch_labels = None
+depends_on = None
+
+TABLE_PREFIXES = ('nyaa', 'sukebei')
+
+
+def upgrade():
+    for prefix in TABLE_PREFIXES:
+        op.create_table(prefix + '_browse_counts',
+            sa.Column('main_category_id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('sub_category_id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('flags', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('count', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('main_category_id', 'sub_category_id', 'flags')
+        )
+    # Fill the tables with reconcile_browse_counts.py
+
+
+def downgrade():
+    for prefix in TABLE_PREFIXES:
+        op.drop_table(prefix + '_browse_counts')
@@ -5,8 +5,9 @@ import string
 import flask
 from flask_assets import Bundle  # noqa F401
 
+from nyaa import elastic
 from nyaa.api_handler import api_blueprint
-from nyaa.extensions import assets, db, fix_paginate, toolbar
+from nyaa.extensions import TorrentDecodingRequest, assets, db, fix_paginate, toolbar
 from nyaa.template_utils import bp as template_utils_bp
 from nyaa.utils import random_string
 from nyaa.views import register_views
@@ -17,6 +18,9 @@ def create_app(config):
     app = flask.Flask(__name__)
     app.config.from_object(config)
 
+    # Decode torrents sent to the upload endpoints while they're being received
+    app.request_class = TorrentDecodingRequest
+
     # Don't refresh cookie each request
     app.config['SESSION_REFRESH_EACH_REQUEST'] = False
 
@@ -79,6 +83,9 @@ def create_app(config):
     app.config['MYSQL_DATABASE_CHARSET'] = 'utf8mb4'
     db.init_app(app)
 
+    # Elasticsearch, with pooled connections shared by all requests
+    elastic.init_app(app)
+
     # Assets
     assets.init_app(app)
     # css = Bundle('style.scss', filters='libsass',
@@ -5,9 +5,12 @@ import re
 
 import flask
 
-from nyaa import backend, forms, models
+from nyaa import backend, conditional, filelist, forms, models
+from nyaa.extensions import db
 from nyaa.views.torrents import _create_upload_category_choices
 
+app = flask.current_app
+
 api_blueprint = flask.Blueprint('api', __name__, url_prefix='/api')
 
 # #################################### API HELPERS ####################################
@@ -68,15 +71,45 @@ UPLOAD_API_DEFAULTS = {
 }
 
 
+def _create_upload_form(torrent_file, request_data):
+    ''' Creates an UploadForm from a torrent file and a dict of API upload keys '''
+    mapped_dict = {
+        'torrent_file': torrent_file
+    }
+
+    # Map api keys to upload form fields
+    for key, default in UPLOAD_API_DEFAULTS.items():
+        mapped_key = UPLOAD_API_FORM_KEYMAP_REVERSE.get(key, key)
+        value = request_data.get(key, default)
+        mapped_dict[mapped_key] = value if value is not None else default
+
+    # Flask-WTF (very helpfully!!) automatically grabs the request form, so force a None formdata
+    upload_form = forms.UploadForm(None, data=mapped_dict, meta={'csrf': False})
+    upload_form.category.choices = _create_upload_category_choices()
+    return upload_form
+
+
+def _map_upload_errors(upload_form):
+    ''' Maps errors back from form fields into the api keys '''
+    return {UPLOAD_API_FORM_KEYMAP.get(k, k): v for k, v in upload_form.errors.items()}
+
+
+def _upload_response(torrent):
+    ''' Creates a response dict with relevant data of an uploaded torrent '''
+    return {
+        'url': flask.url_for('torrents.view', torrent_id=torrent.id, _external=True),
+        'id': torrent.id,
+        'name': torrent.display_name,
+        'hash': torrent.info_hash.hex(),
+        'magnet': torrent.magnet_uri
+    }
+
+
 @api_blueprint.route('/upload', methods=['POST'])
 @api_blueprint.route('/v2/upload', methods=['POST'])
 @basic_auth_user
 @api_require_user
 def v2_api_upload():
-    mapped_dict = {
-        'torrent_file': flask.request.files.get('torrent')
-    }
-
     request_data_field = flask.request.form.get('torrent_data')
     if request_data_field is None:
         return flask.jsonify({'errors': ['missing torrent_data field']}), 400
@@ -86,36 +119,94 @@ def v2_api_upload():
     except json.decoder.JSONDecodeError:
         return flask.jsonify({'errors': ['unable to parse valid JSON in torrent_data']}), 400
 
-    # Map api keys to upload form fields
-    for key, default in UPLOAD_API_DEFAULTS.items():
-        mapped_key = UPLOAD_API_FORM_KEYMAP_REVERSE.get(key, key)
-        value = request_data.get(key, default)
-        mapped_dict[mapped_key] = value if value is not None else default
-
-    # Flask-WTF (very helpfully!!) automatically grabs the request form, so force a None formdata
-    upload_form = forms.UploadForm(None, data=mapped_dict, meta={'csrf': False})
-    upload_form.category.choices = _create_upload_category_choices()
+    upload_form = _create_upload_form(flask.request.files.get('torrent'), request_data)
 
     if upload_form.validate():
         try:
             torrent = backend.handle_torrent_upload(upload_form, flask.g.user)
 
-            # Create a response dict with relevant data
-            torrent_metadata = {
-                'url': flask.url_for('torrents.view', torrent_id=torrent.id, _external=True),
-                'id': torrent.id,
-                'name': torrent.display_name,
-                'hash': torrent.info_hash.hex(),
-                'magnet': torrent.magnet_uri
-            }
-
-            return flask.jsonify(torrent_metadata)
+            return flask.jsonify(_upload_response(torrent))
         except backend.TorrentExtraValidationException:
             pass
 
-    # Map errors back from form fields into the api keys
-    mapped_errors = {UPLOAD_API_FORM_KEYMAP.get(k, k): v for k, v in upload_form.errors.items()}
-    return flask.jsonify({'errors': mapped_errors}), 400
+    return flask.jsonify({'errors': _map_upload_errors(upload_form)}), 400
+
+
+@api_blueprint.route('/v2/upload/batch', methods=['POST'])
+@basic_auth_user
+@api_require_user
+def v2_api_upload_batch():
+    ''' Uploads many torrents (all given as 'torrent' files) in one request and one
+        transaction. torrent_data is either a list of dicts, one for each torrent in the
+        same order, or a single dict used for all of them.
+        Every torrent is validated and stored on its own, so a bad one doesn't fail the
+        rest. The torrents are validated sequentially, as the checks are CPU-bound.
+        Their files are held to a shared budget while they're received, see
+        extensions.TorrentDecodingRequest.
+        Returns a list of results, which either have an 'errors' dict or the same data
+        as a single upload. '''
+    torrent_files = flask.request.files.getlist('torrent')
+    if not torrent_files:
+        return flask.jsonify({'errors': ['missing torrent files']}), 400
+
+    max_batch_size = app.config.get('MAX_UPLOAD_BATCH_SIZE')
+    if max_batch_size and len(torrent_files) > max_batch_size:
+        return flask.jsonify(
+            {'errors': ['at most {} torrents may be uploaded at once'.format(max_batch_size)]}), 400
+
+    request_data_field = flask.request.form.get('torrent_data')
+    if request_data_field is None:
+        return flask.jsonify({'errors': ['missing torrent_data field']}), 400
+
+    try:
+        request_data = json.loads(request_data_field)
+    except json.decoder.JSONDecodeError:
+        return flask.jsonify({'errors': ['unable to parse valid JSON in torrent_data']}), 400
+
+    if isinstance(request_data, dict):
+        request_data = [request_data] * len(torrent_files)
+    elif not isinstance(request_data, list) or len(request_data) != len(torrent_files):
+        return flask.jsonify(
+            {'errors': ['torrent_data must be an object or a list with one for each torrent']}), 400
+
+    results = []
+    uploads = []
+    for torrent_file, item_data in zip(torrent_files, request_data):
+        if not isinstance(item_data, dict):
+            results.append({'errors': {'torrent_data': ['not an object']}})
+            continue
+
+        upload_form = _create_upload_form(torrent_file, item_data)
+        if not upload_form.validate():
+            results.append({'errors': _map_upload_errors(upload_form)})
+            continue
+
+        # Store each torrent under a savepoint, to undo just that one if it fails.
+        # They're flushed one by one instead of bulk inserted, as the checks of the
+        # following torrents (duplicate info hashes, the upload ratelimit) query them.
+        savepoint = db.session.begin_nested()
+        try:
+            torrent = backend.handle_torrent_upload(upload_form, flask.g.user, commit=False)
+        except backend.TorrentExtraValidationException:
+            savepoint.rollback()
+            results.append({'errors': _map_upload_errors(upload_form)})
+            continue
+        savepoint.commit()
+
+        # Fill in the result after the final commit
+        result = {}
+        results.append(result)
+        uploads.append((result, torrent, upload_form))
+
+    db.session.commit()
+
+    # Only now that none of them can be rolled back anymore
+    for result, torrent, upload_form in uploads:
+        backend.store_info_dict(upload_form.torrent_file.parsed_data)
+        backend.backup_torrent_file(torrent, upload_form.torrent_file.data)
+        result.update(_upload_response(torrent))
+
+    return flask.jsonify({'results': results})
 
 
 # ####################################### INFO #######################################
@@ -152,6 +243,16 @@ def v2_api_info(torrent_id_or_hash):
     if torrent.deleted and not (viewer and viewer.is_superadmin):
         return flask.jsonify({'errors': ['Query was not a valid id or hash.']}), 400
 
+    # The submitter and deleted torrents depend on the viewer
+    stats = torrent.stats
+    etag = conditional.make_etag(
+        viewer.id, viewer.level, torrent.id, torrent.updated_time,
+        (stats.seed_count, stats.leech_count, stats.download_count))
+    last_modified = conditional.latest(torrent.updated_time, stats.last_updated)
+    not_modified = conditional.not_modified(etag, last_modified)
+    if not_modified:
+        return not_modified
+
     submitter = None
     if not torrent.anonymous and torrent.user:
         submitter = torrent.user.username
@@ -160,7 +261,7 @@ def v2_api_info(torrent_id_or_hash):
 
     files = {}
     if torrent.filelist:
-        files = json.loads(torrent.filelist.filelist_blob.decode('utf-8'))
+        files = filelist.to_dict(filelist.decode(torrent.filelist.filelist_blob))
 
     # Create a response dict with relevant data
     torrent_metadata = {
@@ -194,4 +295,5 @@ def v2_api_info(torrent_id_or_hash):
         'is_remake': torrent.remake
     }
 
-    return flask.jsonify(torrent_metadata), 200
+    response = flask.jsonify(torrent_metadata)
+    return conditional.add_validators(response, etag, last_modified)
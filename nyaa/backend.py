@@ -1,4 +1,3 @@
-import json
 import os
 from datetime import datetime, timedelta
 from ipaddress import ip_address
@@ -11,8 +10,8 @@ from werkzeug import secure_filename
 import sqlalchemy
 from orderedset import OrderedSet
 
-from nyaa import models, utils
-from nyaa.extensions import db
+from nyaa import compression, filelist, info_dicts, models, torrents, utils
+from nyaa.extensions import config, db
 
 app = flask.current_app
 
@@ -35,45 +34,13 @@ def get_category_id_map():
     return cat_id_map
 
 
-def _replace_utf8_values(dict_or_list):
-    ''' Will replace 'property' with 'property.utf-8' and remove latter if it exists.
-        Thanks, bitcomet! :/ '''
-    did_change = False
-    if isinstance(dict_or_list, dict):
-        for key in [key for key in dict_or_list.keys() if key.endswith('.utf-8')]:
-            dict_or_list[key.replace('.utf-8', '')] = dict_or_list.pop(key)
-            did_change = True
-        for value in dict_or_list.values():
-            did_change = _replace_utf8_values(value) or did_change
-    elif isinstance(dict_or_list, list):
-        for item in dict_or_list:
-            did_change = _replace_utf8_values(item) or did_change
-    return did_change
-
-
-def _recursive_dict_iterator(source):
-    ''' Iterates over a given dict, yielding (key, value) pairs,
-        recursing inside any dicts. '''
-    # TODO Make a proper dict-filetree walker
-    for key, value in source.items():
-        yield (key, value)
-
-        if isinstance(value, dict):
-            for kv in _recursive_dict_iterator(value):
-                yield kv
-
-
 def _validate_torrent_filenames(torrent):
     ''' Checks path parts of a torrent's filetree against blacklisted characters,
         returning False on rejection '''
-    # TODO Move to config.py
-    character_blacklist = [
-        '\u202E',  # RIGHT-TO-LEFT OVERRIDE
-    ]
-    file_tree = json.loads(torrent.filelist.filelist_blob.decode('utf-8'))
-
-    for path_part, value in _recursive_dict_iterator(file_tree):
-        if any(True for c in character_blacklist if c in path_part):
+    file_tree = filelist.decode(torrent.filelist.filelist_blob)
+
+    for path_part in filelist.iter_names(file_tree):
+        if any(True for c in torrents.FILENAME_CHARACTER_BLACKLIST if c in path_part):
             return False
 
     return True
@@ -91,7 +58,14 @@ def validate_torrent_post_upload(torrent, upload_form=None):
     if torrent.user is None and torrent.filesize < minimum_anonymous_torrent_size:
         errors['torrent_file'].append('Torrent too small for an anonymous uploader')
 
-    if not _validate_torrent_filenames(torrent):
+    # Filenames of fresh uploads have been checked while parsing them
+    torrent_data = upload_form.torrent_file.parsed_data if upload_form else None
+    if torrent_data is not None:
+        has_forbidden_filenames = torrent_data.has_forbidden_filenames
+    else:
+        has_forbidden_filenames = not _validate_torrent_filenames(torrent)
+
+    if has_forbidden_filenames:
         errors['torrent_file'].append('Torrent has forbidden characters in filenames')
 
     # Remove keys with empty lists
@@ -141,11 +115,14 @@ def check_uploader_ratelimit(user):
     return now, torrent_count, next_allowed_time
 
 
-def handle_torrent_upload(upload_form, uploading_user=None, fromAPI=False):
+def handle_torrent_upload(upload_form, uploading_user=None, fromAPI=False, commit=True):
     ''' Stores a torrent to the database.
         May throw TorrentExtraValidationException if the form/torrent fails
         post-WTForm validation! Exception messages will also be added to their
-        relevant fields on the given form. '''
+        relevant fields on the given form.
+        With commit=False the session is only flushed, so many uploads can share a
+        transaction. The caller must then commit, and call store_info_dict and
+        backup_torrent_file. '''
     torrent_data = upload_form.torrent_file.parsed_data
 
     # Anonymous uploaders and non-trusted uploaders
@@ -164,46 +141,37 @@ def handle_torrent_upload(upload_form, uploading_user=None, fromAPI=False):
     if torrent_data.db_id is not None:
         old_torrent = models.Torrent.by_id(torrent_data.db_id)
         db.session.delete(old_torrent)
-        db.session.commit()
-        # Delete physical file after transaction has been committed
-        _delete_info_dict(old_torrent)
-
-    # The torrent has been  validated and is safe to access with ['foo'] etc - all relevant
-    # keys and values have been checked for (see UploadForm in forms.py for details)
-    info_dict = torrent_data.torrent_dict['info']
+        if commit:
+            db.session.commit()
+            # Delete physical file after transaction has been committed
+            _delete_info_dict(old_torrent)
+        else:
+            # Same info hash, so the old info_dict is simply replaced below
+            db.session.flush()
 
-    changed_to_utf8 = _replace_utf8_values(torrent_data.torrent_dict)
+    # The torrent has been validated, normalized and parsed into torrent_data
+    # (see torrents.parse_torrent_metadata for details)
 
     # Use uploader-given name or grab it from the torrent
-    display_name = upload_form.display_name.data.strip() or info_dict['name'].decode('utf8').strip()
+    display_name = upload_form.display_name.data.strip() or torrent_data.name.strip()
     information = (upload_form.information.data or '').strip()
     description = (upload_form.description.data or '').strip()
 
-    torrent_filesize = info_dict.get('length') or sum(
-        f['length'] for f in info_dict.get('files'))
-
-    # In case no encoding, assume UTF-8.
-    torrent_encoding = torrent_data.torrent_dict.get('encoding', b'utf-8').decode('utf-8')
-
     torrent = models.Torrent(id=torrent_data.db_id,
                              info_hash=torrent_data.info_hash,
                              display_name=display_name,
                              torrent_name=torrent_data.filename,
                              information=information,
                              description=description,
-                             encoding=torrent_encoding,
-                             filesize=torrent_filesize,
+                             encoding=torrent_data.encoding,
+                             filesize=torrent_data.filesize,
                              user=uploading_user,
                              uploader_ip=ip_address(flask.request.remote_addr).packed)
 
-    # Store bencoded info_dict
-    info_dict_path = torrent.info_dict_path
-
-    info_dict_dir = os.path.dirname(info_dict_path)
-    os.makedirs(info_dict_dir, exist_ok=True)
-
-    with open(info_dict_path, 'wb') as out_file:
-        out_file.write(torrent_data.bencoded_info_dict)
+    # Store bencoded info_dict. Uploads sharing a transaction may still be rolled back,
+    # so their caller does this after committing.
+    if commit:
+        store_info_dict(torrent_data)
 
     torrent.stats = models.Statistic()
     torrent.has_torrent = True
@@ -224,108 +192,49 @@ def handle_torrent_upload(upload_form, uploading_user=None, fromAPI=False):
     torrent.main_category_id, torrent.sub_category_id = \
         upload_form.category.parsed_data.get_category_ids()
 
-    # To simplify parsing the filelist, turn single-file torrent into a list
-    torrent_filelist = info_dict.get('files')
-
-    used_path_encoding = changed_to_utf8 and 'utf-8' or torrent_encoding
-
-    parsed_file_tree = dict()
-    if not torrent_filelist:
-        # If single-file, the root will be the file-tree (no directory)
-        file_tree_root = parsed_file_tree
-        torrent_filelist = [{'length': torrent_filesize, 'path': [info_dict['name']]}]
-    else:
-        # If multi-file, use the directory name as root for files
-        file_tree_root = parsed_file_tree.setdefault(
-            info_dict['name'].decode(used_path_encoding), {})
-
-    # Parse file dicts into a tree
-    for file_dict in torrent_filelist:
-        # Decode path parts from utf8-bytes
-        path_parts = [path_part.decode(used_path_encoding) for path_part in file_dict['path']]
-
-        filename = path_parts.pop()
-        current_directory = file_tree_root
-
-        for directory in path_parts:
-            current_directory = current_directory.setdefault(directory, {})
-
-        # Don't add empty filenames (BitComet directory)
-        if filename:
-            current_directory[filename] = file_dict['length']
-
-    parsed_file_tree = utils.sorted_pathdict(parsed_file_tree)
-
-    json_bytes = json.dumps(parsed_file_tree, separators=(',', ':')).encode('utf8')
-    torrent.filelist = models.TorrentFilelist(filelist_blob=json_bytes)
+    filelist_blob = filelist.encode(torrent_data.file_tree)
+    torrent.filelist = models.TorrentFilelist(filelist_blob=filelist_blob)
 
     db.session.add(torrent)
     db.session.flush()
 
-    # Store the users trackers
-    trackers = OrderedSet()
-    announce = torrent_data.torrent_dict.get('announce', b'').decode('ascii')
-    if announce:
-        trackers.add(announce)
-
-    # List of lists with single item
-    announce_list = torrent_data.torrent_dict.get('announce-list', [])
-    for announce in announce_list:
-        trackers.add(announce[0].decode('ascii'))
-
-    # Store webseeds
-    # qBittorrent doesn't omit url-list but sets it as '' even when there are no webseeds
-    webseed_list = torrent_data.torrent_dict.get('url-list') or []
-    if isinstance(webseed_list, bytes):
-        webseed_list = [webseed_list]  # qB doesn't contain a sole url in a list
-    webseeds = OrderedSet(webseed.decode('utf-8') for webseed in webseed_list)
+    # Store the users trackers and webseeds
+    trackers = torrent_data.trackers
+    webseeds = torrent_data.webseeds
 
     # Remove our trackers, maybe? TODO ?
 
-    # Search for/Add trackers in DB
-    db_trackers = OrderedSet()
-    for announce in trackers:
-        tracker = models.Trackers.by_uri(announce)
+    # Search for/Add trackers in DB, and store tracker refs in order
+    tracker_ids = resolve_tracker_ids(trackers, webseeds)
+    if tracker_ids:
+        db.session.execute(models.TorrentTrackers.__table__.insert(), [
+            {'torrent_id': torrent.id, 'tracker_id': tracker_id, 'order': order}
+            for order, tracker_id in enumerate(tracker_ids)
+        ])
 
-        # Insert new tracker if not found
-        if not tracker:
-            tracker = models.Trackers(uri=announce)
-            db.session.add(tracker)
-            db.session.flush()
-        elif tracker.is_webseed:
-            # If we have an announce marked webseed (user error, malicy?), reset it.
-            # Better to have "bad" announces than "hiding" proper announces in webseeds/url-list.
-            tracker.is_webseed = False
-            db.session.flush()
+    # Before final commit, validate the torrent again
+    validate_torrent_post_upload(torrent, upload_form)
 
-        db_trackers.add(tracker)
+    if not commit:
+        db.session.flush()
+        return torrent
 
-    # Same for webseeds
-    for webseed_url in webseeds:
-        webseed = models.Trackers.by_uri(webseed_url)
+    db.session.commit()
 
-        if not webseed:
-            webseed = models.Trackers(uri=webseed_url, is_webseed=True)
-            db.session.add(webseed)
-            db.session.flush()
+    # Store the actual torrent file as well
+    backup_torrent_file(torrent, upload_form.torrent_file.data)
 
-        # Don't add trackers into webseeds
-        if webseed.is_webseed:
-            db_trackers.add(webseed)
+    return torrent
 
-    # Store tracker refs in DB
-    for order, tracker in enumerate(db_trackers):
-        torrent_tracker = models.TorrentTrackers(torrent_id=torrent.id,
-                                                 tracker_id=tracker.id, order=order)
-        db.session.add(torrent_tracker)
 
-    # Before final commit, validate the torrent again
-    validate_torrent_post_upload(torrent, upload_form)
+def store_info_dict(torrent_data):
+    ''' Stores the bencoded info dict of an uploaded torrent '''
+    info_dicts.get_store().put(torrent_data.info_hash, torrent_data.bencoded_info_dict)
 
-    db.session.commit()
 
-    # Store the actual torrent file as well
-    torrent_file = upload_form.torrent_file.data
+def backup_torrent_file(torrent, torrent_file):
+    ''' Saves an uploaded torrent file into BACKUP_TORRENT_FOLDER, if set, and closes it.
+        Done after the torrent has been committed. '''
     if app.config.get('BACKUP_TORRENT_FOLDER'):
         torrent_file.seek(0, 0)
 
@@ -334,10 +243,127 @@ def handle_torrent_upload(upload_form, uploading_user=None, fromAPI=False):
 
         torrent_path = os.path.join(torrent_dir, '{}.{}'.format(
             torrent.id, secure_filename(torrent_file.filename)))
-        torrent_file.save(torrent_path)
+
+        compression_levels = app.config.get('STORAGE_COMPRESSION')
+        if compression_levels:
+            data = torrent_file.read()
+            out_data = compression.compress_by_size(data, compression_levels)
+            if out_data is not data:
+                # Not a .torrent file anymore, see manage_info_dicts.py decompress-backups
+                torrent_path += compression.FILE_SUFFIX
+            with open(torrent_path, 'wb') as out_file:
+                out_file.write(out_data)
+        else:
+            torrent_file.save(torrent_path)
     torrent_file.close()
 
-    return torrent
+
+# uri -> (id, is_webseed) of trackers known to be committed to the database.
+# Like the tracker generation in torrents.py, this is kept per process: other workers
+# keep serving rows they have cached (say, a tracker since reset from being a webseed)
+# until they evict them or restart.
+_tracker_cache = utils.LRUCache(config.get('TRACKER_CACHE_SIZE', 10000))
+# Session info key for the uris of trackers inserted in the current transaction
+_NEW_TRACKER_URIS = 'nyaa_new_tracker_uris'
+
+
+@sqlalchemy.event.listens_for(db.session, 'after_transaction_end')
+def _forget_new_tracker_uris(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_NEW_TRACKER_URIS, None)
+
+
+def _select_trackers(uris, lock=False):
+    ''' Returns {uri: (id, is_webseed)} for the given uris found in the database.
+        With lock, the rows are read with a shared lock, which also sees rows committed
+        after the transaction's snapshot was taken. '''
+    Trackers = models.Trackers
+    query = db.session.query(Trackers.id, Trackers.uri, Trackers.is_webseed) \
+        .filter(Trackers.uri.in_(uris))
+    if lock:
+        query = query.with_for_update(read=True)
+    rows = query.all()
+
+    # The uri column is case-insensitive, so the stored uri may differ from the given one
+    exact_matches = {}
+    lower_matches = {}
+    for tracker_id, uri, is_webseed in rows:
+        exact_matches[uri] = lower_matches[uri.lower()] = (tracker_id, is_webseed)
+
+    found = {}
+    for uri in uris:
+        row = exact_matches.get(uri) or lower_matches.get(uri.lower())
+        if row:
+            found[uri] = row
+    return found
+
+
+def resolve_tracker_ids(trackers, webseeds=()):
+    ''' Finds or creates the database rows for the given tracker and webseed uris,
+        returning their ids in order (trackers first), without duplicates.
+        Rows are looked up from a cache, then with a single SELECT, and missing ones
+        are bulk inserted, ignoring rows inserted concurrently by another upload
+        (which are then read back with a locking SELECT).
+        Trackers marked as webseeds are reset, and webseeds that are trackers are left out,
+        same as when they were handled one by one. '''
+    Trackers = models.Trackers
+    tracker_uris = set(trackers)
+    all_uris = list(OrderedSet(list(trackers) + list(webseeds)))
+
+    resolved = {}
+    for uri in all_uris:
+        row = _tracker_cache.get(uri)
+        if row is not None:
+            resolved[uri] = row
+
+    missing_uris = [uri for uri in all_uris if uri not in resolved]
+    if missing_uris:
+        new_tracker_uris = db.session.info.setdefault(_NEW_TRACKER_URIS, set())
+        found = _select_trackers(missing_uris)
+
+        missing_uris = [uri for uri in missing_uris if uri not in found]
+        if missing_uris:
+            insert = Trackers.__table__.insert() \
+                .prefix_with('IGNORE', dialect='mysql') \
+                .prefix_with('OR IGNORE', dialect='sqlite')
+            db.session.execute(insert, [{'uri': uri, 'is_webseed': uri not in tracker_uris,
+                                         'disabled': False}
+                                        for uri in missing_uris])
+            new_tracker_uris.update(missing_uris)
+            # Rows skipped by the insert may have been committed by another upload after
+            # our snapshot was taken (under REPEATABLE READ), so a plain SELECT can miss them
+            found.update(_select_trackers(missing_uris, lock=True))
+
+        for uri, row in found.items():
+            # Rows of this transaction may still be rolled back, so don't cache them yet
+            if uri not in new_tracker_uris:
+                _tracker_cache[uri] = row
+        resolved.update(found)
+
+        for uri in all_uris:
+            if uri not in resolved:
+                # Collation rules beyond case, which the database knows better
+                tracker = Trackers.query.filter_by(uri=uri).with_for_update(read=True).one()
+                resolved[uri] = (tracker.id, tracker.is_webseed)
+
+    # If we have an announce marked webseed (user error, malicy?), reset it.
+    # Better to have "bad" announces than "hiding" proper announces in webseeds/url-list.
+    reset_ids = {resolved[uri][0] for uri in trackers if resolved[uri][1]}
+    if reset_ids:
+        db.session.query(Trackers).filter(Trackers.id.in_(reset_ids)) \
+            .update({'is_webseed': False}, synchronize_session='fetch')
+        for uri, (tracker_id, is_webseed) in list(resolved.items()):
+            if tracker_id in reset_ids:
+                resolved[uri] = (tracker_id, False)
+                # Not written into the cache, in case the update is rolled back
+                _tracker_cache.pop(uri)
+        # Torrents with these as webseeds will now get them as trackers
+        torrents.bump_tracker_generation()
+
+    tracker_ids = OrderedSet(resolved[uri][0] for uri in trackers)
+    # Don't add trackers into webseeds
+    tracker_ids.update(resolved[uri][0] for uri in webseeds if resolved[uri][1])
+    return list(tracker_ids)
 
 
 def tracker_api(info_hashes, method):
@@ -370,6 +396,4 @@ def tracker_api(info_hashes, method):
 
 
 def _delete_info_dict(torrent):
-    info_dict_path = torrent.info_dict_path
-    if os.path.exists(info_dict_path):
-        os.remove(info_dict_path)
+    info_dicts.get_store().delete(torrent.info_hash)
@@ -1,4 +1,7 @@
-from io import BytesIO
+import re
+import sys
+from collections import namedtuple
+from collections.abc import MutableMapping, Sequence
 
 
 def _pairwise(iterable):
@@ -8,7 +11,9 @@ def _pairwise(iterable):
     return zip(iterable, iterable)
 
 
-__all__ = ['encode', 'decode', 'BencodeException', 'MalformedBencodeException']
+__all__ = ['encode', 'encode_into', 'decode', 'decode_lazy', 'BencodeDecoder', 'CapturedValue',
+           'LazyDict', 'LazyList', 'BencodeException', 'MalformedBencodeException',
+           'BencodeLimitException']
 
 # https://wiki.theory.org/BitTorrentSpecification#Bencoding
 
@@ -21,6 +26,15 @@ class MalformedBencodeException(BencodeException):
     pass
 
 
+class BencodeLimitException(BencodeException):
+    """ Raised when decoded data goes over a limit given to the decoder,
+        which is named by limit ('max_size', 'max_depth', and so on) """
+
+    def __init__(self, message, limit=None):
+        super().__init__(message)
+        self.limit = limit
+
+
 # bencode types
 _DIGITS = b'0123456789'
 _B_INT = b'i'
@@ -31,137 +45,662 @@ _B_END = b'e'
 
 # Decoding of bencoded data
 
-def _bencode_decode(file_object, decode_keys_as_utf8=True):
-    """ Decodes a bencoded value, raising a MalformedBencodeException on errors.
-        decode_keys_as_utf8 controls decoding dict keys as utf8 (which they
-        almost always are) """
-    if isinstance(file_object, str):
-        file_object = file_object.encode('utf8')
-    if isinstance(file_object, bytes):
-        file_object = BytesIO(file_object)
-
-    def create_ex(msg):
-        return MalformedBencodeException(
-            '{0} at position {1} (0x{1:02X} hex)'.format(msg, file_object.tell()))
-
-    def _read_list():
-        """ Decodes values from stream until a None is returned ('e') """
-        items = []
-        while True:
-            value = _bencode_decode(file_object, decode_keys_as_utf8=decode_keys_as_utf8)
-            if value is None:
-                break
-            items.append(value)
-        return items
+_INT_RE = re.compile(br'(-?[0-9]*)e')
+_INT_PREFIX_RE = re.compile(br'-?[0-9]*')
+_STR_LEN_RE = re.compile(br'([0-9]+):')
+_STR_LEN_PREFIX_RE = re.compile(br'[0-9]*')
+
+# Byte values, as indexing bytes (or a 'B' memoryview) gives ints
+_ORD_INT = _B_INT[0]
+_ORD_LIST = _B_LIST[0]
+_ORD_DICT = _B_DICT[0]
+_ORD_END = _B_END[0]
+_ORD_ZERO = _DIGITS[0]
+_ORD_NINE = _DIGITS[-1]
+
+# Decoder states for the innermost open container
+_IN_LIST = object()
+_NO_KEY = object()
+# Stands in for lists and dicts when values aren't kept
+_SKIPPED = object()
+
+
+def _as_buffer(data):
+    """ Returns the given input as something that can be indexed by offset:
+        bytes are used as-is, other bytes-likes are wrapped in a memoryview
+        and file objects are read fully. """
+    if isinstance(data, str):
+        return data.encode('utf8')
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, (bytearray, memoryview)):
+        return memoryview(data).cast('B')
+    return _as_buffer(data.read())
+
+
+# Raw bytes of a value captured by BencodeDecoder, with its position in the stream.
+# canonical tells if it was encoded the way encode() would (sorted and unique dict keys,
+# no leading zeroes), ie. if encode(decode(raw)) == raw.
+CapturedValue = namedtuple('CapturedValue', 'raw start end canonical')
+
+
+class BencodeDecoder(object):
+    """ A resumable, push-style bencode decoder. Data is given with feed() as it
+        arrives and the decoded value is returned by close().
+        Malformed data raises a MalformedBencodeException from the feed() call that
+        contains it, so a bad upload can be rejected before it's been fully received.
+        Data after the first complete value is ignored, like with decode().
+
+        capture_keys may name keys of a top-level dict whose values are also kept
+        as raw bytes in .captured (as CapturedValues, keyed like the decoded dict).
+
+        The work done for untrusted data can be bounded with max_size (bytes of input),
+        max_depth (nested lists and dicts), max_elements (values of any kind, in total)
+        and max_string_length (bytes in a single bytestring). Going over one raises a
+        BencodeLimitException as soon as it is noticed, without waiting for more data.
+
+        With keep_values unset the data is only checked: nothing is built (close()
+        returns None) and captured values only get their positions, with a raw of None.
+        The data can then be decoded with decode_lazy() without holding it twice. """
+
+    def __init__(self, decode_keys_as_utf8=True, capture_keys=(), max_size=None,
+                 max_depth=None, max_elements=None, max_string_length=None, keep_values=True):
+        self.decode_keys_as_utf8 = decode_keys_as_utf8
+        self.keep_values = keep_values
+        self.capture_keys = frozenset(isinstance(key, str) and key.encode('utf8') or key
+                                      for key in capture_keys)
+        self.captured = {}
+
+        self.max_size = max_size
+        self.max_depth = max_depth
+        self.max_elements = max_elements
+        self.max_string_length = max_string_length
+        self._elements = 0
+
+        # Unparsed (or captured) data, the stream position of its first byte
+        # and the stream position parsed up to
+        self._buffer = bytearray()
+        self._buffer_start = 0
+        self._offset = 0
+
+        # The innermost open list/dict, its state (_IN_LIST for lists, _NO_KEY or
+        # the pending key for dicts) and last key. Outer ones are kept on the stack.
+        self._container = None
+        self._key = None
+        self._last_key = None
+        self._stack = []
+
+        # Stream position of the value being captured, if any
+        self._capture_start = None
+        self._canonical = True
+
+        self.done = False
+        self.value = None
+
+    @property
+    def position(self):
+        """ Amount of bytes fully parsed so far """
+        return self._offset
+
+    @property
+    def elements(self):
+        """ Amount of values decoded so far """
+        return self._elements
+
+    @property
+    def depth(self):
+        """ Amount of currently open lists and dicts """
+        return len(self._stack)
+
+    def feed(self, data):
+        """ Parses as much of the given data (and any left over from previous calls)
+            as possible. Returns True once a complete value has been decoded. """
+        if self.done:
+            return True
+
+        if self.max_size and self._buffer_start + len(self._buffer) + len(data) > self.max_size:
+            raise BencodeLimitException('Data is larger than {} bytes'.format(self.max_size),
+                                        'max_size')
+
+        self._buffer += data
+        with memoryview(self._buffer) as view:
+            self._parse(view, self._buffer_start, final=False)
+
+        # Drop parsed data, unless it's being captured
+        keep_from = self._offset
+        if self._capture_start is not None and self.keep_values:
+            keep_from = self._capture_start
+        del self._buffer[:keep_from - self._buffer_start]
+        self._buffer_start = keep_from
+        return self.done
+
+    def close(self):
+        """ Returns the decoded value, raising a MalformedBencodeException
+            if the data ended before a complete value. """
+        if not self.done:
+            with memoryview(self._buffer) as view:
+                self._parse(view, self._buffer_start, final=True)
+        self._buffer = bytearray()
+        return self.value
+
+    def _parse(self, data, base, final):
+        """ Decodes tokens from data (which starts at stream position base) until
+            a complete value has been decoded, or the data runs out mid-token.
+            If final is set, running out of data is an error. """
+        data_len = len(data)
+        # Slicing a memoryview does not copy, so copy the final slice into bytes
+        copy_slices = isinstance(data, memoryview)
+        decode_keys_as_utf8 = self.decode_keys_as_utf8
+        capture_keys = self.capture_keys
+        keep_values = self.keep_values
+
+        match_int = _INT_RE.match
+        match_str_len = _STR_LEN_RE.match
+
+        def create_ex(msg, position, limit=None):
+            message = '{0} at position {1} (0x{1:02X} hex)'.format(msg, base + position)
+            if limit:
+                return BencodeLimitException(message, limit)
+            return MalformedBencodeException(message)
+
+        # Unset limits are checked against the largest possible values
+        max_depth = self.max_depth or sys.maxsize
+        max_elements = self.max_elements or sys.maxsize
+        max_string_length = self.max_string_length or sys.maxsize
+        elements = self._elements
+
+        container = self._container
+        key = self._key
+        last_key = self._last_key
+        stack = self._stack
+        capture_start = self._capture_start
+        canonical = self._canonical
+        if capture_start is not None:
+            capture_start -= base
+        pos = self._offset - base
 
-    kind = file_object.read(1)
-    if not kind:
-        raise create_ex('EOF, expecting kind')
-
-    if kind == _B_INT:  # Integer
-        int_bytes = b''
         while True:
-            c = file_object.read(1)
-            if not c:
-                raise create_ex('EOF, expecting more integer')
-            elif c == _B_END:
-                try:
-                    return int(int_bytes.decode('utf8'))
-                except Exception as e:
-                    raise create_ex('Unable to parse int')
-
-            # not a digit OR '-' in the middle of the int
-            if (c not in _DIGITS + b'-') or (c == b'-' and int_bytes):
-                raise create_ex('Unexpected input while reading an integer: ' + repr(c))
+            # Start of the current token, to resume from if it's incomplete
+            token_pos = pos
+
+            if pos >= data_len:
+                if not final:
+                    break
+                raise create_ex('EOF, expecting kind', data_len)
+
+            kind = data[pos]
+
+            if _ORD_ZERO <= kind <= _ORD_NINE:  # Bytestring
+                match = match_str_len(data, pos)
+                if match is None:
+                    # Find where the length went wrong
+                    bad_pos = _STR_LEN_PREFIX_RE.match(data, pos).end()
+                    if bad_pos >= data_len:
+                        if not final:
+                            break
+                        raise create_ex('EOF, expecting more string len', data_len)
+                    raise create_ex('Unexpected input while reading string length: ' +
+                                    repr(bytes(data[bad_pos:bad_pos + 1])), bad_pos + 1)
+                pos = match.end()
+                length = int(match.group(1))
+                if length > max_string_length:
+                    raise create_ex('Bytestring longer than {} bytes'.format(max_string_length),
+                                    token_pos, 'max_string_length')
+                end = pos + length
+                if end > data_len:
+                    if not final:
+                        pos = token_pos
+                        break
+                    raise create_ex('Read only {} bytes, {} wanted'.format(data_len - pos,
+                                                                           end - pos),
+                                    data_len)
+                if capture_start is not None and kind == _ORD_ZERO and pos - token_pos > 2:
+                    canonical = False  # Leading zero in length
+                if keep_values or key is _NO_KEY:  # Keys are needed regardless
+                    value = bytes(data[pos:end]) if copy_slices else data[pos:end]
+                else:
+                    value = None
+                pos = end
+
+            elif kind == _ORD_INT:  # Integer
+                match = match_int(data, pos + 1)
+                if match is None:
+                    bad_pos = _INT_PREFIX_RE.match(data, pos + 1).end()
+                    if bad_pos >= data_len:
+                        if not final:
+                            break
+                        raise create_ex('EOF, expecting more integer', data_len)
+                    raise create_ex('Unexpected input while reading an integer: ' +
+                                    repr(bytes(data[bad_pos:bad_pos + 1])), bad_pos + 1)
+                pos = match.end()
+                int_bytes = match.group(1)
+                if not int_bytes or int_bytes == b'-':
+                    raise create_ex('Unable to parse int', pos)
+                value = int(int_bytes)
+                if capture_start is not None and len(int_bytes) > 1 and \
+                        (int_bytes[0] == _ORD_ZERO or int_bytes.startswith(b'-0')):
+                    canonical = False  # Leading zero or negative zero
+
+            elif kind == _ORD_LIST:  # List
+                stack.append((container, key, last_key))
+                if len(stack) > max_depth:
+                    raise create_ex('Nested deeper than {} levels'.format(max_depth), pos,
+                                    'max_depth')
+                container = [] if keep_values else _SKIPPED
+                key = _IN_LIST
+                pos += 1
+                continue
+
+            elif kind == _ORD_DICT:  # Dictionary
+                stack.append((container, key, last_key))
+                if len(stack) > max_depth:
+                    raise create_ex('Nested deeper than {} levels'.format(max_depth), pos,
+                                    'max_depth')
+                container = {} if keep_values else _SKIPPED
+                key = _NO_KEY
+                last_key = None
+                pos += 1
+                continue
+
+            elif kind == _ORD_END and container is not None:  # List/dict end, but not top level
+                if key is not _IN_LIST and key is not _NO_KEY:
+                    raise MalformedBencodeException('Uneven amount of key/value pairs')
+                value = container
+                container, key, last_key = stack.pop()
+                pos += 1
+
+            else:
+                raise create_ex('Unexpected data type ({})'.format(repr(bytes([kind]))), pos + 1)
+
+            elements += 1
+            if elements > max_elements:
+                raise create_ex('More than {} values'.format(max_elements), pos,
+                                'max_elements')
+
+            # Place the finished value into the innermost container, if any
+            if key is _IN_LIST:
+                if keep_values:
+                    container.append(value)
+            elif key is _NO_KEY:
+                key = value
+                # Start capturing if this is a wanted key of the top-level dict
+                if capture_keys and len(stack) == 1 and key in capture_keys:
+                    capture_start = pos
+                    canonical = True
+            elif container is None:
+                self.done = True
+                self.value = value if keep_values else None
+                break
             else:
-                int_bytes += c
+                if not isinstance(key, bytes):
+                    raise create_ex('Dictionary key is not a bytestring', pos)
+                # "Technically" the bencode dictionary keys are bytestrings,
+                # but real-world they're always(?) UTF-8.
+                decoded_key = key.decode('utf8') if decode_keys_as_utf8 else key
+                if keep_values:
+                    container[decoded_key] = value
+
+                if capture_start is None:
+                    pass
+                elif len(stack) == 1:
+                    # The captured value of the top-level dict is complete
+                    self.captured[decoded_key] = CapturedValue(
+                        bytes(data[capture_start:pos]) if keep_values else None,
+                        base + capture_start, base + pos, canonical)
+                    capture_start = None
+                else:
+                    if last_key is not None and key <= last_key:
+                        canonical = False  # Unsorted or duplicate keys
+                    last_key = key
+                key = _NO_KEY
+
+        self._container = container
+        self._key = key
+        self._last_key = last_key
+        self._capture_start = capture_start if capture_start is None else base + capture_start
+        self._canonical = canonical
+        self._elements = elements
+        self._offset = base + pos
+
+
+def _bencode_decode(data, decode_keys_as_utf8=True, **limits):
+    """ Decodes a bencoded value, raising a MalformedBencodeException on errors.
+        decode_keys_as_utf8 controls decoding dict keys as utf8 (which they
+        almost always are). Limits may be given like for BencodeDecoder.
+        The input is walked by offset with an explicit stack instead of recursion,
+        so strings are sliced straight out of it and nesting depth is not bound
+        by the interpreter's recursion limit. """
+    decoder = BencodeDecoder(decode_keys_as_utf8=decode_keys_as_utf8, **limits)
+    data = _as_buffer(data)
+    if decoder.max_size and len(data) > decoder.max_size:
+        raise BencodeLimitException('Data is larger than {} bytes'.format(decoder.max_size),
+                                    'max_size')
+    decoder._parse(data, 0, final=True)
+    return decoder.value
+
+
+# Lazy decoding
+
+def _create_ex(msg, position):
+    return MalformedBencodeException(
+        '{0} at position {1} (0x{1:02X} hex)'.format(msg, position))
+
+
+def _read_str_span(data, pos):
+    """ Returns the (start, end) span of the contents of the bytestring at pos """
+    match = _STR_LEN_RE.match(data, pos)
+    if match is None:
+        bad_pos = _STR_LEN_PREFIX_RE.match(data, pos).end()
+        if bad_pos >= len(data):
+            raise _create_ex('EOF, expecting more string len', len(data))
+        raise _create_ex('Unexpected input while reading string length: ' +
+                         repr(bytes(data[bad_pos:bad_pos + 1])), bad_pos + 1)
+    start = match.end()
+    end = start + int(match.group(1))
+    if end > len(data):
+        raise _create_ex('Read only {} bytes, {} wanted'.format(len(data) - start, end - start),
+                         len(data))
+    return start, end
+
+
+def _read_int(data, pos):
+    """ Returns the value and end position of the integer at pos """
+    match = _INT_RE.match(data, pos + 1)
+    if match is None:
+        bad_pos = _INT_PREFIX_RE.match(data, pos + 1).end()
+        if bad_pos >= len(data):
+            raise _create_ex('EOF, expecting more integer', len(data))
+        raise _create_ex('Unexpected input while reading an integer: ' +
+                         repr(bytes(data[bad_pos:bad_pos + 1])), bad_pos + 1)
+    int_bytes = match.group(1)
+    if not int_bytes or int_bytes == b'-':
+        raise _create_ex('Unable to parse int', match.end())
+    return int(int_bytes), match.end()
+
+
+def _skip_value(data, pos, ends, min_size):
+    """ Returns the end position of the value at pos, checking its tokens
+        without decoding anything. The spans of lists and dicts of at least
+        min_size bytes are recorded in ends ({start: end}) and reused from there,
+        so large nested values are only scanned once. """
+    match_int = _INT_RE.match
+    match_str_len = _STR_LEN_RE.match
+    data_len = len(data)
+    starts = []
+
+    while True:
+        if pos >= data_len:
+            raise _create_ex('EOF, expecting kind', data_len)
+
+        kind = data[pos]
+        if _ORD_ZERO <= kind <= _ORD_NINE:
+            match = match_str_len(data, pos)
+            end = match and match.end() + int(match.group(1))
+            if not match or end > data_len:
+                _read_str_span(data, pos)  # Raises the proper error
+            pos = end
+        elif kind == _ORD_INT:
+            match = match_int(data, pos + 1)
+            if not match or len(match.group(1).lstrip(b'-')) == 0:
+                _read_int(data, pos)  # Raises the proper error
+            pos = match.end()
+        elif kind == _ORD_LIST or kind == _ORD_DICT:
+            end = ends.get(pos)
+            if end is None:
+                starts.append(pos)
+                pos += 1
+                continue
+            pos = end
+        elif kind == _ORD_END and starts:
+            pos += 1
+            start = starts.pop()
+            if pos - start >= min_size:
+                ends[start] = pos
+        else:
+            raise _create_ex('Unexpected data type ({})'.format(repr(bytes([kind]))), pos + 1)
+
+        if not starts:
+            return pos
+
+
+class _LazyValue(object):
+    """ Base for lazily decoded lists and dicts, which only record where their
+        items are in the data and decode (and cache) them when accessed. """
+
+    def __init__(self, data, start, decode_keys_as_utf8, view_threshold, ends):
+        self._data = data
+        self._decode_keys_as_utf8 = decode_keys_as_utf8
+        self._view_threshold = view_threshold
+        self._ends = ends
+        self.start = start
+        self.end = None
+
+    @property
+    def raw(self):
+        """ The bencoded list/dict as it was in the data, as a memoryview (not a copy) """
+        return self._data[self.start:self.end]
+
+    def _decode_item(self, pos):
+        data = self._data
+        kind = data[pos]
+
+        if _ORD_ZERO <= kind <= _ORD_NINE:
+            start, end = _read_str_span(data, pos)
+            if end - start >= self._view_threshold:
+                return data[start:end]
+            return bytes(data[start:end])
+        elif kind == _ORD_INT:
+            return _read_int(data, pos)[0]
+
+        end = _skip_value(data, pos, self._ends, self._view_threshold)
+        if end - pos < self._view_threshold:
+            # Small lists and dicts aren't worth keeping track of, decode them as usual
+            return _bencode_decode(data[pos:end], decode_keys_as_utf8=self._decode_keys_as_utf8)
+        lazy_class = LazyList if kind == _ORD_LIST else LazyDict
+        return lazy_class(data, pos, self._decode_keys_as_utf8, self._view_threshold, self._ends)
+
+
+class LazyList(_LazyValue, Sequence):
+    """ A bencoded list, with items decoded on first access """
+
+    def __init__(self, data, start, decode_keys_as_utf8=True, view_threshold=1024, ends=None):
+        super().__init__(data, start, decode_keys_as_utf8, view_threshold,
+                         {} if ends is None else ends)
+
+        self._spans = []
+        self._items = {}
+
+        pos = start + 1
+        while pos >= len(data) or data[pos] != _ORD_END:
+            self._spans.append(pos)
+            pos = _skip_value(data, pos, self._ends, view_threshold)
+        self.end = pos + 1
+
+    def __len__(self):
+        return len(self._spans)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        item_pos = self._spans[index]
+        try:
+            return self._items[item_pos]
+        except KeyError:
+            item = self._items[item_pos] = self._decode_item(item_pos)
+            return item
 
-    elif kind == _B_LIST:  # List
-        return _read_list()
+    def __eq__(self, other):
+        if isinstance(other, (list, LazyList)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
 
-    elif kind == _B_DICT:  # Dictionary
-        keys_and_values = _read_list()
-        if len(keys_and_values) % 2 != 0:
-            raise MalformedBencodeException('Uneven amount of key/value pairs')
+    def __repr__(self):
+        return '<LazyList of {} items>'.format(len(self))
 
-        # "Technically" the bencode dictionary keys are bytestrings,
-        # but real-world they're always(?) UTF-8.
-        decoded_dict = dict((decode_keys_as_utf8 and k.decode('utf8') or k, v)
-                            for k, v in _pairwise(keys_and_values))
-        return decoded_dict
 
-    # List/dict end, but make sure input is not just 'e'
-    elif kind == _B_END and file_object.tell() > 0:
-        return None
+class LazyDict(_LazyValue, MutableMapping):
+    """ A bencoded dict, with values decoded on first access.
+        Can be modified like a regular dict. """
 
-    elif kind in _DIGITS:  # Bytestring
-        str_len_bytes = kind  # keep first digit
-        # Read string length until a ':'
-        while True:
-            c = file_object.read(1)
-            if not c:
-                raise create_ex('EOF, expecting more string len')
-            if c in _DIGITS:
-                str_len_bytes += c
-            elif c == b':':
-                break
-            else:
-                raise create_ex('Unexpected input while reading string length: ' + repr(c))
-        try:
-            str_len = int(str_len_bytes.decode())
-        except Exception as e:
-            raise create_ex('Unable to parse bytestring length')
+    def __init__(self, data, start, decode_keys_as_utf8=True, view_threshold=1024, ends=None):
+        super().__init__(data, start, decode_keys_as_utf8, view_threshold,
+                         {} if ends is None else ends)
 
-        bytestring = file_object.read(str_len)
-        if len(bytestring) != str_len:
-            raise create_ex('Read only {} bytes, {} wanted'.format(len(bytestring), str_len))
+        # Key to value position, or None for values set after decoding
+        self._spans = {}
+        self._values = {}
 
-        return bytestring
-    else:
-        raise create_ex('Unexpected data type ({})'.format(repr(kind)))
+        pos = start + 1
+        while pos >= len(data) or data[pos] != _ORD_END:
+            if pos >= len(data):
+                raise _create_ex('EOF, expecting kind', len(data))
+            if not _ORD_ZERO <= data[pos] <= _ORD_NINE:
+                if data[pos] in b'ild':
+                    raise MalformedBencodeException('Dictionary key is not a bytestring')
+                raise _create_ex('Unexpected data type ({})'.format(
+                    repr(bytes(data[pos:pos + 1]))), pos + 1)
 
+            key_start, key_end = _read_str_span(data, pos)
+            if key_end >= len(data) or data[key_end] == _ORD_END:
+                raise MalformedBencodeException('Uneven amount of key/value pairs')
 
-# Bencoding
+            key = bytes(data[key_start:key_end])
+            if decode_keys_as_utf8:
+                key = key.decode('utf8')
 
-def _bencode_int(value):
-    """ Encode an integer, eg 64 -> i64e """
-    return _B_INT + str(value).encode('utf8') + _B_END
+            self._spans[key] = key_end
+            pos = _skip_value(data, key_end, self._ends, view_threshold)
+        self.end = pos + 1
 
+    def __len__(self):
+        return len(self._spans)
 
-def _bencode_bytes(value):
-    """ Encode a bytestring (strings as UTF-8), eg 'hello' -> 5:hello """
-    if isinstance(value, str):
-        value = value.encode('utf8')
-    return str(len(value)).encode('utf8') + b':' + value
+    def __iter__(self):
+        return iter(self._spans)
 
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            value = self._values[key] = self._decode_item(self._spans[key])
+            return value
+
+    def __setitem__(self, key, value):
+        self._spans[key] = None
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        del self._spans[key]
+        self._values.pop(key, None)
+
+    def __repr__(self):
+        return '<LazyDict with keys {!r}>'.format(list(self._spans))
+
+
+def _bencode_decode_lazy(data, decode_keys_as_utf8=True, view_threshold=1024):
+    """ Decodes a bencoded value lazily: lists and dicts are returned as LazyLists
+        and LazyDicts, which decode their items only when accessed (nested ones
+        smaller than view_threshold bytes are decoded as usual at that point).
+        Bytestrings of at least view_threshold bytes are returned as memoryview
+        slices of the data instead of copies, so the data must not be modified.
+        Only the structure of the data is checked beforehand and no limits are
+        applied: untrusted data should be checked with a BencodeDecoder first. """
+    data = _as_buffer(data)
+    if not isinstance(data, memoryview):
+        data = memoryview(data)
+    if not len(data):
+        raise _create_ex('EOF, expecting kind', 0)
+
+    kind = data[0]
+    if kind == _ORD_LIST:
+        return LazyList(data, 0, decode_keys_as_utf8, view_threshold)
+    elif kind == _ORD_DICT:
+        return LazyDict(data, 0, decode_keys_as_utf8, view_threshold)
+    return _bencode_decode(data, decode_keys_as_utf8=decode_keys_as_utf8)
 
-def _bencode_list(value):
-    """ Encode a list, eg [64, "hello"] -> li64e5:helloe """
-    return _B_LIST + b''.join(_bencode(item) for item in value) + _B_END
 
+# Bencoding
 
-def _bencode_dict(value):
-    """ Encode a dict, which is keys and values interleaved as a list,
-        eg {"hello":123}-> d5:helloi123ee """
-    dict_keys = sorted(value.keys())  # Sort keys as per spec
-    return _B_DICT + b''.join(
-        _bencode_bytes(key) + _bencode(value[key]) for key in dict_keys) + _B_END
+def _bencode_dict_items(value):
+    """ Returns the keys and values of a dict interleaved, keys sorted as per spec """
+    items = []
+    for key in sorted(value.keys()):
+        if not isinstance(key, (str, bytes)):
+            raise BencodeException('Dictionary key is not a bytestring: ' + repr(key))
+        items += (key, value[key])
+    return iter(items)
+
+
+def _bencode_into(value, out):
+    """ Bencode any supported value (int, bytes, str, list, dict, or the lazy variants
+        from decode_lazy) into out, which is either a bytearray to append to or
+        a file-like object with a write() method.
+        Nested values are walked with an explicit stack instead of recursion, and
+        every token is written straight to out without building intermediate
+        byte strings. Returns the amount of bytes written. """
+    if not isinstance(out, bytearray):
+        # Collect into a buffer and flush it to the file in large writes
+        buffer = bytearray()
+        written = 0
+        for _ in _bencode_chunks(value, buffer):
+            out.write(buffer)
+            written += len(buffer)
+            del buffer[:]
+        out.write(buffer)
+        return written + len(buffer)
+
+    start = len(out)
+    for _ in _bencode_chunks(value, out, flush_size=None):
+        pass
+    return len(out) - start
+
+
+def _bencode_chunks(value, out, flush_size=64 * 1024):
+    """ Appends value bencoded to the bytearray out, yielding whenever a bytestring
+        brings out past flush_size bytes so the caller may flush and clear it. """
+    stack = []
+    items = iter((value,))
+    while True:
+        for item in items:
+            if isinstance(item, (bytes, str, memoryview)):
+                if isinstance(item, str):
+                    item = item.encode('utf8')
+                out += b'%d:' % len(item)
+                out += item
+                if flush_size is not None and len(out) >= flush_size:
+                    yield
+            elif isinstance(item, int):
+                out += b'i%de' % item
+            elif isinstance(item, (list, LazyList)):
+                out += _B_LIST
+                stack.append(items)
+                items = iter(item)
+                break
+            elif isinstance(item, (dict, LazyDict)):
+                out += _B_DICT
+                stack.append(items)
+                items = _bencode_dict_items(item)
+                break
+            else:
+                raise BencodeException('Unsupported type ' + str(type(item)))
+        else:
+            # Current list/dict exhausted
+            if not stack:
+                return
+            out += _B_END
+            items = stack.pop()
 
 
 def _bencode(value):
     """ Bencode any supported value (int, bytes, str, list, dict) """
-    if isinstance(value, int):
-        return _bencode_int(value)
-    elif isinstance(value, (str, bytes)):
-        return _bencode_bytes(value)
-    elif isinstance(value, list):
-        return _bencode_list(value)
-    elif isinstance(value, dict):
-        return _bencode_dict(value)
-
-    raise BencodeException('Unsupported type ' + str(type(value)))
+    out = bytearray()
+    _bencode_into(value, out)
+    return bytes(out)
 
 
 # The functions call themselves
 encode = _bencode
+encode_into = _bencode_into
 decode = _bencode_decode
+decode_lazy = _bencode_decode_lazy
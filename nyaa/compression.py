@@ -0,0 +1,129 @@
+""" Optional compression of stored data (info dicts and backed up .torrent files).
+
+    Compressed data starts with a header naming the method and the original size,
+    so readers can tell it apart from uncompressed data, which is bencoded and so
+    never starts with a null byte.
+"""
+import itertools
+import lzma
+import struct
+import zlib
+
+__all__ = ['compress', 'compress_by_size', 'decompress', 'decompress_chunks', 'decompressed_size',
+           'is_compressed', 'CompressionException']
+
+MAGIC = b'\x00NZ'
+_HEADER = struct.Struct('<3sBQ')
+HEADER_SIZE = _HEADER.size
+# Appended to the names of compressed files, which aren't usable as they are
+FILE_SUFFIX = '.nz'
+
+_METHODS = {'zlib': 1, 'lzma': 2}
+
+
+class CompressionException(Exception):
+    pass
+
+
+def is_compressed(data):
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def compress(data, method, level):
+    ''' Compresses data with method ('zlib' or 'lzma') at the given level (or preset) '''
+    if method == 'zlib':
+        payload = zlib.compress(data, level)
+    elif method == 'lzma':
+        payload = lzma.compress(data, preset=level)
+    else:
+        raise ValueError('Unknown compression method {!r}'.format(method))
+    return _HEADER.pack(MAGIC, _METHODS[method], len(data)) + payload
+
+
+def compress_by_size(data, levels):
+    ''' Compresses data as set in levels, a list of (minimum size, method, level):
+        the entry with the largest minimum size that data reaches is used.
+        Data is returned as-is for a method of None, or when compression doesn't pay off. '''
+    method, level = None, 0
+    for min_size, size_method, size_level in sorted(levels or (), key=lambda entry: entry[0]):
+        if len(data) >= min_size:
+            method, level = size_method, size_level
+
+    if method is None:
+        return data
+    compressed = compress(data, method, level)
+    return compressed if len(compressed) < len(data) else data
+
+
+def decompressed_size(header):
+    ''' Returns the original size of compressed data from its first bytes (at least
+        HEADER_SIZE of them), or None if the data is not compressed '''
+    if not is_compressed(header):
+        return None
+    if len(header) < _HEADER.size:
+        raise CompressionException('Compressed data is truncated')
+    return _HEADER.unpack_from(header)[2]
+
+
+def _decompressor(method):
+    if method == _METHODS['zlib']:
+        return zlib.decompressobj()
+    elif method == _METHODS['lzma']:
+        return lzma.LZMADecompressor()
+    raise CompressionException('Unknown compression method {}'.format(method))
+
+
+def decompress_chunks(chunks):
+    ''' Like decompress, for data given as an iterable of chunks: yields the original data
+        in chunks as it's decompressed, without holding all of it in memory '''
+    chunks = iter(chunks)
+    header = b''
+    for chunk in chunks:
+        header += chunk
+        if len(header) >= _HEADER.size:
+            break
+
+    if not is_compressed(header):
+        if header:
+            yield header
+        yield from chunks
+        return
+
+    size = decompressed_size(header)
+    decompressor = _decompressor(header[len(MAGIC)])
+    written = 0
+    try:
+        for chunk in itertools.chain((header[_HEADER.size:],), chunks):
+            result = decompressor.decompress(chunk)
+            if result:
+                written += len(result)
+                yield result
+    except (zlib.error, lzma.LZMAError) as e:
+        raise CompressionException('Invalid compressed data ({})'.format(e))
+
+    if not decompressor.eof or written != size:
+        raise CompressionException('Decompressed size does not match')
+
+
+def decompress(data):
+    ''' Returns the original data, which may or may not have been compressed '''
+    if not is_compressed(data):
+        return data
+    if len(data) < _HEADER.size:
+        raise CompressionException('Compressed data is truncated')
+
+    _, method, size = _HEADER.unpack_from(data)
+    payload = memoryview(data)[_HEADER.size:]
+    try:
+        if method == _METHODS['zlib']:
+            result = zlib.decompress(payload)
+        elif method == _METHODS['lzma']:
+            result = lzma.decompress(payload)
+        else:
+            raise CompressionException('Unknown compression method {}'.format(method))
+    except (zlib.error, lzma.LZMAError) as e:
+        raise CompressionException('Invalid compressed data ({})'.format(e))
+
+    if len(result) != size:
+        raise CompressionException('Decompressed size does not match')
+    return result
@@ -0,0 +1,63 @@
+""" Conditional GET support.
+
+    Views compute cheap validators (an ETag and/or Last-Modified) from the rows they
+    already have, before doing any expensive work such as rendering templates, and
+    return not_modified() when the client's copy is still current:
+
+        etag = conditional.make_etag(torrent.id, torrent.updated_time)
+        not_modified = conditional.not_modified(etag=etag)
+        if not_modified:
+            return not_modified
+        ...
+        return conditional.add_validators(response, etag=etag)
+"""
+import flask
+from werkzeug.http import is_resource_modified
+
+from nyaa import utils
+
+__all__ = ['make_etag', 'latest', 'not_modified', 'add_validators']
+
+
+def make_etag(*parts):
+    ''' Returns an ETag for a response built from parts (anything with a stable repr).
+        The deployed commit is included, as templates and code change along with it. '''
+    version = flask.current_app.config.get('COMMIT_HASH')
+    return utils.sha1_hash(repr((version,) + parts).encode('utf-8')).hex()
+
+
+def latest(*times):
+    ''' Returns the latest of the given datetimes (ignoring Nones), truncated to seconds
+        as HTTP dates are, or None if there are none '''
+    times = [t.replace(microsecond=0) for t in times if t is not None]
+    return max(times) if times else None
+
+
+def _is_cacheable(per_user):
+    ''' Pages for logged in users carry forms with CSRF tokens, and any page may show
+        flashed messages, so those are never made conditional '''
+    if not per_user:
+        return True
+    return flask.g.user is None and not flask.session.get('_flashes')
+
+
+def not_modified(etag=None, last_modified=None, per_user=False):
+    ''' Returns a 304 response if the request's If-None-Match/If-Modified-Since match the
+        given validators, None otherwise.
+        Set per_user for pages that are rendered differently for the logged in user. '''
+    if flask.request.method not in ('GET', 'HEAD') or not _is_cacheable(per_user):
+        return None
+    if is_resource_modified(flask.request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return add_validators(flask.Response(status=304), etag, last_modified, per_user)
+
+
+def add_validators(response, etag=None, last_modified=None, per_user=False):
+    ''' Sets the ETag and Last-Modified headers of response '''
+    if not _is_cacheable(per_user):
+        return response
+    if etag:
+        response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
@@ -0,0 +1,131 @@
+""" The Elasticsearch client, shared by the app (created in create_app) and the indexing
+    scripts (import_to_es.py, sync_es.py).
+
+    Connections to each node are pooled and kept alive. Every request has a timeout
+    (ES_TIMEOUT), and within a web request all Elasticsearch requests share a budget of
+    ES_REQUEST_BUDGET seconds, so a slow cluster can't hold up pages for long.
+"""
+import time
+
+import flask
+from elasticsearch import Elasticsearch, Urllib3HttpConnection
+
+__all__ = ['create_client', 'get_client', 'request_timeout', 'get_stats',
+           'RequestBudgetExceeded']
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_MAX_CONNECTIONS = 10
+
+
+class RequestBudgetExceeded(Exception):
+    pass
+
+
+class _RequestStats(object):
+    ''' Count and latency of the requests made by this process '''
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, duration, failed=False):
+        self.requests += 1
+        self.failures += int(failed)
+        self.total_seconds += duration
+        self.max_seconds = max(self.max_seconds, duration)
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'average_seconds': self.total_seconds / self.requests if self.requests else 0.0,
+            'max_seconds': self.max_seconds,
+        }
+
+
+_request_stats = _RequestStats()
+
+
+class _StatsConnection(Urllib3HttpConnection):
+    ''' Records every request in _request_stats, on top of the usual logging '''
+
+    def log_request_success(self, method, full_url, path, body, status_code, response,
+                            duration):
+        _request_stats.add(duration)
+        return super(_StatsConnection, self).log_request_success(
+            method, full_url, path, body, status_code, response, duration)
+
+    def log_request_fail(self, method, full_url, path, body, duration, status_code=None,
+                         response=None, exception=None):
+        _request_stats.add(duration, failed=True)
+        return super(_StatsConnection, self).log_request_fail(
+            method, full_url, path, body, duration, status_code, response, exception)
+
+
+def create_client(config, **kwargs):
+    ''' Creates an Elasticsearch client for the hosts in config (ES_HOSTS, by default
+        localhost:9200), with ES_TIMEOUT and ES_MAX_CONNECTIONS (per host).
+        kwargs are passed on to Elasticsearch, overriding those. '''
+    options = {
+        'connection_class': _StatsConnection,
+        'timeout': config.get('ES_TIMEOUT', DEFAULT_TIMEOUT),
+        'maxsize': config.get('ES_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS),
+        # Retrying would go over the budgets
+        'retry_on_timeout': False,
+    }
+    options.update(kwargs)
+    return Elasticsearch(config.get('ES_HOSTS') or None, **options)
+
+
+def init_app(app):
+    app.extensions['elasticsearch'] = create_client(app.config)
+
+
+def get_client():
+    ''' Returns the client of the current app '''
+    return flask.current_app.extensions['elasticsearch']
+
+
+def request_timeout():
+    ''' Returns the timeout for an Elasticsearch request made now: what's left of the
+        budget of the current web request, if lower than ES_TIMEOUT.
+        Raises RequestBudgetExceeded when nothing is left. '''
+    config = flask.current_app.config
+    timeout = config.get('ES_TIMEOUT', DEFAULT_TIMEOUT)
+    budget = config.get('ES_REQUEST_BUDGET')
+    if not budget or not flask.has_request_context():
+        return timeout
+
+    # The budget starts with the first Elasticsearch request of the web request
+    deadline = getattr(flask.g, 'es_deadline', None)
+    if deadline is None:
+        deadline = flask.g.es_deadline = time.monotonic() + budget
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise RequestBudgetExceeded('Elasticsearch budget of {}s exceeded'.format(budget))
+    return min(timeout, remaining)
+
+
+def get_stats(client=None):
+    ''' Returns the request counts and latency of this process, and the state of the
+        connection pools of client (the app's by default) '''
+    if client is None:
+        client = get_client()
+
+    pools = []
+    for connection in client.transport.connection_pool.connections:
+        pool = connection.pool
+        pools.append({
+            'host': connection.host,
+            'connections_created': pool.num_connections,
+            'requests': pool.num_requests,
+            # The queue holds None for connections not made yet
+            'idle_connections': sum(1 for conn in list(pool.pool.queue) if conn)
+            if pool.pool else 0,
+        })
+
+    stats = _request_stats.as_dict()
+    stats['pools'] = pools
+    return stats
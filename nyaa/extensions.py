@@ -1,11 +1,15 @@
 import os.path
+import sys
 
+import flask
 from flask import abort
 from flask.config import Config
 from flask_assets import Environment
 from flask_debugtoolbar import DebugToolbarExtension
 from flask_sqlalchemy import BaseQuery, Pagination, SQLAlchemy
 
+from nyaa import bencode
+
 assets = Environment()
 db = SQLAlchemy()
 toolbar = DebugToolbarExtension()
@@ -13,15 +17,18 @@ toolbar = DebugToolbarExtension()
 
 def fix_paginate():
 
-    def paginate_faste(self, page=1, per_page=50, max_page=None, step=5, count_query=None):
+    def paginate_faste(self, page=1, per_page=50, max_page=None, step=5, count_query=None,
+                       total=None):
         if page < 1:
             abort(404)
 
         if max_page and page > max_page:
             abort(404)
 
-        # Count all items
-        if count_query is not None:
+        # Count all items, unless the total is already known (such as from counters)
+        if total is not None:
+            total_query_count = total
+        elif count_query is not None:
             total_query_count = count_query.scalar()
         else:
             total_query_count = self.count()
@@ -37,6 +44,135 @@ def fix_paginate():
     BaseQuery.paginate_faste = paginate_faste
 
 
+class UploadBudget(object):
+    ''' The bytes and decoded values left for all the uploaded files of a request,
+        None meaning no limit. Running out of bytes aborts the request with 413. '''
+
+    def __init__(self, size=None, elements=None):
+        self.size = size
+        self.elements = elements
+
+    def use_size(self, amount):
+        if self.size is not None:
+            self.size -= amount
+            if self.size < 0:
+                abort(413)
+
+    def use_elements(self, amount):
+        if self.elements is not None:
+            self.elements -= amount
+
+
+class DecodingFileStream(object):
+    ''' Wraps an upload's file stream, checking the bencoded data as Werkzeug writes
+        it in, so a malformed torrent is known (and an oversized one refused)
+        before the request body has been fully received. Only the positions of the
+        captured values are kept, the data is decoded from the file afterwards.
+        The files of a request may also share an UploadBudget, which is drawn from as
+        they come in and refuses the request once it has run out.
+        Everything else is passed through to the wrapped stream. '''
+
+    def __init__(self, stream, max_size=None, capture_keys=(), decoder_limits=None,
+                 budget=None):
+        self._stream = stream
+        self.max_size = max_size
+        self.size = 0
+        self.budget = budget
+
+        self.decoder = bencode.BencodeDecoder(capture_keys=capture_keys, keep_values=False,
+                                              **(decoder_limits or {}))
+        self.max_elements = self.decoder.max_elements
+        self.decode_error = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            abort(413)
+        if self.budget is not None:
+            self.budget.use_size(len(data))
+
+        # Keep writing after an error, but don't bother decoding
+        if self.decode_error is None:
+            self._decode(data)
+
+        return self._stream.write(data)
+
+    def _decode(self, data):
+        decoder = self.decoder
+        elements = decoder.elements
+        budget_elements = self.budget.elements if self.budget is not None else None
+        if budget_elements is not None:
+            if budget_elements <= 0:
+                abort(413)
+            # Decode no more values than the request has left
+            decoder.max_elements = min(self.max_elements or sys.maxsize,
+                                       elements + budget_elements)
+
+        try:
+            decoder.feed(data)
+        except bencode.BencodeLimitException as e:
+            if e.limit == 'max_elements' and decoder.max_elements != self.max_elements:
+                abort(413)
+            self.decode_error = e
+        except (bencode.BencodeException, UnicodeError) as e:
+            self.decode_error = e
+
+        if self.budget is not None:
+            self.budget.use_elements(decoder.elements - elements)
+
+    def close_decoder(self):
+        ''' Closes and returns the decoder, raising the error met while receiving, if any '''
+        if self.decode_error is not None:
+            raise self.decode_error
+        self.decoder.close()
+        return self.decoder
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class TorrentDecodingRequest(flask.Request):
+    ''' Request class which decodes the files uploaded to the torrent upload endpoints
+        (which only take .torrent files) while they are being received, see
+        DecodingFileStream. Files sent anywhere else are left alone.
+        All the files of a request share the budget set by MAX_UPLOAD_REQUEST_SIZE
+        and MAX_UPLOAD_REQUEST_ELEMENTS. '''
+
+    decoding_endpoints = frozenset(['torrents.upload', 'api.v2_api_upload',
+                                    'api.v2_api_upload_batch'])
+    upload_budget = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        stream = super()._get_file_stream(total_content_length, content_type,
+                                          filename, content_length)
+        # The URL has been matched by the time the body is parsed
+        if self.endpoint not in self.decoding_endpoints:
+            return stream
+
+        config = flask.current_app.config
+        if self.upload_budget is None:
+            self.upload_budget = UploadBudget(config.get('MAX_UPLOAD_REQUEST_SIZE') or None,
+                                              config.get('MAX_UPLOAD_REQUEST_ELEMENTS') or None)
+        # Keep the position of the info dict for hashing
+        return DecodingFileStream(stream, max_size=config.get('MAX_TORRENT_FILE_SIZE'),
+                                  capture_keys=('info',),
+                                  decoder_limits=torrent_decoder_limits(config),
+                                  budget=self.upload_budget)
+
+
+def torrent_decoder_limits(config):
+    ''' Returns the BencodeDecoder limits for uploaded torrents set in the given config '''
+    return {
+        'max_depth': config.get('MAX_TORRENT_DEPTH'),
+        'max_elements': config.get('MAX_TORRENT_ELEMENTS'),
+        'max_string_length': config.get('MAX_TORRENT_STRING_LENGTH'),
+    }
+
+
 def _get_config():
     # Workaround to get an available config object before the app is initiallized
     # Only needed/used in top-level and class statements
@@ -0,0 +1,396 @@
+""" Compact binary storage for torrent file lists (TorrentFilelist.filelist_blob).
+
+    A file list is the tree made by utils.sorted_pathdict, stored as columns over its
+    nodes in breadth-first order (so the children of a directory are contiguous):
+
+        header        magic b'NFL', format version (1 byte), node count, name count (<II),
+                      the byte widths of the size, index and offset columns (<BBB),
+                      directory count (<I) and the byte width of the total size column (<B)
+        sizes         per node, the file size or the largest value of the type for directories
+        parents       per node, the index of the parent directory
+        names         per node, the index of the node name in the name table
+        name offsets  per name, plus the end offset of the last one
+        directories   per directory, its node index (in increasing order)
+        file counts   per directory, the amount of files under it at any depth
+        total sizes   per directory, the total size of those files
+        name data     the utf-8 encoded path components, each one stored once
+
+    Node 0 is the root directory. All integers are little-endian and unsigned, packed into
+    the smallest of 1, 2, 4 or 8 bytes that fits the values of their column.
+    Blobs are read lazily, only the nodes that are accessed get decoded.
+    Version 1 blobs end their header after the column widths and have no directory
+    columns. Without them (also left out if the total size would not fit in 8 bytes),
+    directory stats are counted over the whole tree when first needed instead.
+    Older rows store the tree as JSON, which decode() still reads.
+"""
+import bisect
+import itertools
+import json
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+
+__all__ = ['encode', 'decode', 'is_encoded', 'format_version', 'to_dict', 'iter_names', 'find',
+           'list_directory', 'directory_stats', 'FileList', 'FileListDirectory',
+           'FileListException']
+
+MAGIC = b'NFL'
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct('<3sBIIBBB')
+# Follows _HEADER since version 2
+_DIRECTORY_HEADER = struct.Struct('<IB')
+_WIDTH_TYPECODES = OrderedDict([(1, 'B'), (2, 'H'), (4, 'I'), (8, 'Q')])
+
+
+class FileListException(Exception):
+    pass
+
+
+def is_encoded(blob):
+    ''' Returns whether blob is in the binary format (and not an old JSON blob) '''
+    return blob[:len(MAGIC)] == MAGIC
+
+
+def format_version(blob):
+    ''' Returns the format version of a binary file list, or None for JSON blobs '''
+    if not is_encoded(blob) or len(blob) <= len(MAGIC):
+        return None
+    return blob[len(MAGIC)]
+
+
+def _smallest_width(max_value):
+    for width in _WIDTH_TYPECODES:
+        if max_value < 1 << (8 * width):
+            return width
+    raise FileListException('Value out of range: {}'.format(max_value))
+
+
+def encode(file_tree):
+    ''' Encodes a file tree (nested dicts of path components to sizes) into bytes '''
+    names = []
+    name_indices = {}
+    sizes = [None]  # None marks directories
+    parents = [0]
+    node_names = [0]
+
+    def intern(name):
+        index = name_indices.get(name)
+        if index is None:
+            index = name_indices[name] = len(names)
+            names.append(name.encode('utf-8'))
+        return index
+
+    intern('')  # Name of the root directory
+
+    queue = [(0, file_tree)]
+    for parent_index, directory in queue:
+        for name, value in directory.items():
+            if isinstance(value, dict):
+                queue.append((len(sizes), value))
+                sizes.append(None)
+            else:
+                if value < 0:
+                    raise FileListException('File size out of range: {}'.format(value))
+                sizes.append(value)
+            parents.append(parent_index)
+            node_names.append(intern(name))
+
+    name_offsets = [0]
+    for name in names:
+        name_offsets.append(name_offsets[-1] + len(name))
+
+    # Directories get the largest value of the size type, which no file may have
+    size_width = _smallest_width(max((size for size in sizes if size is not None),
+                                     default=-1) + 1)
+    directory_size = (1 << (8 * size_width)) - 1
+    sizes = [directory_size if size is None else size for size in sizes]
+    index_width = _smallest_width(max(len(sizes), len(names)))
+    offset_width = _smallest_width(name_offsets[-1])
+
+    # Stats of every directory, so browsing doesn't need to walk the tree.
+    # They're left out if the total doesn't fit in 8 bytes (not with real torrents).
+    directories = [i for i, size in enumerate(sizes) if size == directory_size]
+    file_counts, total_sizes = _count_subtrees(sizes, parents, directory_size)
+    total_width = 1
+    if total_sizes[0] >= 1 << 64:  # The root has the largest total
+        directories = []
+    else:
+        total_width = _smallest_width(total_sizes[0])
+    file_counts = [file_counts[i] for i in directories]
+    total_sizes = [total_sizes[i] for i in directories]
+
+    out = bytearray(_HEADER.pack(MAGIC, FORMAT_VERSION, len(sizes), len(names),
+                                 size_width, index_width, offset_width))
+    out += _DIRECTORY_HEADER.pack(len(directories), total_width)
+    columns = ((size_width, sizes), (index_width, parents), (index_width, node_names),
+               (offset_width, name_offsets), (index_width, directories),
+               (index_width, file_counts), (total_width, total_sizes))
+    for width, values in columns:
+        column = array(_WIDTH_TYPECODES[width], values)
+        if sys.byteorder != 'little':
+            column.byteswap()
+        out += column.tobytes()
+    out += b''.join(names)
+    return bytes(out)
+
+
+def decode(blob):
+    ''' Returns the root directory of a stored file list, a mapping of path components
+        to file sizes and subdirectories. Old JSON blobs are decoded into OrderedDicts. '''
+    if is_encoded(blob):
+        return FileList(blob).root
+    return json.loads(bytes(blob).decode('utf-8'), object_pairs_hook=OrderedDict)
+
+
+def to_dict(directory):
+    ''' Converts a (lazy) directory into nested OrderedDicts, e.g. for serializing '''
+    if isinstance(directory, FileListDirectory):
+        return directory._filelist.to_dict(directory._index)
+    return OrderedDict((name, to_dict(value) if isinstance(value, Mapping) else value)
+                       for name, value in directory.items())
+
+
+def iter_names(directory):
+    ''' Yields the path components in a directory and its subdirectories.
+        For binary file lists each distinct component is yielded once. '''
+    if isinstance(directory, FileListDirectory):
+        yield from directory._filelist.names()
+        return
+
+    for name, value in directory.items():
+        yield name
+        if isinstance(value, Mapping):
+            yield from iter_names(value)
+
+
+def find(directory, path):
+    ''' Returns the directory or file size at path (a list of path components),
+        raising KeyError if there is none '''
+    for name in path:
+        if not isinstance(directory, Mapping):
+            raise KeyError(name)
+        directory = directory[name]
+    return directory
+
+
+def list_directory(directory, start=0, stop=None):
+    ''' Returns the (name, value) pairs of a directory between positions start and stop '''
+    if isinstance(directory, FileListDirectory):
+        filelist = directory._filelist
+        return [(filelist.node_name(i), filelist.node_value(i))
+                for i in directory.children[start:stop]]
+    return list(itertools.islice(directory.items(), start, stop))
+
+
+def directory_stats(directory):
+    ''' Returns the amount of files in a directory and its subdirectories,
+        and their total size '''
+    if isinstance(directory, FileListDirectory):
+        return directory._filelist.subtree_stats(directory._index)
+
+    file_count = total_size = 0
+    for value in directory.values():
+        if isinstance(value, Mapping):
+            value_count, value_size = directory_stats(value)
+            file_count += value_count
+            total_size += value_size
+        else:
+            file_count += 1
+            total_size += value
+    return file_count, total_size
+
+
+def _count_subtrees(sizes, parents, directory_size):
+    ''' Returns the file counts and total sizes of every directory (by node index),
+        in a single bottom-up pass as children always come after their parents '''
+    file_counts = [0] * len(sizes)
+    total_sizes = [0] * len(sizes)
+
+    for i in range(len(sizes) - 1, 0, -1):
+        parent, size = parents[i], sizes[i]
+        if size == directory_size:
+            file_counts[parent] += file_counts[i]
+            total_sizes[parent] += total_sizes[i]
+        else:
+            file_counts[parent] += 1
+            total_sizes[parent] += size
+    return file_counts, total_sizes
+
+
+def _column(view, offset, width, count):
+    ''' Returns a sequence over count integers of width bytes at offset in view.
+        On little-endian hosts this is a cast of the view, without copying. '''
+    typecode = _WIDTH_TYPECODES.get(width)
+    if typecode is None:
+        raise FileListException('Unsupported column width {}'.format(width))
+    end = offset + width * count
+    if end > len(view):
+        raise FileListException('File list is truncated')
+
+    if sys.byteorder == 'little':
+        return view[offset:end].cast(typecode), end
+
+    column = array(typecode, view[offset:end].tobytes())
+    column.byteswap()
+    return column, end
+
+
+class FileList(object):
+    ''' A lazy reader for a file list in the binary format '''
+
+    def __init__(self, blob):
+        view = memoryview(blob)
+        if len(view) < _HEADER.size:
+            raise FileListException('File list is truncated')
+
+        magic, version, node_count, name_count, size_width, index_width, \
+            offset_width = _HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise FileListException('Not a binary file list')
+        if not 1 <= version <= FORMAT_VERSION:
+            raise FileListException('Unsupported file list version {}'.format(version))
+
+        offset = _HEADER.size
+        if version >= 2:
+            if len(view) < offset + _DIRECTORY_HEADER.size:
+                raise FileListException('File list is truncated')
+            directory_count, total_width = _DIRECTORY_HEADER.unpack_from(view, offset)
+            offset += _DIRECTORY_HEADER.size
+
+        self._sizes, offset = _column(view, offset, size_width, node_count)
+        self._parents, offset = _column(view, offset, index_width, node_count)
+        self._node_names, offset = _column(view, offset, index_width, node_count)
+        self._name_offsets, offset = _column(view, offset, offset_width, name_count + 1)
+
+        # Directory node indices and their stats, None if not stored
+        self._directories = self._file_counts = self._total_sizes = None
+        if version >= 2:
+            directories, offset = _column(view, offset, index_width, directory_count)
+            self._file_counts, offset = _column(view, offset, index_width, directory_count)
+            self._total_sizes, offset = _column(view, offset, total_width, directory_count)
+            # There's always the root directory, unless the stats were left out
+            self._directories = directories if directory_count else None
+
+        self._name_data = view[offset:]
+        if self._name_offsets[-1] > len(self._name_data):
+            raise FileListException('File list is truncated')
+
+        self._directory_size = (1 << (8 * size_width)) - 1
+
+        self._name_cache = {}
+        # Node index -> {child name: node index}, made on the first lookup in a directory
+        self._child_lookups = {}
+        # Per node file counts and total sizes, if the blob doesn't store them,
+        # made on the first call to subtree_stats
+        self._subtree_stats = None
+
+    def __len__(self):
+        ''' Number of files and directories, not counting the root '''
+        return len(self._sizes) - 1
+
+    @property
+    def root(self):
+        return FileListDirectory(self, 0)
+
+    def name(self, name_index):
+        name = self._name_cache.get(name_index)
+        if name is None:
+            start, end = self._name_offsets[name_index], self._name_offsets[name_index + 1]
+            name = self._name_cache[name_index] = str(self._name_data[start:end], 'utf-8')
+        return name
+
+    def names(self):
+        return (self.name(i) for i in range(1, len(self._name_offsets) - 1))
+
+    def node_name(self, node_index):
+        return self.name(self._node_names[node_index])
+
+    def node_value(self, node_index):
+        size = self._sizes[node_index]
+        if size == self._directory_size:
+            return FileListDirectory(self, node_index)
+        return size
+
+    def children(self, node_index):
+        ''' Returns the range of node indices of the children of a directory '''
+        # Nodes are in breadth-first order, so parents only ever increase
+        start = bisect.bisect_left(self._parents, node_index, 1)
+        end = bisect.bisect_right(self._parents, node_index, start)
+        return range(start, end)
+
+    def child(self, node_index, name):
+        ''' Returns the node index of the child of a directory with the given name,
+            raising KeyError if there is none '''
+        lookup = self._child_lookups.get(node_index)
+        if lookup is None:
+            lookup = self._child_lookups[node_index] = \
+                {self.node_name(i): i for i in self.children(node_index)}
+        return lookup[name]
+
+    def subtree_stats(self, node_index):
+        ''' Returns the amount of files under a directory and their total size '''
+        directories = self._directories
+        if directories is not None:
+            i = bisect.bisect_left(directories, node_index)
+            if i < len(directories) and directories[i] == node_index:
+                return self._file_counts[i], self._total_sizes[i]
+            return 0, 0
+
+        if self._subtree_stats is None:
+            self._subtree_stats = _count_subtrees(self._sizes.tolist(), self._parents.tolist(),
+                                                  self._directory_size)
+        file_counts, total_sizes = self._subtree_stats
+        return file_counts[node_index], total_sizes[node_index]
+
+    def to_dict(self, node_index=0):
+        ''' Decodes a directory and its subdirectories into nested OrderedDicts '''
+        sizes, parents, node_names = self._sizes, self._parents, self._node_names
+        directory_size = self._directory_size
+        directories = {node_index: OrderedDict()}
+
+        # A single pass over the following nodes, as parents always come before children
+        for i in range(self.children(node_index).start, len(sizes)):
+            parent = directories.get(parents[i])
+            if parent is None:
+                continue
+            size = sizes[i]
+            if size == directory_size:
+                size = directories[i] = OrderedDict()
+            parent[self.name(node_names[i])] = size
+        return directories[node_index]
+
+
+class FileListDirectory(Mapping):
+    ''' A directory in a FileList, mapping names to file sizes and subdirectories '''
+
+    __slots__ = ('_filelist', '_index', '_children')
+
+    def __init__(self, filelist, index):
+        self._filelist = filelist
+        self._index = index
+        self._children = None
+
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = self._filelist.children(self._index)
+        return self._children
+
+    def __len__(self):
+        return len(self.children)
+
+    def __iter__(self):
+        return (self._filelist.node_name(i) for i in self.children)
+
+    def __getitem__(self, name):
+        return self._filelist.node_value(self._filelist.child(self._index, name))
+
+    def items(self):
+        filelist = self._filelist
+        return [(filelist.node_name(i), filelist.node_value(i)) for i in self.children]
+
+    def values(self):
+        return [self._filelist.node_value(i) for i in self.children]
@@ -0,0 +1,523 @@
+""" Storage for the bencoded info dicts of torrents, used to assemble .torrent files.
+
+    The backend is picked with INFO_DICT_STORAGE:
+    'filesystem' keeps every info dict in its own file (info_dicts/aa/bb/<info hash>),
+    'pack' appends them to a few large segment files, see PackStore.
+    Either one can compress the info dicts as set in STORAGE_COMPRESSION, see CompressedStore.
+    Use manage_info_dicts.py to move info dicts between backends and to compact packs.
+"""
+import abc
+import bisect
+import fcntl
+import io
+import mmap
+import os
+import struct
+from contextlib import closing, contextmanager
+
+import flask
+
+from nyaa import compression, utils
+
+app = flask.current_app
+
+__all__ = ['InfoDictStore', 'FilesystemStore', 'PackStore', 'CompressedStore',
+           'create_store', 'get_store']
+
+
+class InfoDictStore(abc.ABC):
+    ''' Info dicts keyed by (binary) info hash '''
+
+    @abc.abstractmethod
+    def get(self, info_hash):
+        ''' Returns the info dict bytes, raising KeyError if there are none '''
+
+    @abc.abstractmethod
+    def put(self, info_hash, data):
+        ''' Stores data as the info dict, replacing any earlier one '''
+
+    @abc.abstractmethod
+    def delete(self, info_hash):
+        ''' Removes the info dict, if it's stored '''
+
+    @abc.abstractmethod
+    def locate(self, info_hash):
+        ''' Returns (path, offset, length) of the info dict within a file,
+            raising KeyError if there are none '''
+
+    @abc.abstractmethod
+    def __iter__(self):
+        ''' Iterates over the info hashes of all stored info dicts '''
+
+    def stream(self, info_hash, chunk_size=64 * 1024):
+        ''' Returns the size of the info dict and a generator of its bytes, read chunk_size
+            at a time from a file that's opened right away (raising KeyError if there are
+            no info dict). Close the generator if it's not read to the end. '''
+        path, offset, length = self.locate(info_hash)
+        try:
+            in_file = open(path, 'rb')
+        except FileNotFoundError:
+            # Moved (by pack compaction) since it was located
+            return _stream_bytes(self.get(info_hash), chunk_size)
+        return length, _read_chunks(in_file, offset, length, chunk_size)
+
+    def __contains__(self, info_hash):
+        try:
+            self.locate(info_hash)
+        except KeyError:
+            return False
+        return True
+
+
+def _read_chunks(in_file, offset, length, chunk_size):
+    ''' Yields length bytes of in_file from offset, chunk_size at a time, and closes it '''
+    with in_file:
+        in_file.seek(offset)
+        while length > 0:
+            chunk = in_file.read(min(length, chunk_size))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _stream_bytes(data, chunk_size):
+    ''' Returns data like InfoDictStore.stream does '''
+    return len(data), _read_chunks(io.BytesIO(data), 0, len(data), chunk_size)
+
+
+def _decompress_chunks(chunks):
+    with closing(chunks):
+        yield from compression.decompress_chunks(chunks)
+
+
+class FilesystemStore(InfoDictStore):
+    ''' One file per info dict, in two levels of directories by info hash '''
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, info_hash):
+        info_hash = info_hash.hex()
+        return os.path.join(self.folder, info_hash[0:2], info_hash[2:4], info_hash)
+
+    def get(self, info_hash):
+        try:
+            with open(self.path(info_hash), 'rb') as in_file:
+                return in_file.read()
+        except FileNotFoundError:
+            raise KeyError(info_hash)
+
+    def put(self, info_hash, data):
+        path = self.path(info_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as out_file:
+            out_file.write(data)
+
+    def delete(self, info_hash):
+        path = self.path(info_hash)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def locate(self, info_hash):
+        path = self.path(info_hash)
+        try:
+            return path, 0, os.path.getsize(path)
+        except FileNotFoundError:
+            raise KeyError(info_hash)
+
+    def __iter__(self):
+        for _, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                if len(filename) == 40:
+                    yield bytes.fromhex(filename)
+
+
+# Index entries: info hash, segment number, offset and length of the info dict.
+# A length of 0 marks a deleted info dict (bencoded dicts are never empty).
+_ENTRY = struct.Struct('<20sIQI')
+# Precedes each info dict in the segments, so they can be told apart without the index
+_RECORD_HEADER = struct.Struct('<20sI')
+_INDEX_HEADER = b'NIDX\x01\x00\x00\x00'
+
+
+class _IndexTable(object):
+    ''' A memory-mapped index file, with entries sorted by info hash '''
+
+    def __init__(self, path):
+        self._map = None
+        self._length = 0
+        try:
+            with open(path, 'rb') as index_file:
+                if os.fstat(index_file.fileno()).st_size > len(_INDEX_HEADER):
+                    self._map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return
+
+        if self._map is not None:
+            if self._map[:len(_INDEX_HEADER)] != _INDEX_HEADER:
+                raise ValueError('{} is not an info dict index'.format(path))
+            self._length = (len(self._map) - len(_INDEX_HEADER)) // _ENTRY.size
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        ''' Returns the info hash of entry i, which makes this bisectable '''
+        offset = len(_INDEX_HEADER) + i * _ENTRY.size
+        return self._map[offset:offset + 20]
+
+    def entry(self, i):
+        return _ENTRY.unpack_from(self._map, len(_INDEX_HEADER) + i * _ENTRY.size)
+
+    def find(self, info_hash):
+        i = bisect.bisect_left(self, info_hash)
+        if i < self._length and self[i] == info_hash:
+            return self.entry(i)[1:]
+        return None
+
+    def __iter__(self):
+        return (self.entry(i) for i in range(self._length))
+
+
+class PackStore(InfoDictStore):
+    ''' Info dicts appended to segment files of up to segment_size bytes,
+        found through an index of info hash -> (segment, offset, length).
+
+        The index is a file of entries sorted by info hash, read with mmap and binary search.
+        New entries (and deletions) are appended to a journal, which gets merged into the
+        index once it holds journal_size entries. Replaced and deleted info dicts take up
+        space in their segments until compact() is run.
+
+        Writers (in any process) take an exclusive lock on the store. Readers don't need
+        one: segments are only appended to, and the index and journal are replaced by
+        renaming, which readers notice through the inode of the journal. '''
+
+    def __init__(self, folder, segment_size=256 * 1024 * 1024, journal_size=10000):
+        self.folder = folder
+        self.segment_size = segment_size
+        self.journal_size = journal_size
+        os.makedirs(folder, exist_ok=True)
+
+        self._index_path = os.path.join(folder, 'index')
+        self._journal_path = os.path.join(folder, 'journal')
+        self._lock_path = os.path.join(folder, 'lock')
+        open(self._journal_path, 'ab').close()
+
+        self._index = None
+        self._journal = {}
+        self._journal_fd = None
+        self._journal_offset = 0
+        self._segment_maps = {}
+
+    def _segment_path(self, segment):
+        return os.path.join(self.folder, '{:08d}.pack'.format(segment))
+
+    def _segments(self):
+        return sorted(int(filename[:-5]) for filename in os.listdir(self.folder)
+                      if filename.endswith('.pack') and filename[:-5].isdigit())
+
+    @contextmanager
+    def _lock(self):
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reload(self):
+        if self._journal_fd is not None:
+            os.close(self._journal_fd)
+            self._journal_fd = None
+        try:
+            self._journal_fd = os.open(self._journal_path, os.O_RDONLY)
+        except FileNotFoundError:
+            pass
+
+        # The index is always replaced before the journal, so this is at least as new
+        self._index = _IndexTable(self._index_path)
+        self._journal = {}
+        self._journal_offset = 0
+
+    def _refresh(self):
+        ''' Picks up changes to the index and journal made by other processes '''
+        try:
+            journal_inode = os.stat(self._journal_path).st_ino
+        except FileNotFoundError:
+            journal_inode = None
+
+        if (self._index is None or self._journal_fd is None or
+                os.fstat(self._journal_fd).st_ino != journal_inode):
+            self._reload()
+        if self._journal_fd is None:
+            return
+
+        # Read new whole entries, leaving any partially written one for later
+        size = os.fstat(self._journal_fd).st_size
+        size -= (size - self._journal_offset) % _ENTRY.size
+        if size > self._journal_offset:
+            data = os.pread(self._journal_fd, size - self._journal_offset, self._journal_offset)
+            for info_hash, segment, offset, length in _ENTRY.iter_unpack(data):
+                self._journal[info_hash] = (segment, offset, length)
+            self._journal_offset = size
+
+    def _find(self, info_hash):
+        location = self._journal.get(info_hash) or self._index.find(info_hash)
+        if location is None or location[2] == 0:
+            return None
+        return location
+
+    def _read(self, segment, offset, length):
+        segment_map = self._segment_maps.get(segment)
+        if segment_map is None or len(segment_map) < offset + length:
+            # Not mapped yet, or the segment has grown since
+            with open(self._segment_path(segment), 'rb') as segment_file:
+                segment_map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            old_map = self._segment_maps.pop(segment, None)
+            if old_map is not None:
+                old_map.close()
+            self._segment_maps[segment] = segment_map
+        return segment_map[offset:offset + length]
+
+    def get(self, info_hash):
+        self._refresh()
+        location = self._find(info_hash)
+        if location is None:
+            raise KeyError(info_hash)
+        try:
+            return self._read(*location)
+        except FileNotFoundError:
+            # The segment was removed by compaction since we last looked
+            self._reload()
+            self._refresh()
+            location = self._find(info_hash)
+            if location is None:
+                raise KeyError(info_hash)
+            return self._read(*location)
+
+    def locate(self, info_hash):
+        self._refresh()
+        location = self._find(info_hash)
+        if location is None:
+            raise KeyError(info_hash)
+        segment, offset, length = location
+        return self._segment_path(segment), offset, length
+
+    def __iter__(self):
+        self._refresh()
+        journal = dict(self._journal)
+        for info_hash, _, _, length in self._index:
+            if info_hash not in journal and length:
+                yield info_hash
+        for info_hash, (_, _, length) in journal.items():
+            if length:
+                yield info_hash
+
+    def _append_record(self, info_hash, data):
+        ''' Appends data to the last segment (or a new one once it's full) '''
+        segments = self._segments()
+        segment = segments[-1] if segments else 1
+        segment_path = self._segment_path(segment)
+        if os.path.exists(segment_path) and os.path.getsize(segment_path) >= self.segment_size:
+            segment += 1
+            segment_path = self._segment_path(segment)
+
+        with open(segment_path, 'ab') as segment_file:
+            segment_file.write(_RECORD_HEADER.pack(info_hash, len(data)))
+            offset = segment_file.tell()
+            segment_file.write(data)
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+        return segment, offset, len(data)
+
+    def _append_journal(self, info_hash, location):
+        with open(self._journal_path, 'ab') as journal_file:
+            journal_file.write(_ENTRY.pack(info_hash, *location))
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self._refresh()
+
+        if len(self._journal) >= self.journal_size:
+            self._write_index()
+
+    def put(self, info_hash, data):
+        if not data:
+            raise ValueError('Info dict is empty')
+        with self._lock():
+            self._append_journal(info_hash, self._append_record(info_hash, data))
+
+    def delete(self, info_hash):
+        with self._lock():
+            if self._find(info_hash) is not None:
+                self._append_journal(info_hash, (0, 0, 0))
+
+    def _write_index(self, moved=None):
+        ''' Merges the journal (and locations in moved) into a new index,
+            and starts a new journal. Must be called with the lock held. '''
+        changes = dict(self._journal)
+        changes.update(moved or {})
+        changed_hashes = sorted(changes)
+
+        def merged_entries():
+            # Both the index and changed_hashes are sorted, so merge them as such
+            i = 0
+            for entry in self._index:
+                while i < len(changed_hashes) and changed_hashes[i] < entry[0]:
+                    yield (changed_hashes[i],) + changes[changed_hashes[i]]
+                    i += 1
+                if i < len(changed_hashes) and changed_hashes[i] == entry[0]:
+                    continue
+                yield entry
+            for info_hash in changed_hashes[i:]:
+                yield (info_hash,) + changes[info_hash]
+
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'wb') as index_file:
+            index_file.write(_INDEX_HEADER)
+            for entry in merged_entries():
+                if entry[3]:
+                    index_file.write(_ENTRY.pack(*entry))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(tmp_path, self._index_path)
+
+        tmp_path = self._journal_path + '.tmp'
+        open(tmp_path, 'wb').close()
+        os.replace(tmp_path, self._journal_path)
+        self._reload()
+
+    def compact(self, min_live_ratio=0.5):
+        ''' Rewrites the live info dicts out of segments where less than min_live_ratio of
+            the space is in use, then removes those segments. Returns the amount of
+            segments removed and the bytes freed. '''
+        with self._lock():
+            self._write_index()
+
+            segments = self._segments()
+            if not segments:
+                return 0, 0
+
+            live_bytes = dict.fromkeys(segments, 0)
+            for _, segment, _, length in self._index:
+                live_bytes[segment] += _RECORD_HEADER.size + length
+
+            compacted = set()
+            # The last segment is still being appended to, leave it be
+            for segment in segments[:-1]:
+                size = os.path.getsize(self._segment_path(segment))
+                if live_bytes[segment] < size * min_live_ratio:
+                    compacted.add(segment)
+            if not compacted:
+                return 0, 0
+
+            moved = {}
+            for info_hash, segment, offset, length in self._index:
+                if segment in compacted:
+                    data = self._read(segment, offset, length)
+                    moved[info_hash] = self._append_record(info_hash, data)
+            self._write_index(moved)
+
+            freed = 0
+            for segment in compacted:
+                segment_map = self._segment_maps.pop(segment, None)
+                if segment_map is not None:
+                    segment_map.close()
+                segment_path = self._segment_path(segment)
+                freed += os.path.getsize(segment_path) - live_bytes[segment]
+                os.remove(segment_path)
+            return len(compacted), freed
+
+
+class CompressedStore(InfoDictStore):
+    ''' Compresses info dicts (as set in levels, see compression.compress_by_size)
+        before storing them in store, keeping a cache of recently read info dicts.
+        Info dicts stored uncompressed are read as they are. '''
+
+    def __init__(self, store, levels, cache_bytes=64 * 1024 * 1024):
+        self.store = store
+        self.levels = levels
+        # An info hash always has the same info dict, so this never needs invalidating
+        self._cache = utils.LRUCache(maxsize=10000, max_bytes=cache_bytes)
+
+    def get(self, info_hash):
+        data = self._cache.get(info_hash)
+        if data is None:
+            data = compression.decompress(self.store.get(info_hash))
+            self._cache[info_hash] = data
+        return data
+
+    def put(self, info_hash, data):
+        self.store.put(info_hash, compression.compress_by_size(data, self.levels))
+        self._cache.pop(info_hash)
+
+    def delete(self, info_hash):
+        self.store.delete(info_hash)
+        self._cache.pop(info_hash)
+
+    def locate(self, info_hash):
+        ''' Like InfoDictStore.locate, but returns None if the info dict is compressed '''
+        path, offset, length = self.store.locate(info_hash)
+        with open(path, 'rb') as in_file:
+            in_file.seek(offset)
+            if compression.is_compressed(in_file.read(len(compression.MAGIC))):
+                return None
+        return path, offset, length
+
+    def stream(self, info_hash, chunk_size=64 * 1024):
+        ''' Like InfoDictStore.stream, decompressing the info dict as it's read '''
+        data = self._cache.get(info_hash)
+        if data is not None:
+            return _stream_bytes(data, chunk_size)
+
+        path, offset, length = self.store.locate(info_hash)
+        try:
+            in_file = open(path, 'rb')
+        except FileNotFoundError:
+            return _stream_bytes(self.get(info_hash), chunk_size)
+
+        try:
+            in_file.seek(offset)
+            size = compression.decompressed_size(in_file.read(compression.HEADER_SIZE))
+        except Exception:
+            in_file.close()
+            raise
+        chunks = _read_chunks(in_file, offset, length, chunk_size)
+        if size is None:
+            return length, chunks
+        return size, _decompress_chunks(chunks)
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def __contains__(self, info_hash):
+        return info_hash in self.store
+
+
+def create_store(config):
+    ''' Creates the info dict store set up in config '''
+    storage = config.get('INFO_DICT_STORAGE', 'filesystem')
+    if storage == 'filesystem':
+        store = FilesystemStore(os.path.join(config['BASE_DIR'], 'info_dicts'))
+    elif storage == 'pack':
+        store = PackStore(config.get('INFO_DICT_PACK_FOLDER') or
+                          os.path.join(config['BASE_DIR'], 'info_dicts_pack'))
+    else:
+        raise ValueError('Unknown INFO_DICT_STORAGE: {!r}'.format(storage))
+
+    if config.get('STORAGE_COMPRESSION'):
+        store = CompressedStore(store, config['STORAGE_COMPRESSION'],
+                                config.get('INFO_DICT_CACHE_BYTES', 64 * 1024 * 1024))
+    return store
+
+
+_store = None
+
+
+def get_store():
+    ''' Returns the info dict store of the app, created on first use '''
+    global _store
+    if _store is None:
+        _store = create_store(app.config)
+    return _store
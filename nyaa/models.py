@@ -11,8 +11,9 @@ from urllib.parse import urlencode
 import flask
 from markupsafe import escape as escape_markup
 
-from sqlalchemy import ForeignKeyConstraint, Index
+from sqlalchemy import ForeignKeyConstraint, Index, event, func, text
 from sqlalchemy.ext import declarative
+from sqlalchemy.orm.attributes import get_history
 from sqlalchemy_fulltext import FullText
 from sqlalchemy_utils import ChoiceType, EmailType, PasswordType
 
@@ -115,7 +116,13 @@ class TorrentBase(DeclarativeHelperBase):
 
     filesize = db.Column(db.BIGINT, default=0, nullable=False, index=True)
     encoding = db.Column(db.String(length=32), nullable=False)
-    flags = db.Column(db.Integer, default=0, nullable=False, index=True)
+
+    @declarative.declared_attr
+    def flags(cls):
+        # Browse counts need the previous values of flags and categories when they change
+        # (active_history), see BrowseCountBase
+        return db.column_property(db.Column(db.Integer, default=0, nullable=False, index=True),
+                                  active_history=True)
 
     @declarative.declared_attr
     def uploader_id(cls):
@@ -134,9 +141,12 @@ class TorrentBase(DeclarativeHelperBase):
     @declarative.declared_attr
     def main_category_id(cls):
         fk = db.ForeignKey(cls._table_prefix('main_categories.id'))
-        return db.Column(db.Integer, fk, nullable=False)
+        return db.column_property(db.Column(db.Integer, fk, nullable=False),
+                                  active_history=True)
 
-    sub_category_id = db.Column(db.Integer, nullable=False)
+    @declarative.declared_attr
+    def sub_category_id(cls):
+        return db.column_property(db.Column(db.Integer, nullable=False), active_history=True)
 
     @declarative.declared_attr
     def redirect(cls):
@@ -227,7 +237,8 @@ class TorrentBase(DeclarativeHelperBase):
 
     @property
     def info_dict_path(self):
-        ''' Returns a path to the info_dict file in form of 'info_dicts/aa/bb/aabbccddee...' '''
+        ''' Returns a path to the info_dict file in form of 'info_dicts/aa/bb/aabbccddee...'
+            (only used with the 'filesystem' INFO_DICT_STORAGE, see nyaa/info_dicts.py) '''
         info_hash = self.info_hash_as_hex
         return os.path.join(app.config['BASE_DIR'], 'info_dicts',
                             info_hash[0:2], info_hash[2:4], info_hash)
@@ -312,6 +323,90 @@ class StatisticBase(DeclarativeHelperBase):
                                back_populates='stats')
 
 
+class BrowseCountBase(DeclarativeHelperBase):
+    ''' Torrent counts per category and combination of the flags browsing filters on,
+        kept up to date by ORM events on torrents with USE_BROWSE_COUNTS (see the bottom
+        of this file) and reconciled with the torrents table periodically
+        (reconcile_browse_counts.py). '''
+    __tablename_base__ = 'browse_counts'
+
+    # Flags filtered on when browsing (visibility and the quality filter)
+    COUNTED_FLAGS = (TorrentFlags.HIDDEN | TorrentFlags.TRUSTED | TorrentFlags.REMAKE |
+                     TorrentFlags.COMPLETE | TorrentFlags.DELETED)
+
+    main_category_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    sub_category_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    flags = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def count_torrents(cls, main_category_id=None, sub_category_id=None,
+                       flags_set=0, flags_unset=0):
+        ''' Returns the number of torrents in the given category (or all), with all of
+            flags_set and none of flags_unset set '''
+        query = db.session.query(func.coalesce(func.sum(cls.count), 0))
+        if main_category_id is not None:
+            query = query.filter(cls.main_category_id == main_category_id)
+        if sub_category_id is not None:
+            query = query.filter(cls.sub_category_id == sub_category_id)
+        if flags_set:
+            query = query.filter(cls.flags.op('&')(int(flags_set)) == int(flags_set))
+        if flags_unset:
+            query = query.filter(cls.flags.op('&')(int(flags_unset)) == 0)
+        return int(query.scalar())
+
+    @classmethod
+    def add(cls, connection, main_category_id, sub_category_id, flags, delta):
+        ''' Adds delta to a count, on the connection of the ongoing flush.
+            This is a single upsert, as concurrent flushes may create the same count. '''
+        quote = connection.dialect.identifier_preparer.quote
+        keys = ', '.join(quote(name) for name in ('main_category_id', 'sub_category_id', 'flags'))
+        if connection.dialect.name == 'mysql':
+            upsert = 'ON DUPLICATE KEY UPDATE {count} = {count} + :delta'
+        else:
+            # SQLite (3.24+)
+            upsert = 'ON CONFLICT ({keys}) DO UPDATE SET {count} = {count} + :delta'
+        statement = ('INSERT INTO {table} ({keys}, {count}) '
+                     'VALUES (:main_category_id, :sub_category_id, :flags, :delta) ' + upsert)
+        statement = statement.format(table=quote(cls.__tablename__), keys=keys,
+                                     count=quote('count'))
+
+        connection.execute(text(statement), main_category_id=main_category_id,
+                           sub_category_id=sub_category_id,
+                           flags=(flags or 0) & cls.COUNTED_FLAGS, delta=delta)
+
+    @classmethod
+    def reconcile(cls):
+        ''' Recounts everything from the torrents table, fixing any drift (from bulk
+            updates bypassing the ORM, for one). Returns the number of counts changed.
+            Commits, and should be called in a transaction of its own. '''
+        # Lock the counts before counting the torrents, so torrents changed meanwhile
+        # wait for this to commit and are added on top, instead of being overwritten.
+        # On MySQL this locks the gaps between the rows too, so new counts wait as well.
+        rows = cls.query.with_for_update().all()
+
+        torrents = db.metadata.tables[cls._table_prefix('torrents')]
+        counted_flags = torrents.c.flags.op('&')(int(cls.COUNTED_FLAGS))
+        actual = {(main_id, sub_id, flags): count for main_id, sub_id, flags, count in
+                  db.session.query(torrents.c.main_category_id, torrents.c.sub_category_id,
+                                   counted_flags, func.count())
+                  .group_by(torrents.c.main_category_id, torrents.c.sub_category_id,
+                            counted_flags)}
+
+        changed = 0
+        for row in rows:
+            count = actual.pop((row.main_category_id, row.sub_category_id, row.flags), 0)
+            if row.count != count:
+                row.count = count
+                changed += 1
+        for (main_id, sub_id, flags), count in actual.items():
+            db.session.add(cls(main_category_id=main_id, sub_category_id=sub_id,
+                               flags=flags, count=count))
+            changed += 1
+        db.session.commit()
+        return changed
+
+
 class Trackers(db.Model):
     __tablename__ = 'trackers'
 
@@ -802,6 +897,15 @@ class SukebeiStatistic(StatisticBase, db.Model):
     __flavor__ = 'Sukebei'
 
 
+# BrowseCount
+class NyaaBrowseCount(BrowseCountBase, db.Model):
+    __flavor__ = 'Nyaa'
+
+
+class SukebeiBrowseCount(BrowseCountBase, db.Model):
+    __flavor__ = 'Sukebei'
+
+
 # TorrentTrackers
 class NyaaTorrentTrackers(TorrentTrackersBase, db.Model):
     __flavor__ = 'Nyaa'
@@ -861,6 +965,7 @@ if config['SITE_FLAVOR'] == 'nyaa':
     Torrent = NyaaTorrent
     TorrentFilelist = NyaaTorrentFilelist
     Statistic = NyaaStatistic
+    BrowseCount = NyaaBrowseCount
     TorrentTrackers = NyaaTorrentTrackers
     MainCategory = NyaaMainCategory
     SubCategory = NyaaSubCategory
@@ -873,6 +978,7 @@ elif config['SITE_FLAVOR'] == 'sukebei':
     Torrent = SukebeiTorrent
     TorrentFilelist = SukebeiTorrentFilelist
     Statistic = SukebeiStatistic
+    BrowseCount = SukebeiBrowseCount
     TorrentTrackers = SukebeiTorrentTrackers
     MainCategory = SukebeiMainCategory
     SubCategory = SukebeiSubCategory
@@ -880,3 +986,44 @@ elif config['SITE_FLAVOR'] == 'sukebei':
     AdminLog = SukebeiAdminLog
     Report = SukebeiReport
     TorrentNameSearch = SukebeiTorrentNameSearch
+
+
+# Keep the browse counts up to date with torrent changes, if they're used
+_BROWSE_COUNT_COLUMNS = ('main_category_id', 'sub_category_id', 'flags')
+
+
+def _browse_count_key(torrent, previous=False):
+    key = []
+    for column in _BROWSE_COUNT_COLUMNS:
+        history = get_history(torrent, column)
+        if previous and history.deleted:
+            key.append(history.deleted[0])
+        else:
+            key.append(getattr(torrent, column))
+    return tuple(key)
+
+
+def _make_browse_count_listeners(count_class):
+    def after_insert(mapper, connection, torrent):
+        count_class.add(connection, *_browse_count_key(torrent), delta=1)
+
+    def after_update(mapper, connection, torrent):
+        previous_key = _browse_count_key(torrent, previous=True)
+        key = _browse_count_key(torrent)
+        flag_mask = count_class.COUNTED_FLAGS
+        if previous_key[:2] != key[:2] or previous_key[2] & flag_mask != key[2] & flag_mask:
+            count_class.add(connection, *previous_key, delta=-1)
+            count_class.add(connection, *key, delta=1)
+
+    def after_delete(mapper, connection, torrent):
+        count_class.add(connection, *_browse_count_key(torrent, previous=True), delta=-1)
+
+    return after_insert, after_update, after_delete
+
+
+if config.get('USE_BROWSE_COUNTS'):
+    for _torrent_class, _count_class in ((NyaaTorrent, NyaaBrowseCount),
+                                         (SukebeiTorrent, SukebeiBrowseCount)):
+        for _event_name, _listener in zip(('after_insert', 'after_update', 'after_delete'),
+                                          _make_browse_count_listeners(_count_class)):
+            event.listen(_torrent_class, _event_name, _listener, propagate=True)
@@ -1,17 +1,22 @@
+import base64
 import math
+from datetime import datetime
 import re
 import shlex
+import time
 
 import flask
 
 import sqlalchemy
 import sqlalchemy_fulltext.modes as FullTextMode
-from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ElasticsearchException, TransportError
 from elasticsearch_dsl import Q, Search
+from flask_sqlalchemy import Pagination
 from sqlalchemy_fulltext import FullTextSearch
 
-from nyaa import models
+from nyaa import elastic, models, search_cache
 from nyaa.extensions import db
+from nyaa.torrents import create_magnet
 
 app = flask.current_app
 
@@ -69,16 +74,172 @@ def _generate_query_string(term, category, filter, user):
     return params
 
 
+class TorrentRow(object):
+    ''' A torrent as listed in search results (search_results.html and rss.xml), with just the
+        listed columns. Built from Elasticsearch hits and database rows alike, and much
+        lighter than a Torrent: no ORM state, joined categories or statistics. '''
+
+    __slots__ = ('id', 'display_name', 'info_hash', 'filesize', 'created_time',
+                 'main_category_id', 'sub_category_id', 'comment_count', 'has_torrent',
+                 'trusted', 'remake', 'hidden', 'deleted',
+                 'seed_count', 'leech_count', 'download_count', 'highlight')
+
+    # The _source fields of the hits
+    ES_FIELDS = __slots__[:-1]
+
+    def __init__(self, id, display_name, info_hash, filesize, created_time,
+                 main_category_id, sub_category_id, comment_count, has_torrent,
+                 trusted, remake, hidden, deleted,
+                 seed_count, leech_count, download_count, highlight=None):
+        self.id = id
+        self.display_name = display_name
+        self.info_hash = info_hash
+        self.filesize = filesize
+        self.created_time = created_time
+        self.main_category_id = main_category_id
+        self.sub_category_id = sub_category_id
+        self.comment_count = comment_count
+        self.has_torrent = has_torrent
+        self.trusted = trusted
+        self.remake = remake
+        self.hidden = hidden
+        self.deleted = deleted
+        self.seed_count = seed_count
+        self.leech_count = leech_count
+        self.download_count = download_count
+        # The display_name with the matches marked, as HTML
+        self.highlight = highlight
+
+    @classmethod
+    def from_hit(cls, hit):
+        ''' Returns the row of a raw Elasticsearch hit '''
+        source = hit['_source']
+        highlight = hit.get('highlight', {}).get('display_name')
+        return cls(source['id'], source['display_name'], bytes.fromhex(source['info_hash']),
+                   source['filesize'], _parse_es_time(source['created_time']),
+                   int(source['main_category_id']), int(source['sub_category_id']),
+                   source['comment_count'], source['has_torrent'],
+                   source['trusted'], source['remake'], source['hidden'], source['deleted'],
+                   source['seed_count'], source['leech_count'], source['download_count'],
+                   highlight[0] if highlight else None)
+
+    @classmethod
+    def from_db_row(cls, row):
+        ''' Returns the row of a database row with the columns of _row_columns() '''
+        flags = row.flags
+        return cls(row.id, row.display_name, row.info_hash, row.filesize, row.created_time,
+                   row.main_category_id, row.sub_category_id, row.comment_count,
+                   row.has_torrent,
+                   bool(flags & models.TorrentFlags.TRUSTED),
+                   bool(flags & models.TorrentFlags.REMAKE),
+                   bool(flags & models.TorrentFlags.HIDDEN),
+                   bool(flags & models.TorrentFlags.DELETED),
+                   row.seed_count or 0, row.leech_count or 0, row.download_count or 0)
+
+    @property
+    def category_id(self):
+        return '{0}_{1}'.format(self.main_category_id, self.sub_category_id)
+
+    @property
+    def info_hash_as_hex(self):
+        return self.info_hash.hex()
+
+    @property
+    def magnet_uri(self):
+        return create_magnet(self)
+
+    @property
+    def created_utc_timestamp(self):
+        ''' Returns a UTC POSIX timestamp, as seconds '''
+        return (self.created_time - models.UTC_EPOCH).total_seconds()
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+
+def _parse_es_time(value):
+    ''' Parses the created_time of hits (like 2017-05-30T12:34:56), much faster than strptime '''
+    return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                    int(value[11:13]), int(value[14:16]), int(value[17:19]))
+
+
+def _row_columns():
+    ''' Returns the columns of TorrentRow.from_db_row, for Query.with_entities '''
+    return (models.Torrent.id, models.Torrent.display_name, models.Torrent.info_hash,
+            models.Torrent.filesize, models.Torrent.created_time, models.Torrent.flags,
+            models.Torrent.main_category_id, models.Torrent.sub_category_id,
+            models.Torrent.comment_count, models.Torrent.has_torrent,
+            models.Statistic.seed_count, models.Statistic.leech_count,
+            models.Statistic.download_count)
+
+
+class ElasticResults(object):
+    ''' A page of search_elastic results: TorrentRows (items) out of total matches, with
+        cursors to the pages after and before (or None), and facets if asked for. '''
+
+    def __init__(self, hits, total, next_cursor=None, prev_cursor=None, facets=None):
+        # The raw hits are kept for the search cache
+        self.hits = hits
+        self.items = [TorrentRow.from_hit(hit) for hit in hits]
+        self.total = total
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.facets = facets
+
+    def to_dict(self):
+        return {'hits': self.hits, 'total': self.total, 'next_cursor': self.next_cursor,
+                'prev_cursor': self.prev_cursor, 'facets': self.facets}
+
+
+class SearchUnavailable(Exception):
+    ''' Raised by search_elastic when Elasticsearch doesn't answer (in time) or fails '''
+    pass
+
+
+# When browsing from Elasticsearch fails, it's left alone for a while (time.monotonic())
+_elastic_browse_retry_time = 0.0
+
+
+def use_elastic_browse(page=1, per_page=DEFAULT_PER_PAGE):
+    ''' Returns whether to browse (list without a search term) from Elasticsearch:
+        with USE_ELASTIC_BROWSE, unless it failed in the last ES_BROWSE_RETRY_DELAY seconds.
+        Pages past the ES_MAX_SEARCH_RESULT results Elasticsearch serves are left to
+        the database, which can go deeper. '''
+    max_search_results = app.config.get('ES_MAX_SEARCH_RESULT', DEFAULT_MAX_SEARCH_RESULT)
+    return (app.config.get('USE_ELASTIC_SEARCH') and app.config.get('USE_ELASTIC_BROWSE') and
+            time.monotonic() >= _elastic_browse_retry_time and
+            (page - 1) * per_page < max_search_results)
+
+
+def elastic_browse_failed():
+    ''' Sends browsing to the database for a while, after SearchUnavailable '''
+    global _elastic_browse_retry_time
+    _elastic_browse_retry_time = time.monotonic() + app.config.get('ES_BROWSE_RETRY_DELAY', 30)
+    app.logger.warning('Elasticsearch unavailable, browsing from the database', exc_info=True)
+
+
+def _dump_elastic_results(results):
+    return results.to_dict()
+
+
+def _load_elastic_results(value):
+    return ElasticResults(**value)
+
+
+@search_cache.cached('elastic', _dump_elastic_results, _load_elastic_results)
 def search_elastic(term='', user=None, sort='id', order='desc',
                    category='0_0', quality_filter='0', page=1,
                    rss=False, admin=False, logged_in_user=None,
-                   per_page=75, max_search_results=1000):
-    # This function can easily be memcached now
+                   per_page=75, max_search_results=1000, after=None, before=None,
+                   facets=False):
+    ''' Returns the ElasticResults of an Elasticsearch search, with next_cursor (and
+        prev_cursor) for continuing after (or before) its results.
+        Pages are selected by offset, up to max_search_results, or by the cursors.
+        With facets, the results also have the facets (see _facet_counts) of the search.
+        Raises SearchUnavailable if Elasticsearch can't be reached, is too slow or fails. '''
     if page > 4294967295:
         flask.abort(404)
 
-    es_client = Elasticsearch()
-
     es_sort_keys = {
         'id': 'id',
         'size': 'filesize',
@@ -93,7 +254,7 @@ def search_elastic(term='', user=None, sort='id', order='desc',
     if sort_ not in es_sort_keys:
         flask.abort(400)
 
-    es_sort = es_sort_keys[sort]
+    es_sort = es_sort_keys[sort_]
 
     order_keys = {
         'desc': 'desc',
@@ -106,11 +267,11 @@ def search_elastic(term='', user=None, sort='id', order='desc',
 
     # Only allow ID, desc if RSS
     if rss:
-        sort = es_sort_keys['id']
-        order = 'desc'
+        es_sort = es_sort_keys['id']
+        order_ = 'desc'
 
     # funky, es sort is default asc, prefixed by '-' if desc
-    if 'desc' == order:
+    if 'desc' == order_:
         es_sort = '-' + es_sort
 
     # Quality filter
@@ -161,7 +322,10 @@ def search_elastic(term='', user=None, sort='id', order='desc',
     if logged_in_user:
         same_user = user == logged_in_user.id
 
-    s = Search(using=es_client, index=app.config.get('ES_INDEX_NAME'))  # todo, sukebei prefix
+    s = Search(using=elastic.get_client(),
+               index=app.config.get('ES_INDEX_NAME'))  # todo, sukebei prefix
+    # Only what's listed
+    s = s.source(list(TorrentRow.ES_FIELDS))
 
     # Apply search term
     if term:
@@ -205,26 +369,51 @@ def search_elastic(term='', user=None, sort='id', order='desc',
             else:
                 s = s.filter('term', hidden=False)
 
+    # The filters chosen on the results page. With facets, they're applied after the
+    # aggregations, which then count what every other choice would give
+    category_filters = []
     if main_category:
-        s = s.filter('term', main_category_id=main_cat_id)
+        category_filters.append(Q('term', main_category_id=main_cat_id))
     elif sub_category:
-        s = s.filter('term', main_category_id=main_cat_id)
-        s = s.filter('term', sub_category_id=sub_cat_id)
+        category_filters.append(Q('term', main_category_id=main_cat_id))
+        category_filters.append(Q('term', sub_category_id=sub_cat_id))
 
+    quality_filters = []
     if quality_filter == 0:
         pass
-    elif quality_filter == 1:
-        s = s.filter('term', remake=False)
-    elif quality_filter == 2:
-        s = s.filter('term', trusted=True)
-    elif quality_filter == 3:
-        s = s.filter('term', complete=True)
+    elif quality_filter in _QUALITY_FILTERS:
+        quality_filters.append(_QUALITY_FILTERS[quality_filter])
+
+    facets = facets and not rss
+    for result_filter in category_filters + quality_filters:
+        s = s.post_filter(result_filter) if facets else s.filter(result_filter)
 
-    # Apply sort
-    s = s.sort(es_sort)
+    if facets:
+        # Counted in the same request as the results
+        _add_facet_aggs(s, category_filters, quality_filters)
 
+    # Apply sort, with the id breaking ties so that every result has a distinct cursor
+    if es_sort.lstrip('-') == 'id':
+        sort_fields = [es_sort]
+    else:
+        sort_fields = [es_sort, '-id' if 'desc' == order_ else 'id']
+
+    cursor = after or before
+    if cursor:
+        sort_value, torrent_id = _decode_cursor(cursor)
+        search_after = [sort_value, torrent_id][-len(sort_fields):]
+        if before:
+            # Going backwards, search in the opposite order and reverse the results afterwards
+            sort_fields = [f[1:] if f.startswith('-') else '-' + f for f in sort_fields]
+    s = s.sort(*sort_fields)
+
+    if cursor:
+        # search_after seeks like a database index, so there's no limit on how deep this goes.
+        # Fetch one extra result to know if there's another page
+        s = s.extra(search_after=search_after)
+        s = s[0:per_page + 1]
     # Only show first RESULTS_PER_PAGE items for RSS
-    if rss:
+    elif rss:
         s = s[0:per_page]
     else:
         max_page = min(page, int(math.ceil(max_search_results / float(per_page))))
@@ -240,7 +429,157 @@ def search_elastic(term='', user=None, sort='id', order='desc',
     # Return query, uncomment print line to debug query
     # from pprint import pprint
     # print(json.dumps(s.to_dict()))
-    return s.execute()
+    try:
+        response = s.params(request_timeout=elastic.request_timeout()).execute()
+    except (elastic.RequestBudgetExceeded, TransportError, ElasticsearchException) as e:
+        # TransportError covers connection errors and error responses (say, a shard
+        # failure), ElasticsearchException anything else the client raises
+        raise SearchUnavailable(str(e)) from e
+    return _make_elastic_results(response.to_dict(), per_page, after, before)
+
+
+# The filters of the quality_filter values other than 0 (show all)
+_QUALITY_FILTERS = {
+    1: Q('term', remake=False),  # No remakes
+    2: Q('term', trusted=True),  # Only trusted
+    3: Q('term', complete=True)  # Only completed
+}
+
+
+def _add_facet_aggs(s, category_filters, quality_filters):
+    ''' Adds the aggregations of the facets to a search, which has the given filters as
+        post filters. Each facet counts within the choice made on the other one, so the
+        quality counts are for the selected category and the other way around. '''
+    categories = s.aggs.bucket('categories', 'filter', Q('bool', filter=quality_filters))
+    main_categories = categories.bucket('main_categories', 'terms',
+                                        field='main_category_id', size=50)
+    main_categories.bucket('sub_categories', 'terms', field='sub_category_id', size=50)
+
+    quality = s.aggs.bucket('quality', 'filter', Q('bool', filter=category_filters))
+    quality.bucket('filters', 'filters',
+                   filters={str(key): value for key, value in _QUALITY_FILTERS.items()})
+
+
+def _facet_counts(aggregations):
+    ''' Returns the result counts in the aggregations of search_elastic, as
+        {'categories': [(category id, count, [(subcategory id, count), ...]), ...],
+         'quality': {quality filter: count}} with ids like '1_0' and '1_2' '''
+    categories = []
+    main_buckets = aggregations['categories']['main_categories']['buckets']
+    for main in sorted(main_buckets, key=lambda b: int(b['key'])):
+        sub_categories = [(main['key'] + '_' + sub['key'], sub['doc_count'])
+                          for sub in sorted(main['sub_categories']['buckets'],
+                                            key=lambda b: int(b['key']))]
+        categories.append((main['key'] + '_0', main['doc_count'], sub_categories))
+
+    quality = {key: bucket['doc_count']
+               for key, bucket in aggregations['quality']['filters']['buckets'].items()}
+    return {'categories': categories, 'quality': quality}
+
+
+def _hit_cursor(hit):
+    ''' Returns the cursor of a raw hit, from its sort values ([sort value, id] or [id]) '''
+    return _encode_cursor(hit['sort'][0], hit['sort'][-1])
+
+
+def _make_elastic_results(data, per_page, after=None, before=None):
+    ''' Returns the ElasticResults of a raw response, with the extra hit of cursor pages
+        dropped and the cursors set (None when there's nothing more that way) '''
+    hits = data['hits']['hits']
+    next_cursor = prev_cursor = None
+    if after or before:
+        has_more = len(hits) > per_page
+        hits = hits[:per_page]
+        if before:
+            hits.reverse()
+        if hits:
+            next_cursor = (has_more or before) and _hit_cursor(hits[-1]) or None
+            prev_cursor = (has_more or after) and _hit_cursor(hits[0]) or None
+    elif len(hits) == per_page:
+        # Offset pages are linked to by number, but the results can go on past the last one
+        next_cursor = _hit_cursor(hits[-1])
+
+    facets = _facet_counts(data['aggregations']) if 'aggregations' in data else None
+    return ElasticResults(hits, data['hits']['total'], next_cursor, prev_cursor, facets)
+
+
+class KeysetPagination(object):
+    ''' A page of search_db results selected by a cursor (after/before) instead of an offset.
+        Unlike flask_sqlalchemy's Pagination, there's no total or page number. '''
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _encode_cursor(sort_value, torrent_id):
+    ''' Returns an opaque cursor for the position of a result in the sort order '''
+    cursor = '{0}.{1}'.format(sort_value, torrent_id).encode('ascii')
+    return base64.urlsafe_b64encode(cursor).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    ''' Returns the (sort value, torrent id) of a cursor from _encode_cursor '''
+    try:
+        cursor = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, torrent_id = cursor.decode('ascii').split('.')
+        return int(sort_value), int(torrent_id)
+    except (ValueError, UnicodeError):
+        flask.abort(400)
+
+
+def _make_cursor(row, sort_column):
+    return _encode_cursor(getattr(row, sort_column.key), row.id)
+
+
+def _paginate_keyset(query, sort_column, id_column, order, per_page, after=None, before=None):
+    ''' Returns the KeysetPagination of results right after (or before) the given cursor.
+        Seeking to a cursor is an index range scan, so deep pages are as fast as the first. '''
+    cursor = after or before
+    sort_value, torrent_id = _decode_cursor(cursor)
+
+    if order not in ('asc', 'desc'):
+        raise ValueError('Unknown order {!r}'.format(order))
+    # Going backwards, fetch in the opposite order and reverse the results afterwards
+    descending = (order == 'desc') == bool(after)
+    # The leading range on the sort column alone is what lets databases seek in its index
+    if sort_column is id_column:
+        query = query.filter(id_column < torrent_id if descending else id_column > torrent_id)
+        query = query.order_by(id_column.desc() if descending else id_column.asc())
+    elif descending:
+        query = query.filter(sort_column <= sort_value,
+                             (sort_column < sort_value) | (id_column < torrent_id))
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.filter(sort_column >= sort_value,
+                             (sort_column > sort_value) | (id_column > torrent_id))
+        query = query.order_by(sort_column.asc(), id_column.asc())
+
+    # Fetch one extra result to know if there's another page
+    items = query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if not items:
+        return KeysetPagination(items, per_page)
+
+    if after:
+        next_cursor = has_more and _make_cursor(items[-1], sort_column) or None
+        prev_cursor = _make_cursor(items[0], sort_column)
+    else:
+        items.reverse()
+        next_cursor = _make_cursor(items[-1], sort_column)
+        prev_cursor = has_more and _make_cursor(items[0], sort_column) or None
+    return KeysetPagination(items, per_page, next_cursor, prev_cursor)
 
 
 class QueryPairCaller(object):
@@ -262,9 +601,53 @@ class QueryPairCaller(object):
         return wrapper
 
 
+def _load_rows(torrent_ids):
+    ''' Returns the TorrentRows of the given ids, in the same order, skipping ids that have
+        no row (any more). Torrents flagged as deleted are returned like the others. '''
+    if not torrent_ids:
+        return []
+    rows = (db.session.query(*_row_columns())
+            .select_from(models.Torrent)
+            .outerjoin(models.Statistic)
+            .filter(models.Torrent.id.in_(torrent_ids)))
+    rows_by_id = {row.id: row for row in rows}
+    return [TorrentRow.from_db_row(rows_by_id[torrent_id]) for torrent_id in torrent_ids
+            if torrent_id in rows_by_id]
+
+
+def _dump_db_results(results):
+    ''' Turns the results of search_db into ids (and page info) for the search cache '''
+    if isinstance(results, KeysetPagination):
+        return {'type': 'keyset', 'ids': [torrent.id for torrent in results.items],
+                'per_page': results.per_page, 'next_cursor': results.next_cursor,
+                'prev_cursor': results.prev_cursor}
+    if isinstance(results, Pagination):
+        return {'type': 'page', 'ids': [torrent.id for torrent in results.items],
+                'page': results.page, 'per_page': results.per_page, 'total': results.total,
+                'next_cursor': results.next_cursor}
+    # RSS torrents
+    return {'type': 'rss', 'ids': [torrent.id for torrent in results]}
+
+
+def _load_db_results(value):
+    torrent_ids = value['ids']
+    if value['type'] == 'keyset':
+        return KeysetPagination(_load_rows(torrent_ids), value['per_page'],
+                                value['next_cursor'], value['prev_cursor'])
+    if value['type'] == 'page':
+        pagination = Pagination(None, value['page'], value['per_page'], value['total'],
+                                _load_rows(torrent_ids))
+        pagination.next_cursor = value['next_cursor']
+        return pagination
+    return _load_rows(torrent_ids)
+
+
+@search_cache.cached('db', _dump_db_results, _load_db_results)
 def search_db(term='', user=None, sort='id', order='desc', category='0_0',
               quality_filter='0', page=1, rss=False, admin=False,
-              logged_in_user=None, per_page=75):
+              logged_in_user=None, per_page=75, after=None, before=None):
+    ''' Returns the list of TorrentRows for RSS, or a page of them: by offset (page) with
+        flask_sqlalchemy's Pagination, or right after/before a cursor with KeysetPagination. '''
     if page > 4294967295:
         flask.abort(404)
 
@@ -288,8 +671,9 @@ def search_db(term='', user=None, sort='id', order='desc', category='0_0',
         'asc': 'asc'
     }
 
-    order_ = order.lower()
-    if order_ not in order_keys:
+    # Normalized here, as the keyset and offset pagination below pick directions by name
+    order = order.lower()
+    if order not in order_keys:
         flask.abort(400)
 
     filter_keys = {
@@ -350,6 +734,11 @@ def search_db(term='', user=None, sort='id', order='desc', category='0_0',
     count_query = db.session.query(sqlalchemy.func.count(model_class.id))
     qpc = QueryPairCaller(query, count_query)
 
+    # Browsing totals come from the maintained counts (see models.BrowseCountBase), as
+    # counting torrents with flag filters is slow. Counted flags are tracked with the filters.
+    use_browse_counts = app.config.get('USE_BROWSE_COUNTS') and not (user or term or rss)
+    flags_set = flags_unset = 0
+
     # User view (/user/username)
     if user:
         qpc.filter(models.Torrent.uploader_id == user)
@@ -375,6 +764,8 @@ def search_db(term='', user=None, sort='id', order='desc', category='0_0',
             # Hide all DELETED torrents if regular user
             qpc.filter(models.Torrent.flags.op('&')(
                 int(models.TorrentFlags.DELETED)).is_(False))
+            # Hidden torrents aren't counted either, own ones are added to the count below
+            flags_unset |= models.TorrentFlags.DELETED | models.TorrentFlags.HIDDEN
             # If logged in, show all torrents that aren't hidden unless they belong to you
             # On RSS pages, show all public torrents and nothing more.
             if logged_in_user and not rss:
@@ -395,6 +786,10 @@ def search_db(term='', user=None, sort='id', order='desc', category='0_0',
     if filter_tuple:
         qpc.filter(models.Torrent.flags.op('&')(
             int(filter_tuple[0])).is_(filter_tuple[1]))
+        if filter_tuple[1]:
+            flags_set |= filter_tuple[0]
+        else:
+            flags_unset |= filter_tuple[0]
 
     if term:
         for item in shlex.split(term, posix=False):
@@ -403,17 +798,52 @@ def search_db(term='', user=None, sort='id', order='desc', category='0_0',
                     item, models.TorrentNameSearch, FullTextMode.NATURAL))
 
     query, count_query = qpc.items
-    # Sort and order
+    # Sort and order, by id on ties so the order is the same for offset and keyset pages.
+    # Secondary indexes end with the primary key, so both columns are read off one index.
+    id_column = models.Torrent.id
     if sort_column.class_ != models.Torrent:
         index_name = _get_index_name(sort_column)
         query = query.join(sort_column.class_)
         query = query.with_hint(sort_column.class_, 'USE INDEX ({0})'.format(index_name))
-
-    query = query.order_by(getattr(sort_column, order)())
+        id_column = models.Statistic.torrent_id
+    else:
+        query = query.outerjoin(models.Statistic)
+    # Just the listed columns, without loading Torrents
+    query = query.with_entities(*_row_columns())
+
+    if (after or before) and not rss:
+        pagination = _paginate_keyset(query, sort_column, id_column, order, per_page,
+                                      after, before)
+        pagination.items = [TorrentRow.from_db_row(row) for row in pagination.items]
+        return pagination
+
+    if sort_column is id_column:
+        query = query.order_by(getattr(sort_column, order)())
+    else:
+        query = query.order_by(getattr(sort_column, order)(), getattr(id_column, order)())
+
+    total = None
+    if use_browse_counts:
+        total = models.BrowseCount.count_torrents(
+            main_cat_id if (main_category or sub_category) else None,
+            sub_cat_id if sub_category else None,
+            flags_set, flags_unset)
+        if logged_in_user and not admin:
+            # Only the viewer's own hidden torrents are left to count, through their index
+            total += count_query.filter(
+                models.Torrent.uploader_id == logged_in_user.id,
+                models.Torrent.flags.op('&')(int(models.TorrentFlags.HIDDEN)).is_(True)).scalar()
 
     if rss:
-        query = query.limit(per_page)
+        query = [TorrentRow.from_db_row(row) for row in query.limit(per_page)]
     else:
-        query = query.paginate_faste(page, per_page=per_page, step=5, count_query=count_query)
+        query = query.paginate_faste(page, per_page=per_page, step=5, count_query=count_query,
+                                     total=total)
+        query.items = [TorrentRow.from_db_row(row) for row in query.items]
+        # Lets offset pages link to the keyset page following them
+        if query.has_next and query.items:
+            query.next_cursor = _make_cursor(query.items[-1], sort_column)
+        else:
+            query.next_cursor = None
 
     return query
@@ -0,0 +1,201 @@
+""" A cache for search results, keyed by the normalized search arguments.
+
+    Results are stored JSON-encoded, in one of these backends (SEARCH_CACHE):
+      'memory'          an LRU cache in each process
+      'memcached'       a memcached server (SEARCH_CACHE_SERVER), shared by all processes
+      'local-memcached' an in-process stand-in for memcached, for development and tests
+
+    Entries expire after SEARCH_CACHE_TTL seconds; nothing is invalidated on changes.
+    Hits and misses are counted in `stats`, and sent to statsd when STATSD_ADDRESS is set.
+"""
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import time
+from collections import Counter
+
+import flask
+
+from nyaa import utils
+
+app = flask.current_app
+log = logging.getLogger(__name__)
+
+__all__ = ['cached', 'get_cache', 'create_cache', 'make_key', 'visibility_class', 'stats',
+           'MemoryCache', 'KeyValueCache', 'LocalKeyValueClient']
+
+# Hits and misses per namespace, such as 'db.hit'
+stats = Counter()
+
+
+class MemoryCache(object):
+    ''' An in-process LRU cache of at most maxsize entries and max_bytes of values '''
+
+    def __init__(self, maxsize=10000, max_bytes=None):
+        self._items = utils.LRUCache(maxsize=maxsize, max_bytes=max_bytes)
+
+    def get(self, key):
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic():
+            self._items.pop(key)
+            return None
+        return entry.value
+
+    def set(self, key, value, ttl):
+        self._items[key] = _MemoryCacheEntry(value, time.monotonic() + ttl)
+
+
+class _MemoryCacheEntry(object):
+    __slots__ = ('value', 'expires')
+
+    def __init__(self, value, expires):
+        self.value = value
+        self.expires = expires
+
+    def __len__(self):
+        return len(self.value)
+
+
+class KeyValueCache(object):
+    ''' A cache in an external key-value store, through a client with memcached's
+        get(key) and set(key, value, expire) (such as pymemcache's).
+        Keys are hashed to fit memcached's key restrictions. '''
+
+    def __init__(self, client, prefix='nyaa-search:'):
+        self.client = client
+        self.prefix = prefix
+
+    def _store_key(self, key):
+        return self.prefix + hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        try:
+            return self.client.get(self._store_key(key))
+        except Exception:
+            # An unavailable cache shouldn't take searches down with it
+            log.exception('Search cache get failed')
+            return None
+
+    def set(self, key, value, ttl):
+        try:
+            self.client.set(self._store_key(key), value, expire=ttl)
+        except Exception:
+            log.exception('Search cache set failed')
+
+
+class LocalKeyValueClient(object):
+    ''' Stands in for a memcached client, keeping everything in the process '''
+
+    def __init__(self):
+        self._items = {}
+
+    def get(self, key):
+        value, expires = self._items.get(key, (None, None))
+        if expires is not None and expires < time.monotonic():
+            del self._items[key]
+            return None
+        return value
+
+    def set(self, key, value, expire=0):
+        self._items[key] = (value, time.monotonic() + expire if expire else None)
+        return True
+
+
+def create_cache(config):
+    ''' Creates the cache set in config (SEARCH_CACHE), or returns None if disabled '''
+    backend = config.get('SEARCH_CACHE')
+    if not backend:
+        return None
+    if backend == 'memory':
+        return MemoryCache(config.get('SEARCH_CACHE_SIZE', 10000),
+                           config.get('SEARCH_CACHE_BYTES', 64 * 1024 * 1024))
+    if backend == 'memcached':
+        from pymemcache.client.base import Client
+        return KeyValueCache(Client(config.get('SEARCH_CACHE_SERVER', ('localhost', 11211)),
+                                    connect_timeout=1, timeout=0.5))
+    if backend == 'local-memcached':
+        return KeyValueCache(LocalKeyValueClient())
+    raise ValueError('Unknown SEARCH_CACHE {!r}'.format(backend))
+
+
+_cache = None
+_statsd = None
+
+
+def get_cache():
+    ''' Returns the search cache of the app (or None), created on first use '''
+    global _cache
+    if _cache is None:
+        _cache = create_cache(app.config) or False
+    return _cache or None
+
+
+def _count(name):
+    global _statsd
+    stats[name] += 1
+
+    statsd_address = app.config.get('STATSD_ADDRESS')
+    if statsd_address:
+        if _statsd is None:
+            from statsd import StatsClient
+            _statsd = StatsClient(*statsd_address, prefix='nyaa.search_cache')
+        _statsd.incr(name)
+
+
+def visibility_class(user=None, rss=False, admin=False, logged_in_user=None):
+    ''' Returns who a search's results are for: admins see everything, and logged in users
+        their own hidden torrents (unless on RSS or another user's page), but others all see
+        the same results '''
+    if admin:
+        return 'admin'
+    if logged_in_user and not rss and (not user or user == logged_in_user.id):
+        return 'user:{}'.format(logged_in_user.id)
+    return 'public'
+
+
+def make_key(namespace, search_args):
+    ''' Returns the cache key for the arguments of a search function '''
+    args = dict(search_args)
+    # Results depend on what the searcher may see, not on who they are
+    args['visibility'] = visibility_class(args.get('user'), args.get('rss'),
+                                          args.pop('admin', False),
+                                          args.pop('logged_in_user', None))
+    args['term'] = ' '.join((args.get('term') or '').split())
+    for name in ('sort', 'order', 'quality_filter'):
+        if isinstance(args.get(name), str):
+            args[name] = args[name].lower()
+    return namespace + ':' + json.dumps(args, sort_keys=True)
+
+
+def cached(namespace, dump, load):
+    ''' Decorates a search function to cache its results, turned into JSON-compatible
+        values with dump(result) and back with load(value) '''
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            if cache is None:
+                return func(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = make_key(namespace, bound.arguments)
+
+            value = cache.get(key)
+            if value is not None:
+                _count(namespace + '.hit')
+                return load(json.loads(value.decode('utf-8')))
+
+            _count(namespace + '.miss')
+            result = func(*args, **kwargs)
+            cache.set(key, json.dumps(dump(result)).encode('utf-8'),
+                      app.config.get('SEARCH_CACHE_TTL', 60))
+            return result
+        return wrapper
+    return decorator
@@ -68,11 +68,22 @@ $(document).ready(function() {
 		$(this).css({ 'visibility': 'hidden', 'opacity': 0 });
 	});
 
-	// Collapsible file lists
-	$('.torrent-file-list a.folder').click(function(e) {
+	// Collapsible file lists, loaded a directory at a time for big torrents
+	$('.torrent-file-list').on('click', 'a.folder', function(e) {
 		e.preventDefault();
+		var $list = $(this).next(),
+			filesUrl = $(this).closest('.torrent-file-list').data('files-url');
+
+		if (filesUrl && !$list.data('loaded')) {
+			$list.data('loaded', true);
+			_load_file_list($list, filesUrl, $list.data('path'), 0);
+		}
 		$(this).blur().children('i').toggleClass('fa-folder-open fa-folder');
-		$(this).next().stop().slideToggle(250);
+		$list.stop().slideToggle(250);
+	});
+
+	$('.torrent-file-list[data-files-url]').each(function() {
+		_load_file_list($(this).children('ul'), $(this).data('files-url'), [], 0);
 	});
 
 	// Comment editing below
@@ -123,6 +134,69 @@ $(document).ready(function() {
 	})
 });
 
+function _load_file_list($list, filesUrl, path, cursor, $more) {
+	$.getJSON(filesUrl, $.param({ path: path, cursor: cursor }, true)).done(function(data) {
+		$list.children('.file-list-more, .file-list-error').remove();
+
+		$.each(data.entries, function(i, entry) {
+			var $item = $('<li/>');
+			if (entry.type === 'directory') {
+				$item.append(
+					$('<a href="" class="folder"/>').append($('<i class="fa fa-folder"/>'))
+						.append(document.createTextNode(entry.name)),
+					' ',
+					$('<span class="file-size"/>').text('(' + entry.file_count + ' files, ' +
+						_format_file_size(entry.size) + ')'),
+					$('<ul/>').data('path', path.concat([entry.name])));
+			} else {
+				$item.append(
+					$('<i class="fa fa-file"/>'),
+					document.createTextNode(entry.name + ' '),
+					$('<span class="file-size"/>').text('(' + _format_file_size(entry.size) + ')'));
+			}
+			$list.append($item);
+		});
+
+		if (data.next_cursor !== null) {
+			var moreText = 'Show more (' + (data.count - data.next_cursor) + ' left)',
+				$next = $('<a href=""/>').text(moreText).data('text', moreText);
+			$next.click(function(e) {
+				e.preventDefault();
+				if (!$next.data('loading')) {
+					$next.data('loading', true).text('Loading...');
+					_load_file_list($list, filesUrl, path, data.next_cursor, $next);
+				}
+			});
+			$list.append($('<li class="file-list-more"/>').append($next));
+		}
+	}).fail(function() {
+		if ($more) {
+			// Let the next page be tried again
+			$more.data('loading', false).text($more.data('text'));
+		} else {
+			$list.data('loaded', false);
+		}
+		$list.children('.file-list-error').remove();
+		$list.append($('<li class="file-list-error"/>').text('Could not load the file list.'));
+	});
+}
+
+// Same as Jinja's filesizeformat(binary=True)
+function _format_file_size(bytes) {
+	var units = ['KiB', 'MiB', 'GiB', 'TiB', 'PiB', 'EiB', 'ZiB', 'YiB'];
+	if (bytes === 1) {
+		return '1 Byte';
+	} else if (bytes < 1024) {
+		return bytes + ' Bytes';
+	}
+	for (var i = 0; i < units.length; i++) {
+		var unit = Math.pow(1024, i + 2);
+		if (bytes < unit || i === units.length - 1) {
+			return (1024 * bytes / unit).toFixed(1) + ' ' + units[i];
+		}
+	}
+}
+
 function _format_time_difference(seconds) {
 	var units = [
 		["year", 365*24*60*60],
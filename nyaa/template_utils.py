@@ -1,41 +1,18 @@
 import os.path
 import re
-from base64 import b32encode
 from datetime import datetime
 from email.utils import formatdate
-from urllib.parse import urlencode
 
 import flask
 from werkzeug.urls import url_encode
 
 from nyaa.backend import get_category_id_map
-from nyaa.torrents import get_default_trackers
 
 app = flask.current_app
 bp = flask.Blueprint('template-utils', __name__)
 _static_cache = {}  # For static_cachebuster
 
 
-# ######################## CONTEXT PROCESSORS ########################
-
-# For processing ES links
-@bp.app_context_processor
-def create_magnet_from_es_info():
-    def _create_magnet_from_es_info(display_name, info_hash, max_trackers=5, trackers=None):
-        if trackers is None:
-            trackers = get_default_trackers()
-
-        magnet_parts = [
-            ('dn', display_name)
-        ]
-        for tracker in trackers[:max_trackers]:
-            magnet_parts.append(('tr', tracker))
-
-        b32_info_hash = b32encode(bytes.fromhex(info_hash)).decode('utf-8')
-        return 'magnet:?xt=urn:btih:' + b32_info_hash + '&' + urlencode(magnet_parts)
-    return dict(create_magnet_from_es_info=_create_magnet_from_es_info)
-
-
 # ######################### TEMPLATE GLOBALS #########################
 
 @bp.app_template_global()
@@ -67,6 +44,9 @@ def modify_query(**new_values):
     args = flask.request.args.copy()
 
     args.pop('p', None)
+    # Keyset pagination cursors only apply to the current sort
+    args.pop('after', None)
+    args.pop('before', None)
 
     for key, value in new_values.items():
         args[key] = value
@@ -89,13 +69,6 @@ def category_name(cat_id):
 
 # ######################### TEMPLATE FILTERS #########################
 
-@bp.app_template_filter('utc_time')
-def get_utc_timestamp(datetime_str):
-    """ Returns a UTC POSIX timestamp, as seconds """
-    UTC_EPOCH = datetime.utcfromtimestamp(0)
-    return int((datetime.strptime(datetime_str, '%Y-%m-%dT%H:%M:%S') - UTC_EPOCH).total_seconds())
-
-
 @bp.app_template_filter('utc_timestamp')
 def get_utc_timestamp_seconds(datetime_instance):
     """ Returns a UTC POSIX timestamp, as seconds """
@@ -103,21 +76,11 @@ def get_utc_timestamp_seconds(datetime_instance):
     return int((datetime_instance - UTC_EPOCH).total_seconds())
 
 
-@bp.app_template_filter('display_time')
-def get_display_time(datetime_str):
-    return datetime.strptime(datetime_str, '%Y-%m-%dT%H:%M:%S').strftime('%Y-%m-%d %H:%M')
-
-
 @bp.app_template_filter('rfc822')
 def _jinja2_filter_rfc822(date, fmt=None):
     return formatdate(date.timestamp())
 
 
-@bp.app_template_filter('rfc822_es')
-def _jinja2_filter_rfc822_es(datestr, fmt=None):
-    return formatdate(datetime.strptime(datestr, '%Y-%m-%dT%H:%M:%S').timestamp())
-
-
 @bp.app_template_filter()
 def timesince(dt, default='just now'):
     """
@@ -7,13 +7,30 @@ from flask import current_app as app
 
 from orderedset import OrderedSet
 
-from nyaa import bencode
+from nyaa import bencode, utils
 
 USED_TRACKERS = OrderedSet()
 
+# Bumped whenever the trackers put into torrent files may have changed.
+# This only covers the current process: other workers don't see the bump and keep
+# serving their cached torrent files until they're evicted or the worker restarts.
+_tracker_generation = 0
+
+
+def bump_tracker_generation():
+    ''' Marks torrent files assembled so far (and cached) by this process as outdated '''
+    global _tracker_generation
+    _tracker_generation += 1
+
+
+def tracker_generation():
+    ''' Returns a value that changes along with the trackers added to torrent files '''
+    return _tracker_generation, app.config.get('MAIN_ANNOUNCE_URL')
+
 
 def read_trackers_from_file(file_object):
     USED_TRACKERS.clear()
+    bump_tracker_generation()
 
     for line in file_object:
         line = line.strip()
@@ -124,6 +141,13 @@ def create_bencoded_torrent(torrent, bencoded_info, metadata_base=None):
     ''' Creates a bencoded torrent metadata for a given torrent,
         optionally using a given metadata_base dict (note: 'info' key will be
         popped off the dict) '''
+    prefix, suffix = create_bencoded_torrent_parts(torrent, metadata_base)
+    return b''.join((prefix, bencoded_info, suffix))
+
+
+def create_bencoded_torrent_parts(torrent, metadata_base=None):
+    ''' Returns the bencoded torrent metadata for a given torrent as (prefix, suffix),
+        to be put around the bencoded info dict. See create_bencoded_torrent. '''
     if metadata_base is None:
         metadata_base = create_default_metadata_base(torrent)
 
@@ -131,12 +155,238 @@ def create_bencoded_torrent(torrent, bencoded_info, metadata_base=None):
 
     # Make sure info doesn't exist on the base
     metadata_base.pop('info', None)
-    prefixed_dict = {key: metadata_base[key] for key in metadata_base if key < 'info'}
-    suffixed_dict = {key: metadata_base[key] for key in metadata_base if key > 'info'}
 
-    prefix = bencode.encode(prefixed_dict)
-    suffix = bencode.encode(suffixed_dict)
+    # Write the dict by hand, leaving the stored info dict out at its sorted position
+    prefix = bytearray(b'd')
+    suffix = bytearray()
+    for key in sorted(metadata_base.keys()):
+        out = prefix if key < 'info' else suffix
+        bencode.encode_into(key, out)
+        bencode.encode_into(metadata_base[key], out)
+    prefix += b'4:info'
+    suffix += b'e'
+
+    return bytes(prefix), bytes(suffix)
+
+
+# Characters not allowed in torrent paths
+# TODO Move to config.py
+FILENAME_CHARACTER_BLACKLIST = [
+    '\u202E',  # RIGHT-TO-LEFT OVERRIDE
+]
+
+
+class MalformedTorrentException(Exception):
+    ''' Raised by parse_torrent_metadata. part is the part of the metadata at fault,
+        'metadata' or 'trackers' '''
+
+    def __init__(self, message, part='metadata'):
+        super().__init__(message)
+        self.part = part
+
+
+class TorrentFileData(object):
+    """Quick and dirty class to pass data from the validator"""
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+
+# Metadata may also be decoded with bencode.decode_lazy, long bytestrings being memoryviews
+_DICT_TYPES = (dict, bencode.LazyDict)
+_LIST_TYPES = (list, bencode.LazyList)
+_BYTES_TYPES = (bytes, memoryview)
+
+
+# https://wiki.theory.org/BitTorrentSpecification#Metainfo_File_Structure
+def parse_torrent_metadata(torrent_dict, tracker_to_check_for=None):
+    ''' Validates and normalizes a decoded torrent metadata dict in a single pass,
+        raising MalformedTorrentException on errors.
+        Returns a TorrentFileData with the torrent_dict ('key.utf-8' values moved to
+        'key'), the decoded name and encoding, filesize, a sorted file_tree, trackers
+        and webseeds, whether tracker_to_check_for is one of the trackers (tracker_found),
+        private and whether a path has blacklisted characters (has_forbidden_filenames). '''
+    try:
+        torrent_data = _parse_metadata(torrent_dict)
+    except AssertionError as e:
+        raise MalformedTorrentException(e.args[0], 'metadata')
+
+    try:
+        torrent_data.trackers, torrent_data.tracker_found = _parse_trackers(
+            torrent_dict, tracker_to_check_for)
+    except AssertionError as e:
+        raise MalformedTorrentException(e.args[0], 'trackers')
+
+    return torrent_data
+
+
+def _parse_metadata(torrent_dict):
+    assert isinstance(torrent_dict, _DICT_TYPES), 'torrent metadata is not a dict'
+    _replace_utf8_keys(torrent_dict)
+
+    info_dict = torrent_dict.get('info')
+    assert info_dict is not None, 'no info_dict in torrent'
+    assert isinstance(info_dict, _DICT_TYPES), 'info is not a dict'
+    utf8_info_keys = _replace_utf8_keys(info_dict)
+
+    encoding_bytes = torrent_dict.get('encoding', b'utf-8')
+    encoding_string = _validate_bytes(encoding_bytes, 'encoding', test_decode='utf-8')
+    encoding = encoding_string.lower()
+
+    # Values from 'key.utf-8' are UTF-8 regardless of the torrent's encoding
+    name = info_dict.get('name')
+    name_string = _validate_bytes(name, 'name',
+                                  test_decode='utf-8' if 'name' in utf8_info_keys else encoding)
+    has_forbidden_filenames = _has_blacklisted_characters(name_string)
+
+    piece_length = info_dict.get('piece length')
+    _validate_number(piece_length, 'piece length', check_positive=True)
+
+    pieces = info_dict.get('pieces')
+    _validate_bytes(pieces, 'pieces')
+    assert len(pieces) % 20 == 0, 'pieces length is not a multiple of 20'
+
+    file_tree = {}
+    files = info_dict.get('files')
+    if files is not None:
+        _validate_list(files, 'filelist')
+
+        # If multi-file, use the directory name as root for files
+        file_tree_root = file_tree.setdefault(name_string, {}) if files else file_tree
+        filesize = 0
+
+        for file_dict in files:
+            assert isinstance(file_dict, _DICT_TYPES), 'file is not a dict'
+            path_encoding = 'utf-8' if 'path' in _replace_utf8_keys(file_dict) else encoding
+
+            file_length = file_dict.get('length')
+            _validate_number(file_length, 'file length', check_positive_or_zero=True)
+            filesize += file_length
+
+            path_list = file_dict.get('path')
+            _validate_list(path_list, 'path', check_empty=True)
+
+            # Validate possible directory names
+            current_directory = file_tree_root
+            for path_part in path_list[:-1]:
+                directory = _validate_bytes(path_part, 'path part', test_decode=path_encoding)
+                has_forbidden_filenames = (has_forbidden_filenames or
+                                           _has_blacklisted_characters(directory))
+
+                current_directory = current_directory.setdefault(directory, {})
+                assert isinstance(current_directory, dict), 'path part is also a filename'
+
+            # Validate actual filename, allow b'' to specify an empty directory
+            filename = _validate_bytes(path_list[-1], 'filename', check_empty=False,
+                                       test_decode=path_encoding)
+            has_forbidden_filenames = (has_forbidden_filenames or
+                                       _has_blacklisted_characters(filename))
+
+            # Don't add empty filenames (BitComet directory)
+            if filename:
+                current_directory[filename] = file_length
+
+    else:
+        filesize = info_dict.get('length')
+        _validate_number(filesize, 'length', check_positive=True)
+
+    if not files:
+        # If single-file, the root will be the file-tree (no directory)
+        file_tree[name_string] = filesize
+
+    return TorrentFileData(torrent_dict=torrent_dict,
+                           name=name_string,
+                           encoding=encoding_string,
+                           filesize=filesize,
+                           file_tree=utils.sorted_pathdict(file_tree),
+                           webseeds=_parse_webseeds(torrent_dict),
+                           private=info_dict.get('private') == 1,
+                           has_forbidden_filenames=has_forbidden_filenames)
+
+
+def _parse_trackers(torrent_dict, tracker_to_check_for=None):
+    trackers = OrderedSet()
+
+    announce = torrent_dict.get('announce')
+    assert announce is not None, 'no tracker in torrent'
+    trackers.add(_validate_bytes(announce, 'announce', test_decode='utf-8'))
+
+    # List of lists with single item
+    announce_list = torrent_dict.get('announce-list')
+    if announce_list is not None:
+        _validate_list(announce_list, 'announce-list')
+
+        for announce in announce_list:
+            _validate_list(announce, 'announce-list item', check_empty=True)
+            trackers.add(_validate_bytes(
+                announce[0], 'announce-list item url', test_decode='utf-8'))
+
+    tracker_found = False
+    if tracker_to_check_for:
+        tracker_to_check_for = tracker_to_check_for.lower()
+        tracker_found = any(tracker.lower() == tracker_to_check_for for tracker in trackers)
+
+    return trackers, tracker_found
+
+
+# http://www.bittorrent.org/beps/bep_0019.html
+def _parse_webseeds(torrent_dict):
+    webseed_list = torrent_dict.get('url-list')
+    if isinstance(webseed_list, _BYTES_TYPES):
+        # url-list should be omitted in case of no webseeds. However.
+        # qBittorrent has an empty bytestring for no webseeds,
+        # a bytestring for one and a list for multiple, so:
+        # In case of a empty, keep as-is for next if.
+        # In case of one, wrap it in a list.
+        webseed_list = webseed_list and [webseed_list]
+
+    webseeds = OrderedSet()
+    # Merely check for truthiness ([], '' or a list with items)
+    if webseed_list:
+        _validate_list(webseed_list, 'url-list')
+
+        for webseed_url in webseed_list:
+            webseeds.add(_validate_bytes(webseed_url, 'url-list item', test_decode='utf-8'))
+
+    return webseeds
+
+
+def _replace_utf8_keys(source_dict):
+    ''' Replaces 'property' with 'property.utf-8' and removes the latter, returning
+        the replaced keys. Thanks, bitcomet! :/ '''
+    replaced_keys = []
+    for key in [key for key in source_dict.keys() if key.endswith('.utf-8')]:
+        plain_key = key[:-len('.utf-8')]
+        source_dict[plain_key] = source_dict.pop(key)
+        replaced_keys.append(plain_key)
+    return replaced_keys
+
+
+def _has_blacklisted_characters(path_part):
+    return any(c in path_part for c in FILENAME_CHARACTER_BLACKLIST)
+
+
+def _validate_bytes(value, name='value', check_empty=True, test_decode=None):
+    assert isinstance(value, _BYTES_TYPES), name + ' is not bytes'
+    if check_empty:
+        assert len(value) > 0, name + ' is empty'
+    if test_decode:
+        try:
+            return str(value, test_decode)
+        except UnicodeError:
+            raise AssertionError(name + ' could not be decoded from ' + repr(test_decode))
+
+
+def _validate_number(value, name='value', check_positive=False, check_positive_or_zero=False):
+    assert isinstance(value, int), name + ' is not an int'
+    if check_positive_or_zero:
+        assert value >= 0, name + ' is less than 0'
+    elif check_positive:
+        assert value > 0, name + ' is not positive'
 
-    bencoded_torrent = prefix[:-1] + b'4:info' + bencoded_info + suffix[1:]
 
-    return bencoded_torrent
+def _validate_list(value, name='value', check_empty=False):
+    assert isinstance(value, _LIST_TYPES), name + ' is not a list'
+    if check_empty:
+        assert len(value) > 0, name + ' is empty'
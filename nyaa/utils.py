@@ -42,6 +42,53 @@ def cached_function(f):
     return decorator
 
 
+class LRUCache(object):
+    """ A mapping of at most maxsize items, dropping the least recently used ones.
+        With max_bytes, the total len() of the values is kept under it as well. """
+
+    def __init__(self, maxsize=1024, max_bytes=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            self._items.move_to_end(key)
+        except KeyError:
+            return default
+        return self._items[key]
+
+    def __setitem__(self, key, value):
+        self.pop(key)
+        if self.max_bytes is not None:
+            if len(value) > self.max_bytes:
+                return  # Would push everything else out
+            self.total_bytes += len(value)
+        self._items[key] = value
+        while len(self._items) > self.maxsize or \
+                (self.max_bytes is not None and self.total_bytes > self.max_bytes):
+            _, dropped = self._items.popitem(last=False)
+            if self.max_bytes is not None:
+                self.total_bytes -= len(dropped)
+
+    def pop(self, key, default=None):
+        value = self._items.pop(key, default)
+        if self.max_bytes is not None and value is not default:
+            self.total_bytes -= len(value)
+        return value
+
+    def clear(self):
+        self._items.clear()
+        self.total_bytes = 0
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
 def flatten_dict(d, result=None):
     if result is None:
         result = {}
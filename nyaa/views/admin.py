@@ -2,7 +2,7 @@ from ipaddress import ip_address
 
 import flask
 
-from nyaa import forms, models
+from nyaa import elastic, forms, models, search_cache
 from nyaa.extensions import db
 
 bp = flask.Blueprint('admin', __name__, url_prefix='/admin')
@@ -22,6 +22,18 @@ def view_adminlog():
                                  adminlog=logs)
 
 
+@bp.route('/stats', endpoint='stats', methods=['GET'])
+def view_stats():
+    ''' Stats of this process: Elasticsearch requests and connections, search cache hits '''
+    if not flask.g.user or not flask.g.user.is_superadmin:
+        flask.abort(403)
+
+    return flask.jsonify({
+        'elasticsearch': elastic.get_stats(),
+        'search_cache': dict(search_cache.stats),
+    })
+
+
 @bp.route('/bans', endpoint='bans', methods=['GET', 'POST'])
 def view_adminbans():
     if not flask.g.user or not flask.g.user.is_moderator:
@@ -7,10 +7,11 @@ from ipaddress import ip_address
 import flask
 from flask_paginate import Pagination
 
-from nyaa import models
+from nyaa import conditional, models
 from nyaa.extensions import db
 from nyaa.search import (DEFAULT_MAX_SEARCH_RESULT, DEFAULT_PER_PAGE, SERACH_PAGINATE_DISPLAY_MSG,
-                         _generate_query_string, search_db, search_elastic)
+                         SearchUnavailable, _generate_query_string, elastic_browse_failed,
+                         search_db, search_elastic, use_elastic_browse)
 from nyaa.utils import chain_get
 from nyaa.views.account import logout
 
@@ -83,6 +84,11 @@ def home(rss):
     except (ValueError, TypeError):
         page_number = 1
 
+    # Cursors for keyset pagination (see search_db and search_elastic), used instead of
+    # the page number
+    after = req_args.get('after')
+    before = req_args.get('before')
+
     # Check simply if the key exists
     use_magnet_links = 'magnets' in req_args or 'm' in req_args
 
@@ -129,7 +135,9 @@ def home(rss):
         'quality_filter': quality_filter or '0',
         'page': page_number,
         'rss': render_as_rss,
-        'per_page': results_per_page
+        'per_page': results_per_page,
+        'after': after,
+        'before': before
     }
 
     if flask.g.user:
@@ -145,42 +153,52 @@ def home(rss):
         # Redirect user from search to the torrent if we found one with the specific info_hash
         return flask.redirect(flask.url_for('torrents.view', torrent_id=infohash_torrent.id))
 
-    # If searching, we get results from elastic search
+    # Searches get results from elastic search, and so does browsing with USE_ELASTIC_BROWSE
     use_elastic = app.config.get('USE_ELASTIC_SEARCH')
-    if use_elastic and search_term:
-        query_args['term'] = search_term
-
+    query_results = None
+    if use_elastic and (search_term or
+                        use_elastic_browse(query_args['page'], results_per_page)):
         max_search_results = app.config.get('ES_MAX_SEARCH_RESULT', DEFAULT_MAX_SEARCH_RESULT)
 
         # Only allow up to (max_search_results / page) pages
         max_page = min(query_args['page'], int(math.ceil(max_search_results / results_per_page)))
 
-        query_args['page'] = max_page
-        query_args['max_search_results'] = max_search_results
+        es_query_args = dict(query_args, term=search_term or '', page=max_page,
+                             max_search_results=max_search_results)
+        if search_term:
+            es_query_args['facets'] = app.config.get('ENABLE_ELASTIC_SEARCH_FACETS', False)
 
-        query_results = search_elastic(**query_args)
+        try:
+            query_results = search_elastic(**es_query_args)
+        except SearchUnavailable:
+            if search_term:
+                flask.abort(503)
+            # The database can serve browsing just as well, if slower
+            elastic_browse_failed()
 
+    if query_results is not None:
         if render_as_rss:
             return render_rss(
-                '"{}"'.format(search_term), query_results,
+                '"{}"'.format(search_term) if search_term else 'Home', query_results,
                 use_elastic=True, magnet_links=use_magnet_links)
         else:
             rss_query_string = _generate_query_string(
                 search_term, category, quality_filter, user_name)
-            max_results = min(max_search_results, query_results['hits']['total'])
+            max_results = min(max_search_results, query_results.total)
             # change p= argument to whatever you change page_parameter to or pagination breaks
-            pagination = Pagination(p=query_args['page'], per_page=results_per_page,
+            pagination = Pagination(p=es_query_args['page'], per_page=results_per_page,
                                     total=max_results, bs_version=3, page_parameter='p',
                                     display_msg=SERACH_PAGINATE_DISPLAY_MSG)
             return flask.render_template('home.html',
                                          use_elastic=True,
                                          pagination=pagination,
                                          torrent_query=query_results,
-                                         search=query_args,
+                                         search=es_query_args,
                                          rss_filter=rss_query_string,
                                          special_results=special_results)
     else:
-        # If ES is enabled, default to db search for browsing
+        # If ES is enabled, default to db search for browsing (unless browsing from ES,
+        # and it's unavailable)
         if use_elastic:
             query_args['term'] = ''
         else:  # Otherwise, use db search for everything
@@ -204,14 +222,30 @@ def home(rss):
 
 
 def render_rss(label, query, use_elastic, magnet_links=False):
+    if use_elastic:
+        torrent_query = query.items
+        # Elasticsearch feeds link to the next page of results, for walking through all of them
+        next_cursor = query.next_cursor
+    else:
+        torrent_query = query
+        next_cursor = None
+
+    # Feed readers poll often, so validate against the listed torrents before rendering
+    etag = conditional.make_etag(label, magnet_links,
+                                 [torrent.values() for torrent in torrent_query])
+
+    not_modified = conditional.not_modified(etag=etag, per_user=True)
+    if not_modified:
+        return not_modified
+
     rss_xml = flask.render_template('rss.xml',
-                                    use_elastic=use_elastic,
                                     magnet_links=magnet_links,
                                     term=label,
                                     site_url=flask.request.url_root,
-                                    torrent_query=query)
+                                    torrent_query=torrent_query,
+                                    next_cursor=next_cursor)
     response = flask.make_response(rss_xml)
     response.headers['Content-Type'] = 'application/xml'
     # Cache for an hour
     response.headers['Cache-Control'] = 'max-age={}'.format(1 * 5 * 60)
-    return response
+    return conditional.add_validators(response, etag=etag, per_user=True)
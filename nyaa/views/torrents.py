@@ -1,4 +1,4 @@
-import json
+import time
 from ipaddress import ip_address
 from urllib.parse import quote
 
@@ -7,8 +7,8 @@ from werkzeug.datastructures import CombinedMultiDict
 
 from sqlalchemy.orm import joinedload
 
-from nyaa import backend, forms, models, torrents
-from nyaa.extensions import db
+from nyaa import backend, conditional, filelist, forms, info_dicts, models, torrents, utils
+from nyaa.extensions import config, db
 from nyaa.utils import cached_function
 
 app = flask.current_app
@@ -60,20 +60,89 @@ def view_torrent(torrent_id):
                                                 torrent_id=torrent_id,
                                                 _anchor='com-' + str(torrent_count)))
 
+    # Everything shown to anonymous users comes from the torrent, its stats, categories,
+    # comments and the users shown with them, which change without touching the torrent
+    stats = torrent.stats
+    comments = torrent.comments
+    etag = conditional.make_etag(
+        torrent.id, torrent.updated_time,
+        stats and (stats.seed_count, stats.leech_count, stats.download_count),
+        torrent.main_category.name, torrent.sub_category.name,
+        _etag_user(torrent.user),
+        [(comment.id, comment.edited_time, _etag_user(comment.user)) for comment in comments])
+    last_modified = conditional.latest(
+        torrent.updated_time, stats and stats.last_updated,
+        *[comment.edited_time or comment.created_time for comment in comments])
+    not_modified = conditional.not_modified(etag, last_modified, per_user=True)
+    if not_modified:
+        return not_modified
+
     # Only allow owners and admins to edit torrents
     can_edit = flask.g.user and (flask.g.user is torrent.user or flask.g.user.is_moderator)
 
     files = None
+    file_count = 0
     if torrent.filelist:
-        files = json.loads(torrent.filelist.filelist_blob.decode('utf-8'))
+        files = filelist.decode(torrent.filelist.filelist_blob)
+        file_count, _ = filelist.directory_stats(files)
 
     report_form = forms.ReportForm()
-    return flask.render_template('view.html', torrent=torrent,
-                                 files=files,
-                                 comment_form=comment_form,
-                                 comments=torrent.comments,
-                                 can_edit=can_edit,
-                                 report_form=report_form)
+    response = flask.make_response(flask.render_template('view.html', torrent=torrent,
+                                                         files=files,
+                                                         file_count=file_count,
+                                                         comment_form=comment_form,
+                                                         comments=comments,
+                                                         can_edit=can_edit,
+                                                         report_form=report_form))
+    return conditional.add_validators(response, etag, last_modified, per_user=True)
+
+
+@bp.route('/view/<int:torrent_id>/files', endpoint='files', methods=['GET'])
+def view_torrent_files(torrent_id):
+    ''' Lists a directory in the torrent's file tree, a page at a time.
+        The directory is given as path components in repeated `path` arguments,
+        and the next page starts from `cursor`. '''
+    torrent = models.Torrent.query \
+                            .options(joinedload('filelist')) \
+                            .filter_by(id=torrent_id) \
+                            .first()
+    if not torrent or not torrent.filelist:
+        flask.abort(404)
+
+    # Only allow admins see deleted torrents
+    if torrent.deleted and not (flask.g.user and flask.g.user.is_moderator):
+        flask.abort(404)
+
+    path = flask.request.args.getlist('path')
+    cursor = max(flask.request.args.get('cursor', 0, type=int), 0)
+    page_size = app.config.get('FILE_LIST_PAGE_SIZE', 200)
+
+    files = filelist.decode(torrent.filelist.filelist_blob)
+    try:
+        directory = filelist.find(files, path)
+    except KeyError:
+        flask.abort(404)
+    if isinstance(directory, int):
+        flask.abort(404)
+
+    # Fetch one extra entry to know if there's a next page
+    page = filelist.list_directory(directory, cursor, cursor + page_size + 1)
+
+    entries = []
+    for name, value in page[:page_size]:
+        if isinstance(value, int):
+            entries.append({'name': name, 'type': 'file', 'size': value})
+        else:
+            file_count, total_size = filelist.directory_stats(value)
+            entries.append({'name': name, 'type': 'directory', 'size': total_size,
+                            'child_count': len(value), 'file_count': file_count})
+
+    return flask.jsonify({
+        'path': path,
+        'count': len(directory),
+        'entries': entries,
+        'next_cursor': cursor + page_size if len(page) > page_size else None,
+    })
 
 
 @bp.route('/view/<int:torrent_id>/edit', endpoint='edit', methods=['GET', 'POST'])
@@ -318,7 +387,13 @@ def download_torrent(torrent_id):
     if torrent.deleted and not (flask.g.user and flask.g.user.is_moderator):
         flask.abort(404)
 
-    torrent_file, torrent_file_size = _make_torrent_file(torrent)
+    # Answer revalidations before the info dict is read (or opened for streaming)
+    cached = _get_cached_torrent_file(torrent)
+    not_modified = conditional.not_modified(etag=cached.etag, last_modified=cached.last_modified)
+    if not_modified:
+        return not_modified
+
+    torrent_file, torrent_file_size = _make_torrent_file(torrent, cached)
     disposition = 'inline; filename="{0}"; filename*=UTF-8\'\'{0}'.format(
         quote(torrent.torrent_name.encode('utf-8')))
 
@@ -326,7 +401,7 @@ def download_torrent(torrent_id):
     resp.headers['Content-Type'] = 'application/x-bittorrent'
     resp.headers['Content-Disposition'] = disposition
     resp.headers['Content-Length'] = torrent_file_size
-    return resp
+    return conditional.add_validators(resp, cached.etag, cached.last_modified)
 
 
 @bp.route('/view/<int:torrent_id>/comment/<int:comment_id>/edit', methods=['POST'])
@@ -477,10 +552,99 @@ def _create_upload_category_choices():
     return choices
 
 
-def _make_torrent_file(torrent):
-    with open(torrent.info_dict_path, 'rb') as in_file:
-        bencoded_info = in_file.read()
+def _etag_user(user):
+    ''' Returns what the torrent page shows of a user (name, level badge and avatar) '''
+    return user and (user.id, user.username, user.level, user.status, user.email)
+
+
+class _CachedTorrentFile(object):
+    ''' The validators of a torrent file and the bencoded parts before and after its info
+        dict (prefix and suffix), along with the assembled file (data) once it's been read,
+        unless the info dict is big enough to be streamed from storage instead '''
+    __slots__ = ('data', 'prefix', 'suffix', 'etag', 'last_modified', 'expires')
+
+    def __init__(self, data, prefix, suffix, etag, last_modified, expires):
+        self.data = data
+        self.prefix = prefix
+        self.suffix = suffix
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    def __len__(self):
+        if self.data is not None:
+            return len(self.data)
+        return len(self.prefix) + len(self.suffix)
+
+
+# Assembled torrent files only change along with their trackers: the tracker generation
+# (trackers.txt, MAIN_ANNOUNCE_URL) is part of the key, and the torrent's updated_time
+# covers re-uploads. Other processes may change a tracker to/from a webseed, so entries
+# also expire after a while.
+_torrent_file_cache = utils.LRUCache(maxsize=100000,
+                                     max_bytes=config.get('TORRENT_FILE_CACHE_BYTES',
+                                                          64 * 1024 * 1024))
+
+TORRENT_FILE_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _torrent_file_cache_key(torrent):
+    # The comment links to the torrent page on the requested host
+    return (torrent.id, torrent.updated_time, torrents.tracker_generation(),
+            flask.request.host_url)
+
+
+def _get_cached_torrent_file(torrent):
+    ''' Returns the _CachedTorrentFile for torrent. On a cache miss only the validators
+        and the parts around the info dict are made: the info dict isn't read until
+        _make_torrent_file, so revalidations don't touch the storage. '''
+    cache_key = _torrent_file_cache_key(torrent)
+    cached = _torrent_file_cache.get(cache_key)
+    if cached is None or cached.expires < time.monotonic():
+        prefix, suffix = torrents.create_bencoded_torrent_parts(torrent)
+        # The info hash is the hash of the info dict, so this covers the whole file
+        etag = utils.sha1_hash(prefix + torrent.info_hash + suffix).hex()
+        last_modified = conditional.latest(torrent.updated_time)
+        expires = time.monotonic() + app.config.get('TORRENT_FILE_CACHE_TTL', 600)
+
+        cached = _CachedTorrentFile(None, prefix, suffix, etag, last_modified, expires)
+        _torrent_file_cache[cache_key] = cached
+    return cached
+
+
+def _make_torrent_file(torrent, cached=None):
+    ''' Returns the bencoded torrent file for torrent and its size.
+        The file is bytes, or an iterable of them if the info dict is streamed from storage
+        (when it's at least TORRENT_FILE_STREAM_SIZE, decompressed as it's read if need be).
+        Aborts with a 404 if the info dict is missing from the storage. '''
+    if cached is None:
+        cached = _get_cached_torrent_file(torrent)
+    if cached.data is not None:
+        return cached.data, len(cached.data)
+
+    # Open the info dict right away, so any error happens before the response starts
+    try:
+        info_size, info_chunks = info_dicts.get_store().stream(
+            torrent.info_hash, TORRENT_FILE_STREAM_CHUNK_SIZE)
+    except KeyError:
+        app.logger.error('Info dict of torrent %d is missing from the storage', torrent.id)
+        flask.abort(404)
+
+    size = len(cached.prefix) + info_size + len(cached.suffix)
+    torrent_file = _stream_torrent_file(cached.prefix, info_chunks, cached.suffix)
+    if info_size >= app.config.get('TORRENT_FILE_STREAM_SIZE', 1024 * 1024):
+        return torrent_file, size
+
+    data = b''.join(torrent_file)
+    _torrent_file_cache[_torrent_file_cache_key(torrent)] = _CachedTorrentFile(
+        data, None, None, cached.etag, cached.last_modified, cached.expires)
+    return data, size
 
-    bencoded_torrent_data = torrents.create_bencoded_torrent(torrent, bencoded_info)
 
-    return bencoded_torrent_data, len(bencoded_torrent_data)
+def _stream_torrent_file(prefix, info_chunks, suffix):
+    try:
+        yield prefix
+        yield from info_chunks
+        yield suffix
+    finally:
+        info_chunks.close()
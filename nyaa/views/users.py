@@ -12,7 +12,8 @@ from itsdangerous import BadSignature, URLSafeSerializer
 from nyaa import backend, forms, models
 from nyaa.extensions import db
 from nyaa.search import (DEFAULT_MAX_SEARCH_RESULT, DEFAULT_PER_PAGE, SERACH_PAGINATE_DISPLAY_MSG,
-                         _generate_query_string, search_db, search_elastic)
+                         SearchUnavailable, _generate_query_string, elastic_browse_failed,
+                         search_db, search_elastic, use_elastic_browse)
 from nyaa.utils import chain_get, sha1_hash
 
 app = flask.current_app
@@ -154,6 +155,11 @@ def view_user(user_name):
     except (ValueError, TypeError):
         page_number = 1
 
+    # Cursors for keyset pagination (see search_db and search_elastic), used instead of
+    # the page number
+    after = req_args.get('after')
+    before = req_args.get('before')
+
     results_per_page = app.config.get('RESULTS_PER_PAGE', DEFAULT_PER_PAGE)
 
     query_args = {
@@ -165,7 +171,9 @@ def view_user(user_name):
         'quality_filter': quality_filter or '0',
         'page': page_number,
         'rss': False,
-        'per_page': results_per_page
+        'per_page': results_per_page,
+        'after': after,
+        'before': before
     }
 
     if flask.g.user:
@@ -173,32 +181,40 @@ def view_user(user_name):
         if flask.g.user.is_moderator:  # God mode
             query_args['admin'] = True
 
-    # Use elastic search for term searching
+    # Use elastic search for term searching (and browsing, with USE_ELASTIC_BROWSE)
     rss_query_string = _generate_query_string(search_term, category, quality_filter, user_name)
     use_elastic = app.config.get('USE_ELASTIC_SEARCH')
-    if use_elastic and search_term:
-        query_args['term'] = search_term
-
+    query_results = None
+    if use_elastic and (search_term or
+                        use_elastic_browse(query_args['page'], results_per_page)):
         max_search_results = app.config.get('ES_MAX_SEARCH_RESULT', DEFAULT_MAX_SEARCH_RESULT)
 
         # Only allow up to (max_search_results / page) pages
         max_page = min(query_args['page'], int(math.ceil(max_search_results / results_per_page)))
 
-        query_args['page'] = max_page
-        query_args['max_search_results'] = max_search_results
+        es_query_args = dict(query_args, page=max_page, max_search_results=max_search_results)
+        if search_term:
+            es_query_args['facets'] = app.config.get('ENABLE_ELASTIC_SEARCH_FACETS', False)
 
-        query_results = search_elastic(**query_args)
+        try:
+            query_results = search_elastic(**es_query_args)
+        except SearchUnavailable:
+            if search_term:
+                flask.abort(503)
+            # The database can serve browsing just as well, if slower
+            elastic_browse_failed()
 
-        max_results = min(max_search_results, query_results['hits']['total'])
+    if query_results is not None:
+        max_results = min(max_search_results, query_results.total)
         # change p= argument to whatever you change page_parameter to or pagination breaks
-        pagination = Pagination(p=query_args['page'], per_page=results_per_page,
+        pagination = Pagination(p=es_query_args['page'], per_page=results_per_page,
                                 total=max_results, bs_version=3, page_parameter='p',
                                 display_msg=SERACH_PAGINATE_DISPLAY_MSG)
         return flask.render_template('user.html',
                                      use_elastic=True,
                                      pagination=pagination,
                                      torrent_query=query_results,
-                                     search=query_args,
+                                     search=es_query_args,
                                      user=user,
                                      user_page=True,
                                      rss_filter=rss_query_string,
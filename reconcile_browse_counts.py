@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""
+Recounts the torrents per category and flags used for browsing totals
+(see BrowseCountBase in nyaa/models.py). With USE_BROWSE_COUNTS the counts are
+kept up to date as torrents change, but changes made without the ORM are missed,
+so run this periodically (from cron, for example) and once after enabling it.
+"""
+from nyaa import create_app, models
+
+app = create_app('config')
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        for count_class in (models.NyaaBrowseCount, models.SukebeiBrowseCount):
+            changed = count_class.reconcile()
+            print('{0}: fixed {1} counts'.format(count_class.__tablename__, changed))
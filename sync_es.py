@@ -29,11 +29,11 @@ This script will exit on any sort of exception, so you'll want to use your
 supervisor's restart functionality, e.g. Restart=failure in systemd, or
 the poor man's `while true; do sync_es.py; sleep 1; done` in tmux.
 """
-from elasticsearch import Elasticsearch
 from elasticsearch.helpers import bulk, BulkIndexError
 from pymysqlreplication import BinLogStreamReader
 from pymysqlreplication.row_event import UpdateRowsEvent, DeleteRowsEvent, WriteRowsEvent
 from datetime import datetime
+from nyaa import elastic
 from nyaa.models import TorrentFlags
 import sys
 import json
@@ -69,6 +69,8 @@ MYSQL_PW = config.get('mysql_password', 'dunnolol')
 NT_DB = config.get('database', 'nyaav2')
 INTERNAL_QUEUE_DEPTH = config.get('internal_queue_depth', 10000)
 ES_CHUNK_SIZE = config.get('es_chunk_size', 10000)
+# list of "host:port", localhost:9200 by default
+ES_HOSTS = config.get('es_hosts')
 # seconds since no events happening to flush to es. remember this also
 # interacts with es' refresh_interval setting.
 FLUSH_INTERVAL = config.get('flush_interval', 5)
@@ -259,7 +261,7 @@ class EsPoster(ExitingThread):
         self.flush_interval = flush_interval
 
     def run_happy(self):
-        es = Elasticsearch(timeout=30)
+        es = elastic.create_client({'ES_HOSTS': ES_HOSTS}, timeout=30)
 
         last_save = time.time()
         since_last = 0
@@ -0,0 +1,242 @@
+""" Benchmarks for bencode decoding/encoding and torrent upload validation,
+    run over a corpus of synthetic torrents. Use `./dev.py bench` to run. """
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime
+from io import BytesIO
+
+from werkzeug.datastructures import FileStorage
+
+from nyaa import bencode
+
+DEFAULT_OUTPUT = 'bench_results.json'
+UPLOAD_CHUNK_SIZE = 16 * 1024  # Roughly what Werkzeug writes uploads in
+ANNOUNCE_URL = 'http://127.0.0.1:6881/announce'
+
+
+def make_torrent(file_count=1, dir_depth=1, piece_count=None, seed=0, announce=ANNOUNCE_URL):
+    """ Creates a bencoded torrent with file_count files (a single-file torrent if 1),
+        spread over directories dir_depth levels deep. Unless piece_count is given,
+        the piece length is picked like torrent clients do, for at most 2048 pieces.
+        The output is the same for a given seed. """
+    rng = random.Random(seed)
+
+    info = {'name': 'Synthetic torrent {0}'.format(seed).encode('utf-8')}
+
+    if file_count == 1:
+        info['length'] = total_size = rng.randint(1, 4096) * 1024 * 1024
+    else:
+        files = []
+        total_size = 0
+        for i in range(file_count):
+            length = rng.randint(1, 64 * 1024 * 1024)
+            path = [('directory {0}-{1}'.format(level, i % (10 * level + 10))).encode('utf-8')
+                    for level in range(dir_depth - 1)]
+            path.append('[Group] Some Show - {0:05d} (1080p) [{1:08X}].mkv'.format(
+                i, rng.getrandbits(32)).encode('utf-8'))
+            files.append({'length': length, 'path': path})
+            total_size += length
+        info['files'] = files
+
+    if piece_count is None:
+        piece_length = 256 * 1024
+        while total_size > piece_length * 2048:
+            piece_length *= 2
+        piece_count = -(-total_size // piece_length)
+    else:
+        piece_length = max(1, total_size // piece_count)
+    info['piece length'] = piece_length
+    info['pieces'] = rng.getrandbits(piece_count * 20 * 8).to_bytes(piece_count * 20, 'little')
+
+    torrent = {
+        'announce': announce.encode('utf-8'),
+        'announce-list': [[announce.encode('utf-8')], [b'udp://tracker.example.com:1337']],
+        'comment': b'Synthetic benchmark torrent',
+        'created by': b'NyaaV2 bench',
+        'creation date': 1500000000 + seed,
+        'info': info,
+    }
+    return bencode.encode(torrent)
+
+
+# name: kwargs for make_torrent
+CORPUS = OrderedDict([
+    ('single-file', dict(file_count=1)),
+    ('files-10k', dict(file_count=10000, dir_depth=2)),
+    ('files-200k', dict(file_count=200000, dir_depth=3)),
+    ('deep-tree', dict(file_count=2000, dir_depth=64)),
+    ('large-pieces', dict(file_count=1, piece_count=1024 * 1024)),
+])
+
+
+def _upload_validation(data):
+    """ Feeds data through the upload stream in chunks (as received) and validates it
+        with UploadForm.validate_torrent_file. Needs an app context. """
+    from nyaa.extensions import DecodingFileStream
+    from nyaa.forms import UploadForm
+
+    class Field(object):
+        pass
+
+    stream = DecodingFileStream(BytesIO(), capture_keys=('info',))
+    view = memoryview(data)
+    for offset in range(0, len(data), UPLOAD_CHUNK_SIZE):
+        stream.write(view[offset:offset + UPLOAD_CHUNK_SIZE])
+    stream.seek(0)
+
+    field = Field()
+    field.data = FileStorage(stream, filename='bench.torrent')
+    UploadForm.validate_torrent_file(None, field)
+    return field.parsed_data
+
+
+def measure(func, arg, size, repeat):
+    """ Runs func(arg) repeat times, returning the best time and the resulting
+        throughput, then once more under tracemalloc for the peak memory use
+        and the amount of memory blocks held by the result. """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    try:
+        result = func(arg)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    allocated_blocks = sys.getallocatedblocks() - blocks_before
+    del result
+
+    return OrderedDict([
+        ('seconds', best),
+        ('mb_per_sec', size / best / (1024 * 1024) if best else None),
+        ('peak_memory', peak_memory),
+        ('allocated_blocks', allocated_blocks),
+    ])
+
+
+def run_benchmarks(corpus_names, repeat=5, with_upload=True):
+    results = []
+    for name in corpus_names:
+        # Seed by position in the corpus, so entries stay the same when picked alone
+        data = make_torrent(seed=list(CORPUS.keys()).index(name), **CORPUS[name])
+        value = bencode.decode(data)
+
+        benchmarks = [
+            ('decode', bencode.decode, data),
+            ('lazy', bencode.decode_lazy, data),
+            ('encode', bencode.encode, value),
+        ]
+        if with_upload:
+            benchmarks.append(('upload', _upload_validation, data))
+
+        for bench_name, func, arg in benchmarks:
+            result = OrderedDict([('corpus', name), ('benchmark', bench_name),
+                                  ('size', len(data))])
+            result.update(measure(func, arg, len(data), repeat))
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def print_result(result, previous=None):
+    line = '{corpus:>14} {benchmark:>7} {size:>11,d} B {seconds:9.4f} s {mb_per_sec:9.2f} MB/s' \
+        ' {peak_memory:>13,d} B peak {allocated_blocks:>9,d} blocks'.format(**result)
+    if previous:
+        line += ' ({0:+.1%} speed vs previous run)'.format(
+            previous['seconds'] / result['seconds'] - 1)
+    print(line)
+    sys.stdout.flush()
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_runs(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as in_file:
+        return json.load(in_file)
+
+
+def compare_runs(run, previous_run):
+    """ Prints the results of run, with the speed difference to the matching
+        results of previous_run """
+    previous_results = {(r['corpus'], r['benchmark']): r for r in previous_run['results']}
+    print('\nCompared to {0} (revision {1}):'.format(previous_run['timestamp'],
+                                                     previous_run['revision']))
+    for result in run['results']:
+        print_result(result, previous_results.get((result['corpus'], result['benchmark'])))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='dev.py bench',
+                                     description='Run bencode benchmarks on synthetic torrents')
+    parser.add_argument('corpus', nargs='*',
+                        help='Corpus entries to run, out of {0} (default: all)'.format(
+                            ', '.join(CORPUS.keys())))
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Times to run each benchmark, best time is kept (default: 5)')
+    parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT,
+                        help='JSON file to add the results to (default: %(default)s)')
+    parser.add_argument('--no-save', default=False, action='store_true',
+                        help='Don\'t save the results')
+    parser.add_argument('--no-upload', default=False, action='store_true',
+                        help='Skip the upload validation benchmark (which needs config.py)')
+    args = parser.parse_args(args)
+
+    unknown_names = [name for name in args.corpus if name not in CORPUS]
+    if unknown_names:
+        parser.error('unknown corpus entries: ' + ', '.join(unknown_names))
+    corpus_names = args.corpus or list(CORPUS.keys())
+
+    if args.no_upload:
+        results = run_benchmarks(corpus_names, args.repeat, with_upload=False)
+    else:
+        from nyaa import create_app
+        app = create_app('config')
+        # Make sure the synthetic torrents pass the tracker checks
+        app.config['MAIN_ANNOUNCE_URL'] = ANNOUNCE_URL
+        with app.app_context():
+            results = run_benchmarks(corpus_names, args.repeat)
+
+    run = OrderedDict([
+        ('timestamp', datetime.utcnow().isoformat()),
+        ('revision', _git_revision()),
+        ('python', platform.python_version()),
+        ('results', results),
+    ])
+
+    runs = load_runs(args.output)
+    if runs:
+        compare_runs(run, runs[-1])
+
+    if not args.no_save:
+        runs.append(run)
+        with open(args.output, 'w') as out_file:
+            json.dump(runs, out_file, indent=2)
+        print('\nResults saved to', args.output)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+""" Benchmarks offset (LIMIT/OFFSET) against keyset (cursor) pagination by page depth,
+    over a table of synthetic torrents. Use `python -m tests.bench_pagination` to run.
+
+    The table lives in its own database (an in-memory SQLite one by default), as the
+    rows are generated. Give a MySQL URI with --db-uri for numbers closer to production.
+"""
+
+import argparse
+import random
+import sys
+import time
+
+import sqlalchemy
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from nyaa.search import _encode_cursor, _paginate_keyset
+
+PER_PAGE = 75
+DEPTHS = (1, 10, 100, 1000, 5000)
+
+Base = declarative_base()
+
+
+class BenchTorrent(Base):
+    __tablename__ = 'bench_torrents'
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    filesize = sqlalchemy.Column(sqlalchemy.BigInteger, nullable=False, index=True)
+    display_name = sqlalchemy.Column(sqlalchemy.String(255), nullable=False)
+
+
+def populate(session, row_count, seed=0):
+    rng = random.Random(seed)
+    batch = []
+    for torrent_id in range(1, row_count + 1):
+        batch.append({'id': torrent_id,
+                      'filesize': rng.randrange(1024, 64 * 1024 ** 3),
+                      'display_name': 'Torrent {0}'.format(torrent_id)})
+        if len(batch) == 10000:
+            session.execute(BenchTorrent.__table__.insert(), batch)
+            batch = []
+    if batch:
+        session.execute(BenchTorrent.__table__.insert(), batch)
+    session.commit()
+
+
+def _best_time(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_benchmarks(session, sort_column, depths, repeat=5):
+    query = session.query(BenchTorrent)
+    ordered = query.order_by(sort_column.desc(), BenchTorrent.id.desc())
+
+    print('{0:>8} {1:>12} {2:>12}   (sorted by {3}, {4} per page)'.format(
+        'page', 'offset', 'keyset', sort_column.key, PER_PAGE))
+    for page in depths:
+        offset = (page - 1) * PER_PAGE
+        if page == 1:
+            continue_from = None
+        else:
+            # The cursor of the last result of the previous page, as it'd be in the link
+            last = ordered.offset(offset - 1).first()
+            if last is None:
+                break
+            continue_from = _encode_cursor(getattr(last, sort_column.key), last.id)
+
+        offset_time = _best_time(
+            lambda: ordered.limit(PER_PAGE).offset(offset).all(), repeat)
+        if continue_from is None:
+            keyset_time = offset_time
+        else:
+            keyset_time = _best_time(
+                lambda: _paginate_keyset(query, sort_column, BenchTorrent.id, 'desc',
+                                         PER_PAGE, after=continue_from), repeat)
+
+        print('{0:>8,d} {1:>10.2f}ms {2:>10.2f}ms'.format(
+            page, offset_time * 1000, keyset_time * 1000))
+        sys.stdout.flush()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m tests.bench_pagination',
+                                     description='Benchmark offset and keyset pagination')
+    parser.add_argument('--db-uri', default='sqlite://',
+                        help='Database to create the benchmark table in (default: in memory)')
+    parser.add_argument('-n', '--rows', type=int, default=500000,
+                        help='Synthetic torrents to generate (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Times to run each query, best time is kept (default: 5)')
+    args = parser.parse_args(args)
+
+    engine = sqlalchemy.create_engine(args.db_uri)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        print('Generating {0:,d} torrents...'.format(args.rows))
+        populate(session, args.rows)
+
+        for sort_column in (BenchTorrent.id, BenchTorrent.filesize):
+            run_benchmarks(session, sort_column, DEPTHS, args.repeat)
+            print()
+    finally:
+        session.close()
+        Base.metadata.drop_all(engine)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,6 +22,12 @@ class ApiHandlerTests(NyaaTestCase):
         data = json.loads(rv.get_data())
         self.assertDictEqual({'errors': ['Bad authorization']}, data)
 
+    def test_batch_upload_no_authorization(self):
+        """ Test that the batch upload API is locked unless you're logged in """
+        rv = self.app.post('/api/v2/upload/batch')
+        data = json.loads(rv.get_data())
+        self.assertDictEqual({'errors': ['Bad authorization']}, data)
+
     @unittest.skip('Not yet implemented')
     def test_bad_credentials(self):
         """ Test that API is locked unless you're logged in """
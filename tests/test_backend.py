@@ -1,6 +1,8 @@
 import unittest
+from unittest import mock
 
 from nyaa import backend
+from tests import NyaaTestCase
 
 
 class TestBackend(unittest.TestCase):
@@ -16,31 +18,33 @@ class TestBackend(unittest.TestCase):
     #     os.close(self.db)
     #     os.unlink(nyaa.app.config['DATABASE'])
 
-    def test_replace_utf8_values(self):
-        test_dict = {
-            'hash': '2346ad27d7568ba9896f1b7da6b5991251debdf2',
-            'title.utf-8': '¡hola! ¿qué tal?',
-            'filelist.utf-8': [
-                'Español 101.mkv',
-                'ру́сский 202.mp4'
-            ]
-        }
-        expected_dict = {
-            'hash': '2346ad27d7568ba9896f1b7da6b5991251debdf2',
-            'title': '¡hola! ¿qué tal?',
-            'filelist': [
-                'Español 101.mkv',
-                'ру́сский 202.mp4'
-            ]
-        }
-
-        self.assertTrue(backend._replace_utf8_values(test_dict))
-        self.assertDictEqual(test_dict, expected_dict)
-
     @unittest.skip('Not yet implemented')
     def test_handle_torrent_upload(self):
         pass
 
 
+class TestResolveTrackerIds(NyaaTestCase):
+
+    def test_tracker_inserted_concurrently(self):
+        ''' A tracker committed by another upload after our snapshot was taken is skipped
+            by the insert and missed by plain SELECTs, but found by the locking one '''
+        uri = 'http://concurrent.tracker.example/announce'
+        selects = []
+
+        def select_trackers(uris, lock=False):
+            selects.append(lock)
+            return {uri: (42, False)} if lock else {}
+
+        with self.app_context, \
+                mock.patch.object(backend, '_select_trackers', side_effect=select_trackers), \
+                mock.patch.object(backend.db.session, 'execute') as execute:
+            self.assertEqual(backend.resolve_tracker_ids([uri]), [42])
+
+        execute.assert_called_once()
+        self.assertEqual(selects, [False, True])
+        # Inserted in this transaction as far as we know, so not cached yet
+        self.assertIsNone(backend._tracker_cache.get(uri))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,6 @@
+import tracemalloc
 import unittest
+from io import BytesIO
 
 from nyaa import bencode
 
@@ -33,6 +35,8 @@ class TestBencode(unittest.TestCase):
                 r'Unsupported type'),
             (1.6, bencode.BencodeException,
                 r'Unsupported type'),
+            ({1: 2}, bencode.BencodeException,
+                r'Dictionary key is not a bytestring'),
         ]
 
         test_cases = [  # (raw, expected_result)
@@ -50,6 +54,26 @@ class TestBencode(unittest.TestCase):
         for raw, expected_result in test_cases:
             self.assertEqual(bencode.encode(raw), expected_result)
 
+    def test_encode_into(self):
+        value = {'numbers': [1, 2], 'hello': 'world', 'nested': [[[{}]]], 'big': b'x' * 100000}
+        expected = bencode.encode(value)
+
+        # Appending to a bytearray
+        out = bytearray(b'prefix')
+        self.assertEqual(bencode.encode_into(value, out), len(expected))
+        self.assertEqual(bytes(out), b'prefix' + expected)
+
+        # Writing to a file object
+        out = BytesIO()
+        self.assertEqual(bencode.encode_into(value, out), len(expected))
+        self.assertEqual(out.getvalue(), expected)
+
+        # Deep nesting is not bound by the recursion limit
+        deep = []
+        for _ in range(10000):
+            deep = [deep]
+        self.assertEqual(bencode.encode(deep), b'l' * 10001 + b'e' * 10001)
+
     def test_decode(self):
         exception_test_cases = [  # (raw, raised_exception, expected_result_regexp)
             # test malformed bencode
@@ -71,6 +95,10 @@ class TestBencode(unittest.TestCase):
                 r'Unexpected data type'),
             (b'd5:world7:numbersli1ei2eee', bencode.MalformedBencodeException,
                 r'Uneven amount of key/value pairs'),
+            (b'e', bencode.MalformedBencodeException,
+                r'Unexpected data type'),
+            (b'di1ei2ee', bencode.MalformedBencodeException,
+                r'Dictionary key is not a bytestring'),
         ]
 
         test_cases = [  # (raw, expected_result)
@@ -89,6 +117,206 @@ class TestBencode(unittest.TestCase):
         for raw, expected_result in test_cases:
             self.assertEqual(bencode.decode(raw), expected_result)
 
+    def test_decode_positions(self):
+        test_cases = [  # (raw, expected_position)
+            (b'i6-4', 3),
+            (b'li1e4#stringe', 6),
+            (b'l4:hey', 6),
+            (b'li1e$', 5),
+        ]
+
+        for raw, expected_position in test_cases:
+            expected_regexp = r'at position {} '.format(expected_position)
+            self.assertRaisesRegexp(bencode.MalformedBencodeException, expected_regexp,
+                                    bencode.decode, raw)
+
+    def test_decode_buffers(self):
+        raw = b'd5:hello5:world7:numbersli1ei2eee'
+        expected_result = {'hello': b'world', 'numbers': [1, 2]}
+
+        self.assertEqual(bencode.decode(bytearray(raw)), expected_result)
+        self.assertEqual(bencode.decode(memoryview(raw)), expected_result)
+        # Strings are returned as bytes even when slicing a memoryview
+        self.assertIsInstance(bencode.decode(memoryview(raw))['hello'], bytes)
+
+    def test_decode_deep_nesting(self):
+        depth = 100000
+        value = bencode.decode(b'l' * depth + b'e' * depth)
+        for _ in range(depth - 1):
+            value = value[0]
+        self.assertEqual(value, [])
+
+    def test_decoder_feed(self):
+        raw = b'd5:hello5:world7:numbersli1ei-20ee6:pieces20:aaaaaaaaaaaaaaaaaaaae'
+
+        # Feed the data in chunks of varying size, which split tokens
+        for chunk_size in (1, 2, 3, 7, len(raw)):
+            decoder = bencode.BencodeDecoder()
+            for i in range(0, len(raw), chunk_size):
+                decoder.feed(raw[i:i + chunk_size])
+            self.assertTrue(decoder.done)
+            self.assertEqual(decoder.close(), bencode.decode(raw))
+
+        decoder = bencode.BencodeDecoder()
+        decoder.feed(b'd5:hello5:wor')
+        self.assertFalse(decoder.done)
+        self.assertEqual(decoder.depth, 1)
+        self.assertEqual(decoder.position, 8)
+
+    def test_decoder_errors(self):
+        # Errors are raised as soon as the malformed data is fed, with positions in the stream
+        decoder = bencode.BencodeDecoder()
+        decoder.feed(b'li1e')
+        self.assertRaisesRegexp(bencode.MalformedBencodeException,
+                                r'Unexpected data type .* at position 5 ',
+                                decoder.feed, b'$')
+
+        # Incomplete data is only an error once the decoder is closed
+        decoder = bencode.BencodeDecoder()
+        decoder.feed(b'l4:he')
+        self.assertRaisesRegexp(bencode.MalformedBencodeException,
+                                r'Read only \d+ bytes, \d+ wanted',
+                                decoder.close)
+
+    def test_decoder_capture(self):
+        test_cases = [  # (raw, expected_raw, expected_canonical)
+            (b'd8:announce1:a4:infod4:name1:x6:lengthi5eee', b'd4:name1:x6:lengthi5ee', False),
+            (b'd4:infod6:lengthi5e4:name1:xe1:zi1ee', b'd6:lengthi5e4:name1:xe', True),
+            (b'd4:infod6:lengthi05e4:name1:xee', b'd6:lengthi05e4:name1:xe', False),
+            (b'd4:infod6:lengthi5e4:name01:xee', b'd6:lengthi5e4:name01:xe', False),
+            (b'd4:infod4:name1:x4:name1:yee', b'd4:name1:x4:name1:ye', False),
+        ]
+
+        for raw, expected_raw, expected_canonical in test_cases:
+            # Capturing must work across chunks
+            for chunk_size in (1, len(raw)):
+                decoder = bencode.BencodeDecoder(capture_keys=['info'])
+                for i in range(0, len(raw), chunk_size):
+                    decoder.feed(raw[i:i + chunk_size])
+                value = decoder.close()
+
+                captured = decoder.captured['info']
+                self.assertEqual(captured.raw, expected_raw)
+                self.assertEqual(raw[captured.start:captured.end], expected_raw)
+                self.assertEqual(captured.canonical, expected_canonical)
+                # Canonical means re-encoding gives the same bytes
+                self.assertEqual(bencode.encode(value['info']) == expected_raw, expected_canonical)
+
+    def test_decoder_limits(self):
+        exception_test_cases = [  # (raw, limits, expected_result_regexp)
+            (b'l' * 11 + b'e' * 11, dict(max_depth=10), r'Nested deeper than 10 levels'),
+            (b'd1:a' * 11, dict(max_depth=10), r'Nested deeper than 10 levels'),
+            (b'l' + b'i0e' * 10 + b'e', dict(max_elements=10), r'More than 10 values'),
+            (b'l' + b'le' * 10 + b'e', dict(max_elements=10), r'More than 10 values'),
+            (b'11:hello world', dict(max_string_length=10), r'Bytestring longer than 10 bytes'),
+            # Found out from the length alone
+            (b'1000000:', dict(max_string_length=10), r'Bytestring longer than 10 bytes'),
+            (b'l' + b'i0e' * 10 + b'e', dict(max_size=31), r'Data is larger than 31 bytes'),
+        ]
+
+        for raw, limits, expected_result_regexp in exception_test_cases:
+            self.assertRaisesRegexp(bencode.BencodeLimitException, expected_result_regexp,
+                                    bencode.decode, raw, **limits)
+
+            decoder = bencode.BencodeDecoder(**limits)
+            with self.assertRaisesRegexp(bencode.BencodeLimitException, expected_result_regexp):
+                for i in range(len(raw)):
+                    decoder.feed(raw[i:i + 1])
+
+        # Values right at the limits are fine
+        raw = b'l' * 10 + b'e' * 10
+        self.assertEqual(len(bencode.decode(raw, max_depth=10, max_elements=10)), 1)
+        self.assertEqual(bencode.decode(b'10:hello worl', max_string_length=10, max_size=13),
+                         b'hello worl')
+
+    def test_decoder_without_values(self):
+        raw = b'd8:announce1:a4:infod4:name1:x6:lengthi5eee'
+        for chunk_size in (1, len(raw)):
+            decoder = bencode.BencodeDecoder(capture_keys=['info'], keep_values=False)
+            for i in range(0, len(raw), chunk_size):
+                decoder.feed(raw[i:i + chunk_size])
+            self.assertIsNone(decoder.close())
+
+            captured = decoder.captured['info']
+            self.assertIsNone(captured.raw)
+            self.assertEqual(raw[captured.start:captured.end], b'd4:name1:x6:lengthi5ee')
+            self.assertFalse(captured.canonical)  # Unsorted keys
+
+        # The data is still fully checked
+        decoder = bencode.BencodeDecoder(keep_values=False, max_elements=10)
+        self.assertRaisesRegexp(bencode.MalformedBencodeException,
+                                r'Dictionary key is not a bytestring',
+                                decoder.feed, b'dli1eei1ee')
+        decoder = bencode.BencodeDecoder(keep_values=False, max_elements=10)
+        self.assertRaisesRegexp(bencode.BencodeLimitException, r'More than 10 values',
+                                decoder.feed, b'l' + b'i0e' * 11 + b'e')
+
+    def test_decode_lazy(self):
+        raw = b'd4:infod5:filesld6:lengthi5e4:pathl1:aeee4:name4:test6:pieces20:' + \
+            b'a' * 20 + b'e3:onei1ee'
+
+        value = bencode.decode_lazy(raw, view_threshold=20)
+        self.assertIsInstance(value, bencode.LazyDict)
+        self.assertEqual(list(value.keys()), ['info', 'one'])
+
+        info = value['info']
+        self.assertIsInstance(info, bencode.LazyDict)
+        self.assertIsInstance(info['files'], bencode.LazyList)
+        self.assertEqual(info['files'][0]['path'], [b'a'])
+        # Lists and dicts below the threshold are decoded as usual
+        self.assertIsInstance(info['files'][0]['path'], list)
+        self.assertEqual(info['name'], b'test')
+        # Long strings are memoryviews of the data
+        self.assertIsInstance(info['pieces'], memoryview)
+        self.assertEqual(bytes(info['pieces']), b'a' * 20)
+
+        # Raw bytes of lists/dicts are available, and the values encode like regular ones
+        self.assertEqual(info.raw, bencode.encode(bencode.decode(raw)['info']))
+        self.assertEqual(bencode.encode(value), raw)
+        self.assertEqual(value, bencode.decode(raw))
+
+        # Lazy dicts can be modified
+        value['two'] = 2
+        del value['one']
+        self.assertEqual(dict(value)['two'], 2)
+        self.assertNotIn('one', value)
+
+        # Scalars are decoded as usual
+        self.assertEqual(bencode.decode_lazy(b'i5e'), 5)
+
+    def test_decode_lazy_errors(self):
+        exception_test_cases = [  # (raw, expected_result_regexp)
+            (b'd4:infoi5e', r'EOF, expecting kind'),
+            (b'd4:infoe', r'Uneven amount of key/value pairs'),
+            (b'di1ei2ee', r'Dictionary key is not a bytestring'),
+            (b'l4:hey', r'Read only \d+ bytes, \d+ wanted'),
+            (b'li6-4ee', r'Unexpected input while reading an integer'),
+        ]
+
+        for raw, expected_result_regexp in exception_test_cases:
+            self.assertRaisesRegexp(bencode.MalformedBencodeException, expected_result_regexp,
+                                    bencode.decode_lazy, raw)
+
+    def test_decode_lazy_memory(self):
+        # A torrent with 1 MiB of pieces, most of which is never looked at
+        raw = bencode.encode({'announce': b'http://tracker/announce', 'info': {
+            'name': b'test', 'piece length': 262144, 'pieces': b'a' * 1024 * 1024,
+            'files': [{'length': i, 'path': [b'dir', b'file %d' % i]} for i in range(100)]}})
+
+        def peak_memory(decode):
+            tracemalloc.start()
+            try:
+                info = decode(raw)['info']
+                self.assertEqual(len(info['pieces']), 1024 * 1024)
+                self.assertEqual(sum(f['length'] for f in info['files']), 4950)
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        # The pieces are not copied out of the data
+        self.assertLess(peak_memory(bencode.decode_lazy), 256 * 1024)
+        self.assertGreater(peak_memory(bencode.decode), 1024 * 1024)
+
 
 if __name__ == '__main__':
     unittest.main()
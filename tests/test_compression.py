@@ -0,0 +1,65 @@
+import unittest
+
+from nyaa import compression
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_compress(self):
+        data = b'd5:filesl' + b'd6:lengthi1e4:pathl8:file.txtee' * 1000 + b'ee'
+        for method, level in (('zlib', 6), ('lzma', 1)):
+            compressed = compression.compress(data, method, level)
+            self.assertTrue(compression.is_compressed(compressed))
+            self.assertLess(len(compressed), len(data))
+            self.assertEqual(compression.decompress(compressed), data)
+
+        # Uncompressed data is read as-is
+        self.assertFalse(compression.is_compressed(data))
+        self.assertEqual(compression.decompress(data), data)
+
+        with self.assertRaises(ValueError):
+            compression.compress(data, 'gzip', 1)
+
+    def test_compress_by_size(self):
+        levels = [(1024, 'lzma', 1), (0, None, 0), (100, 'zlib', 1)]
+        data = b'a' * 2000
+        self.assertEqual(compression.compress_by_size(data[:50], levels), data[:50])
+        self.assertEqual(compression.decompress(compression.compress_by_size(data[:500], levels)),
+                         data[:500])
+        self.assertEqual(compression.compress_by_size(data[:500], levels)[3], 1)  # zlib
+        self.assertEqual(compression.compress_by_size(data, levels)[3], 2)  # lzma
+        self.assertEqual(compression.compress_by_size(data, None), data)
+
+        # Incompressible data is left as-is
+        data = bytes(range(256))
+        self.assertEqual(compression.compress_by_size(data, levels), data)
+
+    def test_decompress_chunks(self):
+        data = b'd5:filesl' + b'd6:lengthi1e4:pathl8:file.txtee' * 1000 + b'ee'
+        for method, level in (('zlib', 6), ('lzma', 1)):
+            compressed = compression.compress(data, method, level)
+            self.assertEqual(compression.decompressed_size(compressed), len(data))
+            chunks = [compressed[i:i + 5] for i in range(0, len(compressed), 5)]
+            self.assertEqual(b''.join(compression.decompress_chunks(chunks)), data)
+
+        # Uncompressed data is passed through
+        self.assertIsNone(compression.decompressed_size(data))
+        self.assertEqual(b''.join(compression.decompress_chunks([data[:5], data[5:]])), data)
+        self.assertEqual(b''.join(compression.decompress_chunks([])), b'')
+
+        compressed = compression.compress(data, 'zlib', 6)
+        with self.assertRaises(compression.CompressionException):
+            b''.join(compression.decompress_chunks([compressed[:-2]]))
+        with self.assertRaises(compression.CompressionException):
+            b''.join(compression.decompress_chunks([compressed[:8]]))
+
+    def test_decompress_errors(self):
+        compressed = compression.compress(b'd4:name4:teste', 'zlib', 6)
+        for data in (compressed[:8], compressed[:-2], compressed[:3] + b'\x09' + compressed[4:],
+                     compressed[:4] + b'\x05' + compressed[5:]):
+            with self.assertRaises(compression.CompressionException):
+                compression.decompress(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
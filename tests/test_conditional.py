@@ -0,0 +1,59 @@
+import unittest
+from datetime import datetime
+
+import flask
+from werkzeug.http import http_date
+
+from nyaa import conditional
+
+
+class TestConditional(unittest.TestCase):
+
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+        self.app.secret_key = 'test'
+        with self.app.app_context():
+            self.etag = conditional.make_etag(1, datetime(2017, 5, 1))
+        self.last_modified = conditional.latest(datetime(2017, 5, 1, 12, 0, 0, 500))
+
+    def _not_modified(self, headers, per_user=False, user=None):
+        with self.app.test_request_context('/', headers=headers):
+            flask.g.user = user
+            return conditional.not_modified(self.etag, self.last_modified, per_user)
+
+    def test_make_etag(self):
+        with self.app.app_context():
+            self.assertEqual(self.etag, conditional.make_etag(1, datetime(2017, 5, 1)))
+            self.assertNotEqual(self.etag, conditional.make_etag(1, datetime(2017, 5, 2)))
+
+            # Stable across restarts, but not deploys
+            self.app.config['COMMIT_HASH'] = 'abc123'
+            self.assertNotEqual(self.etag, conditional.make_etag(1, datetime(2017, 5, 1)))
+
+    def test_latest(self):
+        self.assertIsNone(conditional.latest(None))
+        self.assertEqual(self.last_modified, datetime(2017, 5, 1, 12, 0, 0))
+        self.assertEqual(conditional.latest(None, datetime(2017, 5, 2, 0, 0, 5, 10),
+                                            datetime(2017, 5, 1)),
+                         datetime(2017, 5, 2, 0, 0, 5))
+
+    def test_not_modified(self):
+        self.assertIsNone(self._not_modified({}))
+        self.assertIsNone(self._not_modified({'If-None-Match': '"other"'}))
+
+        response = self._not_modified({'If-None-Match': '"{}"'.format(self.etag)})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], '"{}"'.format(self.etag))
+
+        since = http_date(self.last_modified)
+        self.assertEqual(self._not_modified({'If-Modified-Since': since}).status_code, 304)
+
+    def test_per_user(self):
+        headers = {'If-None-Match': '"{}"'.format(self.etag)}
+        self.assertEqual(self._not_modified(headers, per_user=True).status_code, 304)
+        self.assertIsNone(self._not_modified(headers, per_user=True, user=object()))
+        self.assertEqual(self._not_modified(headers, user=object()).status_code, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from unittest import mock
+
+import flask
+
+from nyaa import elastic
+
+
+class TestElastic(unittest.TestCase):
+
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+        self.app.config.update(ES_HOSTS=['es1:9200', 'es2:9201'], ES_TIMEOUT=10,
+                               ES_REQUEST_BUDGET=5)
+        elastic.init_app(self.app)
+
+    def test_create_client(self):
+        with self.app.app_context():
+            client = elastic.get_client()
+            stats = elastic.get_stats()
+        self.assertIs(client, self.app.extensions['elasticsearch'])
+        # The client shuffles its hosts
+        self.assertEqual(sorted(pool['host'] for pool in stats['pools']),
+                         ['http://es1:9200', 'http://es2:9201'])
+        self.assertEqual(stats['pools'][0]['connections_created'], 0)
+
+    def test_request_timeout(self):
+        with self.app.app_context():
+            # Outside of web requests (in scripts), there's no budget
+            self.assertEqual(elastic.request_timeout(), 10)
+
+        with self.app.test_request_context('/'), mock.patch('time.monotonic') as monotonic:
+            monotonic.return_value = 100.0
+            self.assertEqual(elastic.request_timeout(), 5)
+            monotonic.return_value = 103.0
+            self.assertEqual(elastic.request_timeout(), 2)
+            monotonic.return_value = 105.0
+            with self.assertRaises(elastic.RequestBudgetExceeded):
+                elastic.request_timeout()
+
+        # Each web request has its own budget
+        with self.app.test_request_context('/'):
+            self.assertAlmostEqual(elastic.request_timeout(), 5, places=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+from io import BytesIO
+
+import flask
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from nyaa import bencode
+from nyaa.extensions import DecodingFileStream, TorrentDecodingRequest, UploadBudget
+
+
+class TestDecodingFileStream(unittest.TestCase):
+    raw = b'l' + b'i0e' * 6 + b'e'  # 7 values, 20 bytes
+
+    def test_decode(self):
+        stream = DecodingFileStream(BytesIO(), capture_keys=('info',))
+        stream.write(b'd4:infod4:name1:xee')
+        self.assertEqual(stream.close_decoder().captured['info'].start, 7)
+        self.assertEqual(stream.getvalue(), b'd4:infod4:name1:xee')
+
+        stream = DecodingFileStream(BytesIO())
+        stream.write(b'l$')
+        self.assertRaises(bencode.MalformedBencodeException, stream.close_decoder)
+
+    def test_budget(self):
+        # The files of a request share the budget
+        budget = UploadBudget(size=100, elements=10)
+        DecodingFileStream(BytesIO(), budget=budget).write(self.raw)
+        self.assertEqual(budget.size, 80)
+        self.assertEqual(budget.elements, 3)
+
+        # Going over it refuses the request, without decoding further
+        stream = DecodingFileStream(BytesIO(), budget=budget)
+        with self.assertRaises(RequestEntityTooLarge):
+            stream.write(self.raw)
+        self.assertEqual(stream.decoder.elements, 0)
+
+        budget = UploadBudget(size=30)
+        DecodingFileStream(BytesIO(), budget=budget).write(self.raw)
+        with self.assertRaises(RequestEntityTooLarge):
+            DecodingFileStream(BytesIO(), budget=budget).write(self.raw)
+
+    def test_file_limits(self):
+        # The limits of a single file still only fail that file
+        stream = DecodingFileStream(BytesIO(), decoder_limits={'max_elements': 5},
+                                    budget=UploadBudget(elements=100))
+        stream.write(self.raw)
+        self.assertRaisesRegexp(bencode.BencodeLimitException, r'More than 5 values',
+                                stream.close_decoder)
+
+
+
+class TestTorrentDecodingRequest(unittest.TestCase):
+
+    def test_endpoints(self):
+        app = flask.Flask(__name__)
+        app.request_class = TorrentDecodingRequest
+
+        def view():
+            stream = flask.request.files['torrent'].stream
+            return 'decoded' if isinstance(stream, DecodingFileStream) else 'plain'
+
+        app.add_url_rule('/upload', 'torrents.upload', view, methods=['POST'])
+        app.add_url_rule('/profile', 'users.profile', view, methods=['POST'])
+
+        # Only files sent to the upload endpoints are decoded
+        client = app.test_client()
+        for url, expected_stream in (('/upload', b'decoded'), ('/profile', b'plain')):
+            response = client.post(url, data={'torrent': (BytesIO(b'i5e'), 'a.torrent')})
+            self.assertEqual(response.data, expected_stream)
+
+
+if __name__ == '__main__':
+    unittest.main()
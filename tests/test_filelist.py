@@ -0,0 +1,119 @@
+import json
+import unittest
+from collections import OrderedDict
+
+from nyaa import filelist, utils
+
+
+class TestFilelist(unittest.TestCase):
+
+    def setUp(self):
+        self.file_tree = utils.sorted_pathdict({
+            'Torrent': {
+                'b.txt': 10,
+                'a.txt': 2 ** 40,
+                'dir': {'a.txt': 20, 'nested': {'c.txt': 0}},
+                'empty': {},
+            },
+        })
+
+    def test_roundtrip(self):
+        blob = filelist.encode(self.file_tree)
+        self.assertTrue(filelist.is_encoded(blob))
+
+        root = filelist.decode(blob)
+        self.assertIsInstance(root, filelist.FileListDirectory)
+        self.assertEqual(filelist.to_dict(root), self.file_tree)
+        self.assertEqual(list(root['Torrent'].keys()), ['dir', 'empty', 'a.txt', 'b.txt'])
+        self.assertEqual(len(root['Torrent']), 4)
+        self.assertEqual(root['Torrent']['a.txt'], 2 ** 40)
+        self.assertEqual(root['Torrent']['dir']['nested']['c.txt'], 0)
+        self.assertEqual(len(root['Torrent']['empty']), 0)
+        self.assertEqual(filelist.to_dict(root['Torrent']['dir']),
+                         {'a.txt': 20, 'nested': {'c.txt': 0}})
+        self.assertNotIn('c.txt', root['Torrent'])
+        with self.assertRaises(KeyError):
+            root['Torrent']['missing']
+
+        # Path components are only stored once
+        self.assertEqual(sorted(filelist.iter_names(root)),
+                         ['Torrent', 'a.txt', 'b.txt', 'c.txt', 'dir', 'empty', 'nested'])
+
+    def test_single_file(self):
+        root = filelist.decode(filelist.encode({'Tést': 500}))
+        self.assertEqual(root.items(), [('Tést', 500)])
+
+    def test_column_widths(self):
+        # Sizes take 8 bytes only when needed, and directories stay distinct from files
+        for size in (0, 254, 255, 2 ** 32 - 1, 2 ** 63):
+            file_tree = {'dir': {'file': size}, 'file': size}
+            root = filelist.decode(filelist.encode(file_tree))
+            self.assertEqual(filelist.to_dict(root), file_tree)
+            # Even when the total doesn't fit in the stored stats
+            self.assertEqual(filelist.directory_stats(root), (2, size * 2))
+
+        file_tree = {'dir': {'file {}'.format(i): i for i in range(300)}}
+        self.assertEqual(filelist.to_dict(filelist.decode(filelist.encode(file_tree))),
+                         file_tree)
+
+    def test_json_blob(self):
+        blob = json.dumps(self.file_tree, separators=(',', ':')).encode('utf-8')
+        self.assertFalse(filelist.is_encoded(blob))
+
+        root = filelist.decode(blob)
+        self.assertIsInstance(root, OrderedDict)
+        self.assertEqual(root, self.file_tree)
+        self.assertEqual(list(root['Torrent'].keys()), ['dir', 'empty', 'a.txt', 'b.txt'])
+        self.assertEqual(sorted(filelist.iter_names(root)),
+                         ['Torrent', 'a.txt', 'a.txt', 'b.txt', 'c.txt', 'dir', 'empty',
+                          'nested'])
+
+    def test_browse(self):
+        blobs = [filelist.encode(self.file_tree),
+                 json.dumps(self.file_tree, separators=(',', ':')).encode('utf-8')]
+        for blob in blobs:
+            root = filelist.decode(blob)
+
+            self.assertEqual(filelist.directory_stats(root), (4, 2 ** 40 + 30))
+            directory = filelist.find(root, ['Torrent', 'dir'])
+            self.assertEqual(filelist.directory_stats(directory), (2, 20))
+            self.assertEqual(filelist.find(root, ['Torrent', 'dir', 'a.txt']), 20)
+            self.assertEqual(filelist.directory_stats(filelist.find(root, ['Torrent', 'empty'])),
+                             (0, 0))
+            for path in (['Torrent', 'missing'], ['Torrent', 'b.txt', 'c.txt']):
+                with self.assertRaises(KeyError):
+                    filelist.find(root, path)
+
+            directory = filelist.find(root, ['Torrent'])
+            self.assertEqual([name for name, _ in filelist.list_directory(directory, 1, 3)],
+                             ['empty', 'a.txt'])
+            self.assertEqual(filelist.list_directory(directory, 3), [('b.txt', 10)])
+            self.assertEqual(filelist.list_directory(directory, 5, 10), [])
+
+    def test_version_1(self):
+        # {'d': {'f': 5}, 'g': 7}, without the directory stats of later versions
+        blob = (b'NFL\x01\x04\x00\x00\x00\x04\x00\x00\x00\x01\x01\x01\xff\xff\x07\x05'
+                b'\x00\x00\x00\x01\x00\x01\x02\x03\x00\x00\x01\x02\x03dgf')
+        self.assertEqual(filelist.format_version(blob), 1)
+        self.assertEqual(filelist.format_version(filelist.encode({'g': 7})),
+                         filelist.FORMAT_VERSION)
+        self.assertIsNone(filelist.format_version(b'{}'))
+
+        root = filelist.decode(blob)
+        self.assertEqual(filelist.to_dict(root), {'d': {'f': 5}, 'g': 7})
+        self.assertEqual(filelist.directory_stats(root), (2, 12))
+        self.assertEqual(filelist.directory_stats(root['d']), (1, 5))
+
+    def test_errors(self):
+        blob = filelist.encode(self.file_tree)
+
+        with self.assertRaises(filelist.FileListException):
+            filelist.FileList(blob[:40])
+        with self.assertRaises(filelist.FileListException):
+            filelist.FileList(blob[:3] + b'\xff' + blob[4:])
+        with self.assertRaises(filelist.FileListException):
+            filelist.encode({'a': -1})
+
+
+if __name__ == '__main__':
+    unittest.main()
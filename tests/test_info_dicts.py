@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nyaa import info_dicts
+
+
+def _info_hash(i):
+    return i.to_bytes(20, 'big')
+
+
+class TestInfoDicts(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _check_store(self, store):
+        info_hash = _info_hash(1)
+        self.assertNotIn(info_hash, store)
+        with self.assertRaises(KeyError):
+            store.get(info_hash)
+
+        store.put(info_hash, b'd4:name4:teste')
+        store.put(_info_hash(2), b'd4:name5:othere')
+        self.assertEqual(store.get(info_hash), b'd4:name4:teste')
+        self.assertIn(info_hash, store)
+
+        path, offset, length = store.locate(info_hash)
+        with open(path, 'rb') as in_file:
+            in_file.seek(offset)
+            self.assertEqual(in_file.read(length), b'd4:name4:teste')
+
+        size, chunks = store.stream(info_hash, chunk_size=4)
+        self.assertEqual(size, 14)
+        self.assertEqual(list(chunks), [b'd4:n', b'ame4', b':tes', b'te'])
+        with self.assertRaises(KeyError):
+            store.stream(_info_hash(3))
+
+        store.put(info_hash, b'd4:name7:replacee')
+        self.assertEqual(store.get(info_hash), b'd4:name7:replacee')
+        self.assertEqual(sorted(store), [_info_hash(1), _info_hash(2)])
+
+        store.delete(info_hash)
+        store.delete(info_hash)
+        self.assertNotIn(info_hash, store)
+        with self.assertRaises(KeyError):
+            store.get(info_hash)
+        self.assertEqual(list(store), [_info_hash(2)])
+
+    def test_filesystem_store(self):
+        store = info_dicts.FilesystemStore(self.folder)
+        self._check_store(store)
+        self.assertTrue(os.path.exists(os.path.join(self.folder, '00', '00', '00' * 19 + '02')))
+
+    def test_pack_store(self):
+        self._check_store(info_dicts.PackStore(self.folder))
+
+    def test_pack_store_index(self):
+        # A small journal and segments, to go through index merges and several segments
+        store = info_dicts.PackStore(self.folder, segment_size=100, journal_size=3)
+        other_store = info_dicts.PackStore(self.folder)
+
+        for i in range(20):
+            store.put(_info_hash(i), 'd1:ii{}ee'.format(i).encode('ascii'))
+        store.delete(_info_hash(5))
+
+        self.assertGreater(len(os.listdir(self.folder)), 5)
+        for store_ in (store, other_store):
+            self.assertEqual(sorted(store_), [_info_hash(i) for i in range(20) if i != 5])
+            self.assertEqual(store_.get(_info_hash(13)), b'd1:ii13ee')
+            self.assertNotIn(_info_hash(5), store_)
+
+        # Changes by other instances (processes) are picked up
+        other_store.put(_info_hash(13), b'd1:ii-13ee')
+        self.assertEqual(store.get(_info_hash(13)), b'd1:ii-13ee')
+
+    def test_pack_store_compact(self):
+        store = info_dicts.PackStore(self.folder, segment_size=100)
+        for i in range(20):
+            store.put(_info_hash(i), 'd1:ii{}ee'.format(i).encode('ascii'))
+        reader = info_dicts.PackStore(self.folder)
+        self.assertEqual(reader.get(_info_hash(0)), b'd1:ii0ee')
+
+        for i in range(15):
+            store.delete(_info_hash(i))
+        segment_count, freed = store.compact()
+        self.assertGreater(segment_count, 0)
+        self.assertGreater(freed, 0)
+        self.assertEqual(store.compact(), (0, 0))
+
+        for store_ in (store, reader):
+            self.assertEqual(sorted(store_), [_info_hash(i) for i in range(15, 20)])
+            for i in range(15, 20):
+                self.assertEqual(store_.get(_info_hash(i)), 'd1:ii{}ee'.format(i).encode('ascii'))
+
+    def test_compressed_store(self):
+        levels = [(100, 'zlib', 6)]
+        store = info_dicts.CompressedStore(info_dicts.FilesystemStore(self.folder), levels)
+        self._check_store(store)
+
+        small, large = b'd4:name4:teste', b'd4:name1000:' + b'a' * 1000 + b'e'
+        store.put(_info_hash(1), small)
+        store.put(_info_hash(2), large)
+        self.assertEqual(store.store.get(_info_hash(1)), small)
+        self.assertLess(len(store.store.get(_info_hash(2))), 100)
+        self.assertEqual(store.get(_info_hash(2)), large)
+
+        # Compressed info dicts can't be served straight from the file, but can be streamed
+        self.assertIsNotNone(store.locate(_info_hash(1)))
+        self.assertIsNone(store.locate(_info_hash(2)))
+        store = info_dicts.CompressedStore(info_dicts.FilesystemStore(self.folder), levels)
+        size, chunks = store.stream(_info_hash(2), chunk_size=10)
+        self.assertEqual(size, len(large))
+        self.assertEqual(b''.join(chunks), large)
+
+        # Reading works the same without compression enabled
+        store = info_dicts.CompressedStore(info_dicts.FilesystemStore(self.folder), None)
+        self.assertEqual(store.get(_info_hash(2)), large)
+
+    def test_create_store(self):
+        config = {'BASE_DIR': self.folder}
+        self.assertIsInstance(info_dicts.create_store(config), info_dicts.FilesystemStore)
+        config['INFO_DICT_STORAGE'] = 'pack'
+        self.assertIsInstance(info_dicts.create_store(config), info_dicts.PackStore)
+        config['STORAGE_COMPRESSION'] = [(0, 'zlib', 6)]
+        store = info_dicts.create_store(config)
+        self.assertIsInstance(store, info_dicts.CompressedStore)
+        self.assertIsInstance(store.store, info_dicts.PackStore)
+        config['STORAGE_COMPRESSION'] = None
+        config['INFO_DICT_STORAGE'] = 'unknown'
+        with self.assertRaises(ValueError):
+            info_dicts.create_store(config)
+
+
+if __name__ == '__main__':
+    unittest.main()
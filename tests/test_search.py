@@ -0,0 +1,97 @@
+import unittest
+from unittest import mock
+
+import flask
+from elasticsearch.exceptions import ConnectionError, ElasticsearchException, TransportError
+from elasticsearch_dsl import Q, Search
+from werkzeug.exceptions import HTTPException
+
+from nyaa import elastic, search
+
+
+class TestSearchFacets(unittest.TestCase):
+
+    def test_facet_aggs_with_category(self):
+        # Anime - English-translated selected, along with "Only trusted"
+        category_filters = [Q('term', main_category_id=1), Q('term', sub_category_id=2)]
+        quality_filters = [Q('term', trusted=True)]
+        s = Search()
+        search._add_facet_aggs(s, category_filters, quality_filters)
+        aggs = s.to_dict()['aggs']
+
+        # Categories are counted among trusted torrents, qualities within the category
+        self.assertEqual(aggs['categories']['filter'],
+                         {'bool': {'filter': [{'term': {'trusted': True}}]}})
+        self.assertEqual(aggs['quality']['filter'],
+                         {'bool': {'filter': [{'term': {'main_category_id': 1}},
+                                              {'term': {'sub_category_id': 2}}]}})
+        self.assertEqual(sorted(aggs['quality']['aggs']['filters']['filters']['filters']),
+                         ['1', '2', '3'])
+
+    def test_facet_counts(self):
+        aggregations = {
+            'categories': {'doc_count': 12, 'main_categories': {'buckets': [
+                {'key': '3', 'doc_count': 2, 'sub_categories': {'buckets': [
+                    {'key': '1', 'doc_count': 2}]}},
+                {'key': '1', 'doc_count': 10, 'sub_categories': {'buckets': [
+                    {'key': '3', 'doc_count': 4}, {'key': '2', 'doc_count': 6}]}},
+            ]}},
+            'quality': {'doc_count': 6, 'filters': {'buckets': {
+                '1': {'doc_count': 5}, '2': {'doc_count': 6}, '3': {'doc_count': 1}}}},
+        }
+        self.assertEqual(search._facet_counts(aggregations), {
+            'categories': [('1_0', 10, [('1_2', 6), ('1_3', 4)]), ('3_0', 2, [('3_1', 2)])],
+            'quality': {'1': 5, '2': 6, '3': 1},
+        })
+
+
+class TestSearchDb(unittest.TestCase):
+
+    def test_order(self):
+        app = flask.Flask(__name__)
+        with app.test_request_context('/'):
+            with self.assertRaises(HTTPException) as context:
+                search.search_db(order='sideways')
+            self.assertEqual(context.exception.code, 400)
+
+    def test_keyset_order(self):
+        # Callers pass the order normalized, anything else would page in the wrong direction
+        query = mock.Mock()
+        cursor = search._encode_cursor(10, 10)
+        with self.assertRaises(ValueError):
+            search._paginate_keyset(query, mock.Mock(), mock.Mock(), 'DESC', 75, after=cursor)
+        self.assertFalse(query.filter.called)
+
+
+class TestSearchElastic(unittest.TestCase):
+
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+        self.app.config.update(ES_HOSTS=['es:9200'], ES_INDEX_NAME='nyaa_torrents',
+                               USE_ELASTIC_SEARCH=True, USE_ELASTIC_BROWSE=True,
+                               ES_MAX_SEARCH_RESULT=1000)
+        elastic.init_app(self.app)
+
+    def test_unavailable(self):
+        errors = [
+            ConnectionError('N/A', 'Connection refused', None),
+            TransportError(500, 'search_phase_execution_exception',
+                           {'error': {'root_cause': [{'reason': 'all shards failed'}]}}),
+            ElasticsearchException('Unexpected response'),
+        ]
+        with self.app.test_request_context('/'):
+            for error in errors:
+                with mock.patch.object(Search, 'execute', side_effect=error):
+                    with self.assertRaises(search.SearchUnavailable):
+                        search.search_elastic()
+
+    def test_browse_pages(self):
+        with self.app.app_context():
+            # Only the pages Elasticsearch can serve by number are browsed from it
+            self.assertTrue(search.use_elastic_browse(page=1, per_page=75))
+            self.assertTrue(search.use_elastic_browse(page=14, per_page=75))
+            self.assertFalse(search.use_elastic_browse(page=15, per_page=75))
+
+
+if __name__ == '__main__':
+    unittest.main()
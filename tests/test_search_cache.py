@@ -0,0 +1,95 @@
+import time
+import unittest
+
+import flask
+
+from nyaa import search_cache
+
+
+class FakeUser(object):
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class TestSearchCache(unittest.TestCase):
+
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+        self.app.config['SEARCH_CACHE'] = 'local-memcached'
+        search_cache._cache = None
+        search_cache.stats.clear()
+
+    def tearDown(self):
+        search_cache._cache = None
+
+    def test_memory_cache(self):
+        cache = search_cache.MemoryCache(maxsize=2)
+        cache.set('a', b'1', 60)
+        cache.set('b', b'2', 60)
+        self.assertEqual(cache.get('a'), b'1')
+        cache.set('c', b'3', 60)
+        self.assertIsNone(cache.get('b'))  # Least recently used
+
+        cache.set('d', b'4', -1)
+        self.assertIsNone(cache.get('d'))
+
+        cache = search_cache.MemoryCache(max_bytes=10)
+        cache.set('a', b'123456', 60)
+        cache.set('b', b'123456', 60)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), b'123456')
+
+    def test_key_value_cache(self):
+        client = search_cache.LocalKeyValueClient()
+        cache = search_cache.KeyValueCache(client)
+        cache.set('some key', b'value', 60)
+        self.assertEqual(cache.get('some key'), b'value')
+        self.assertIsNone(cache.get('other key'))
+        self.assertTrue(all(' ' not in key for key in client._items))
+
+        client.set('expired', b'value', expire=1)
+        client._items['expired'] = (b'value', time.monotonic() - 1)
+        self.assertIsNone(client.get('expired'))
+
+    def test_make_key(self):
+        user = FakeUser(5)
+        key = search_cache.make_key('db', {'term': ' some  term ', 'sort': 'ID', 'user': None,
+                                           'rss': False, 'logged_in_user': user})
+        self.assertEqual(key, search_cache.make_key(
+            'db', {'term': 'some term', 'sort': 'id', 'user': None, 'rss': False,
+                   'logged_in_user': user}))
+
+        # Logged in users see their own hidden torrents, except on RSS and others' pages
+        public = search_cache.make_key('db', {'user': None, 'rss': True, 'logged_in_user': user})
+        self.assertEqual(public, search_cache.make_key('db', {'user': None, 'rss': True}))
+        self.assertEqual(search_cache.visibility_class(user=7, logged_in_user=user), 'public')
+        self.assertEqual(search_cache.visibility_class(user=5, logged_in_user=user), 'user:5')
+        self.assertEqual(search_cache.visibility_class(logged_in_user=user), 'user:5')
+        self.assertEqual(search_cache.visibility_class(admin=True, logged_in_user=user),
+                         'admin')
+
+    def test_cached(self):
+        calls = []
+
+        @search_cache.cached('test', dump=lambda result: result['ids'],
+                             load=lambda value: {'ids': value, 'cached': True})
+        def search(term='', page=1):
+            calls.append((term, page))
+            return {'ids': [1, 2, 3]}
+
+        with self.app.app_context():
+            self.assertEqual(search(term='a'), {'ids': [1, 2, 3]})
+            self.assertEqual(search('a', page=1), {'ids': [1, 2, 3], 'cached': True})
+            search(term='a', page=2)
+            self.assertEqual(calls, [('a', 1), ('a', 2)])
+            self.assertEqual(search_cache.stats['test.hit'], 1)
+            self.assertEqual(search_cache.stats['test.miss'], 2)
+
+            self.app.config['SEARCH_CACHE'] = None
+            search_cache._cache = None
+            search(term='a')
+            self.assertEqual(len(calls), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,9 @@
 import unittest
 import datetime
 
-from email.utils import formatdate
-
 from tests import NyaaTestCase
-from nyaa.template_utils import (_jinja2_filter_rfc822, _jinja2_filter_rfc822_es, get_utc_timestamp,
-                                 get_display_time, timesince, filter_truthy, category_name)
+from nyaa.template_utils import (_jinja2_filter_rfc822, timesince, filter_truthy,
+                                 category_name)
 
 
 class TestTemplateUtils(NyaaTestCase):
@@ -26,23 +24,6 @@ class TestTemplateUtils(NyaaTestCase):
         test_date = datetime.datetime(2017, 2, 15, 11, 15, 34, 100, datetime.timezone.utc)
         self.assertEqual(_jinja2_filter_rfc822(test_date), 'Wed, 15 Feb 2017 11:15:34 -0000')
 
-    def test_filter_rfc822_es(self):
-        # test with local timezone
-        test_date_str = '2017-02-15T11:15:34'
-        # this is in order to get around local time zone issues
-        expected = formatdate(float(datetime.datetime(2017, 2, 15, 11, 15, 34, 100).timestamp()))
-        self.assertEqual(_jinja2_filter_rfc822_es(test_date_str), expected)
-
-    def test_get_utc_timestamp(self):
-        # test with local timezone
-        test_date_str = '2017-02-15T11:15:34'
-        self.assertEqual(get_utc_timestamp(test_date_str), 1487157334)
-
-    def test_get_display_time(self):
-        # test with local timezone
-        test_date_str = '2017-02-15T11:15:34'
-        self.assertEqual(get_display_time(test_date_str), '2017-02-15 11:15')
-
     def test_timesince(self):
         now = datetime.datetime.utcnow()
         self.assertEqual(timesince(now), 'just now')
@@ -0,0 +1,154 @@
+import unittest
+
+from nyaa import bencode, torrents
+
+
+def _make_torrent_dict(info=None, **kwargs):
+    torrent_dict = {
+        'announce': b'http://tracker.example.com/announce',
+        'info': {
+            'name': b'Test Torrent',
+            'piece length': 262144,
+            'pieces': b'a' * 40,
+            'length': 500,
+        },
+    }
+    torrent_dict['info'].update(info or {})
+    torrent_dict.update(kwargs)
+    return torrent_dict
+
+
+class TestTorrents(unittest.TestCase):
+
+    def test_parse_single_file(self):
+        torrent_dict = _make_torrent_dict(**{
+            'announce-list': [[b'http://tracker.example.com/announce'], [b'udp://other:1337']],
+            'url-list': b'http://webseed.example.com/',
+        })
+        torrent_data = torrents.parse_torrent_metadata(torrent_dict,
+                                                       'http://TRACKER.example.com/announce')
+
+        self.assertIs(torrent_data.torrent_dict, torrent_dict)
+        self.assertEqual(torrent_data.name, 'Test Torrent')
+        self.assertEqual(torrent_data.encoding, 'utf-8')
+        self.assertEqual(torrent_data.filesize, 500)
+        self.assertEqual(torrent_data.file_tree, {'Test Torrent': 500})
+        self.assertEqual(list(torrent_data.trackers), ['http://tracker.example.com/announce',
+                                                       'udp://other:1337'])
+        self.assertEqual(list(torrent_data.webseeds), ['http://webseed.example.com/'])
+        self.assertTrue(torrent_data.tracker_found)
+        self.assertFalse(torrent_data.private)
+        self.assertFalse(torrent_data.has_forbidden_filenames)
+
+        torrent_data = torrents.parse_torrent_metadata(torrent_dict, 'http://elsewhere/announce')
+        self.assertFalse(torrent_data.tracker_found)
+
+    def test_parse_multi_file(self):
+        torrent_dict = _make_torrent_dict(info={
+            'files': [
+                {'length': 10, 'path': [b'b.txt']},
+                {'length': 20, 'path': [b'dir', b'a.txt']},
+                {'length': 0, 'path': [b'empty', b'']},  # BitComet directory
+            ],
+            'private': 1,
+        }, encoding=b'UTF-8')
+        del torrent_dict['info']['length']
+
+        torrent_data = torrents.parse_torrent_metadata(torrent_dict)
+        self.assertEqual(torrent_data.encoding, 'UTF-8')
+        self.assertEqual(torrent_data.filesize, 30)
+        self.assertEqual(torrent_data.file_tree,
+                         {'Test Torrent': {'dir': {'a.txt': 20}, 'empty': {}, 'b.txt': 10}})
+        self.assertEqual(list(torrent_data.file_tree['Test Torrent'].keys()),
+                         ['dir', 'empty', 'b.txt'])
+        self.assertTrue(torrent_data.private)
+
+    def test_parse_utf8_keys(self):
+        torrent_dict = _make_torrent_dict(info={
+            'name': 'Name'.encode('cp1252'),
+            'name.utf-8': 'Náme'.encode('utf-8'),
+            'files': [
+                {'length': 10, 'path': ['Fíle'.encode('cp1252')]},
+                {'length': 10, 'path': [b'x'], 'path.utf-8': ['Fíle 2'.encode('utf-8')]},
+            ],
+        }, encoding=b'cp1252')
+
+        torrent_data = torrents.parse_torrent_metadata(torrent_dict)
+        info_dict = torrent_dict['info']
+        self.assertNotIn('name.utf-8', info_dict)
+        self.assertEqual(info_dict['name'], 'Náme'.encode('utf-8'))
+        self.assertNotIn('path.utf-8', info_dict['files'][1])
+        self.assertEqual(torrent_data.name, 'Náme')
+        self.assertEqual(torrent_data.file_tree, {'Náme': {'Fíle': 10, 'Fíle 2': 10}})
+
+    def test_parse_lazy(self):
+        torrent_dict = _make_torrent_dict(info={
+            'name.utf-8': 'Náme'.encode('utf-8'),
+            'pieces': b'a' * 2000,
+            'files': [{'length': 10, 'path': [b'dir', b'file %d' % i]} for i in range(100)],
+        })
+        del torrent_dict['info']['length']
+        lazy_dict = bencode.decode_lazy(bencode.encode(torrent_dict))
+
+        torrent_data = torrents.parse_torrent_metadata(lazy_dict)
+        self.assertIsInstance(lazy_dict['info']['pieces'], memoryview)
+        self.assertEqual(torrent_data.name, 'Náme')
+        self.assertEqual(torrent_data.filesize, 1000)
+        self.assertEqual(len(torrent_data.file_tree['Náme']['dir']), 100)
+
+    def test_parse_forbidden_filenames(self):
+        torrent_dict = _make_torrent_dict(info={
+            'files': [{'length': 10, 'path': ['bad\u202edir'.encode('utf-8'), b'file']}],
+        })
+        torrent_data = torrents.parse_torrent_metadata(torrent_dict)
+        self.assertTrue(torrent_data.has_forbidden_filenames)
+
+    def test_parse_errors(self):
+        exception_test_cases = [  # (torrent_dict, expected_part, expected_message)
+            ([], 'metadata', 'torrent metadata is not a dict'),
+            ({}, 'metadata', 'no info_dict in torrent'),
+            (_make_torrent_dict(info={'name': b''}), 'metadata', 'name is empty'),
+            (_make_torrent_dict(info={'name': b'\xff'}), 'metadata',
+                "name could not be decoded from 'utf-8'"),
+            (_make_torrent_dict(info={'pieces': b'a' * 30}), 'metadata',
+                'pieces length is not a multiple of 20'),
+            (_make_torrent_dict(info={'files': [{'length': -1, 'path': [b'a']}]}), 'metadata',
+                'file length is less than 0'),
+            (_make_torrent_dict(info={'files': [{'length': 1, 'path': []}]}), 'metadata',
+                'path is empty'),
+            (_make_torrent_dict(info={'files': [{'length': 1, 'path': [b'a']},
+                                                {'length': 1, 'path': [b'a', b'b']}]}),
+                'metadata', 'path part is also a filename'),
+            (_make_torrent_dict(**{'url-list': [5]}), 'metadata', 'url-list item is not bytes'),
+            (_make_torrent_dict(announce=None), 'trackers', 'no tracker in torrent'),
+            (_make_torrent_dict(**{'announce-list': [[]]}), 'trackers',
+                'announce-list item is empty'),
+        ]
+
+        for torrent_dict, expected_part, expected_message in exception_test_cases:
+            with self.assertRaises(torrents.MalformedTorrentException) as context:
+                torrents.parse_torrent_metadata(torrent_dict)
+            self.assertEqual(context.exception.part, expected_part)
+            self.assertEqual(str(context.exception), expected_message)
+
+    def test_create_bencoded_torrent(self):
+        class Torrent(object):
+            encoding = 'utf-8'
+
+        metadata_base = {
+            'announce': 'http://tracker.example.com/announce',
+            'comment': 'http://example.com/view/1',
+            'url-list': ['http://webseed.example.com/'],
+        }
+        info_dict = {'name': b'Test', 'length': 5}
+        expected = bencode.encode(dict(metadata_base, encoding='utf-8', info=info_dict))
+
+        prefix, suffix = torrents.create_bencoded_torrent_parts(Torrent(), dict(metadata_base))
+        self.assertEqual(prefix + bencode.encode(info_dict) + suffix, expected)
+        self.assertEqual(torrents.create_bencoded_torrent(Torrent(), bencode.encode(info_dict),
+                                                          dict(metadata_base)),
+                         expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -110,6 +110,43 @@ class TestUtils(unittest.TestCase):
         }
         self.assertDictEqual(utils.flatten_dict(initial), expected)
 
+    def test_lru_cache(self):
+        cache = utils.LRUCache(maxsize=3)
+        for key in 'abc':
+            cache[key] = key.upper()
+        self.assertEqual(len(cache), 3)
+
+        # Using 'a' makes 'b' the least recently used item
+        self.assertEqual(cache.get('a'), 'A')
+        cache['d'] = 'D'
+        self.assertNotIn('b', cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get(key) for key in 'acd'], ['A', 'C', 'D'])
+
+        # Setting an existing key updates it without growing the cache
+        cache['c'] = 'CC'
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get('c'), 'CC')
+
+        self.assertEqual(cache.pop('c'), 'CC')
+        self.assertEqual(cache.pop('c', 'missing'), 'missing')
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+        # Bounded by the total length of the values
+        cache = utils.LRUCache(max_bytes=10)
+        cache['a'] = b'aaaa'
+        cache['b'] = b'bbbb'
+        cache['c'] = b'cccc'
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.total_bytes, 8)
+        cache['b'] = b'b'
+        self.assertEqual(cache.total_bytes, 5)
+        cache['d'] = b'd' * 11  # Too big to cache at all
+        self.assertNotIn('d', cache)
+        self.assertEqual(cache.pop('c'), b'cccc')
+        self.assertEqual(cache.total_bytes, 1)
+
 
 if __name__ == '__main__':
     unittest.main()
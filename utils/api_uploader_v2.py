@@ -10,6 +10,7 @@ SUKEBEI_HOST = 'https://sukebei.nyaa.si'
 
 API_BASE = '/api'
 API_UPLOAD = API_BASE + '/upload'
+API_UPLOAD_BATCH = API_BASE + '/v2/upload/batch'
 
 NYAA_CATS = '''1_1 - Anime - AMV
 1_2 - Anime - English
@@ -107,7 +108,8 @@ trusted_group.add_argument('--no-trusted', dest='trusted',
                            action='store_false', help='Do not mark torrent as trusted')
 parser.set_defaults(trusted=True)
 
-tor_group.add_argument('torrent', metavar='TORRENT_FILE', help='The .torrent file to upload')
+tor_group.add_argument('torrent', metavar='TORRENT_FILE', nargs='+',
+                       help='The .torrent file(s) to upload. Several are uploaded in one request')
 
 
 def crude_torrent_check(file_object):
@@ -134,17 +136,24 @@ if __name__ == "__main__":
     debug_host = args.host or os.getenv('NYAA_API_HOST')
     api_host = (debug_host or (args.sukebei and SUKEBEI_HOST or NYAA_HOST)).rstrip('/')
 
-    api_upload_url = api_host + API_UPLOAD
+    batch_upload = len(args.torrent) > 1
+    api_upload_url = api_host + (API_UPLOAD_BATCH if batch_upload else API_UPLOAD)
+
+    if batch_upload and args.name:
+        raise Exception('A display name can only be given when uploading a single torrent.')
 
     if args.description_file:
         # Replace args.description with contents of the file
         with open(args.description_file, 'r') as in_file:
             args.description = in_file.read()
 
-    torrent_file = open(args.torrent, 'rb')
-    # Check if the file even seems like a torrent
-    if not crude_torrent_check(torrent_file):
-        raise Exception("File '{}' doesn't seem to be a torrent file".format(args.torrent))
+    torrent_files = []
+    for torrent_path in args.torrent:
+        torrent_file = open(torrent_path, 'rb')
+        # Check if the file even seems like a torrent
+        if not crude_torrent_check(torrent_file):
+            raise Exception("File '{}' doesn't seem to be a torrent file".format(torrent_path))
+        torrent_files.append(torrent_file)
 
     api_username = args.user or os.getenv('NYAA_API_USERNAME')
     api_password = args.password or os.getenv('NYAA_API_PASSWORD')
@@ -171,13 +180,12 @@ if __name__ == "__main__":
         'torrent_data': json.dumps(data)
     }
 
-    files = {
-        'torrent': torrent_file
-    }
+    files = [('torrent', torrent_file) for torrent_file in torrent_files]
 
     # Go!
     r = requests.post(api_upload_url, auth=auth, data=encoded_data, files=files)
-    torrent_file.close()
+    for torrent_file in torrent_files:
+        torrent_file.close()
 
     if args.raw:
         print(r.text)
@@ -194,7 +202,19 @@ if __name__ == "__main__":
         if errors:
             print('Upload failed', errors)
             exit(1)
-        else:
-            print("[Uploaded] {url} - '{name}'".format(**response))
-            if args.magnet:
-                print(response['magnet'])
+
+        # A batch upload has results for each torrent, in order
+        results = response['results'] if batch_upload else [response]
+        failed = False
+        for torrent_path, result in zip(args.torrent, results):
+            errors = result.get('errors')
+            if errors:
+                print("Upload of '{}' failed".format(torrent_path), errors)
+                failed = True
+            else:
+                print("[Uploaded] {url} - '{name}'".format(**result))
+                if args.magnet:
+                    print(result['magnet'])
+
+        if failed:
+            exit(1)